@@ -1,14 +1,56 @@
 # This file is part of gorm, an object relational mapper for versioned graphs.
 # Copyright (C) 2014 Zachary Spector.
 from collections import defaultdict, deque
-from .graph import (
-    Graph,
-    DiGraph,
-    MultiGraph,
-    MultiDiGraph,
-)
-from .query import QueryEngine
-from .cache import Cache, NodesCache, EdgesCache
+from importlib import import_module
+from itertools import islice
+from weakref import WeakValueDictionary
+import heapq
+from .query import QueryEngine, ReadOnlyError
+from .cache import Cache, NodesCache, EdgesCache, deep_sizeof
+from . import shared
+from .xjson import hint_stats
+
+
+graph_types = ('Graph', 'DiGraph', 'MultiGraph', 'MultiDiGraph')
+
+
+def __getattr__(name):
+    """Import :mod:`gorm.graph`, and therefore networkx, only once
+    somebody wants a graph class
+
+    """
+    if name == 'graph' or name in graph_types:
+        graph = import_module('.graph', __name__)
+        return graph if name == 'graph' else getattr(graph, name)
+    raise AttributeError(
+        "module {} has no attribute {}".format(__name__, name)
+    )
+
+
+def graph_class(type_s):
+    """Return the graph class named ``type_s``, importing it if need be"""
+    return getattr(import_module('.graph', __name__), type_s)
+
+
+def _tagged_stream(order, table, stream):
+    """Private use. Tag each ``(rev, variable, value)`` from a cache's
+    stream with its table, and an order to break ties in revision.
+
+    """
+    for (rev, var, value) in stream:
+        yield (rev, order, table, var, value)
+
+
+def _chunks(iterable, size):
+    """Private use. Iterate over lists of up to ``size`` items from
+    ``iterable``.
+
+    """
+    it = iter(iterable)
+    chunk = list(islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, size))
 
 
 class GraphNameError(KeyError):
@@ -29,19 +71,59 @@ class ORM(object):
             query_engine_class=QueryEngine,
             json_dump=None,
             json_load=None,
-            caching=True
+            caching=True,
+            codec=None,
+            compress_threshold=None,
+            compression='zlib',
+            dedup_threshold=None,
+            readonly=False,
+            immutable=False,
+            vals_maxsize=4096
     ):
         """Make a SQLAlchemy engine if possible, else a sqlite3 connection. In
         either case, begin a transaction.
 
+        ``codec`` says how to encode keys and values in a new
+        database; see :mod:`gorm.codec`. Values whose encodings are
+        at least ``compress_threshold`` long are compressed with
+        ``compression``, which is ``'zlib'`` or ``'lzma'``. Values at
+        least ``dedup_threshold`` long after that are stored only once
+        however many times they occur in history, and the
+        ``vals_maxsize`` of those used most recently are kept decoded.
+
+        With ``readonly``, open an existing database just to read it.
+        Anything that would write to it raises :class:`ReadOnlyError`
+        instead, except setting ``branch`` and ``rev``, which only
+        change for me. Many processes may read a SQLite database at
+        once this way. With ``immutable`` too, SQLite doesn't even
+        lock the file, so nothing may write to it until I'm closed.
+
         """
-        self.db = query_engine_class(dbstring, connect_args, alchemy, json_dump, json_load)
+        self.db = query_engine_class(
+            dbstring, connect_args, alchemy, json_dump, json_load,
+            codec=codec, compress_threshold=compress_threshold,
+            compression=compression, dedup_threshold=dedup_threshold,
+            readonly=readonly, immutable=immutable,
+            vals_maxsize=vals_maxsize
+        )
+        self.readonly = readonly
         self._obranch = None
         self._orev = None
+        # lists and dicts that the present branch and revision have their
+        # own copies of, and so may be changed in place; see
+        # gorm.xjson.CopyOnWrite
+        self._owned = {}
+        # frozen copies of graphs, keyed by graph, then by (branch, rev);
+        # see GormGraph.snapshot
+        self._snapshots = {}
+        self.db.write_listeners.append(self._forget_snapshots)
+        # nodes, edges, and such mappings I've made, so I can hand out the
+        # same ones again while anybody's using them; see gorm.graph._intern
+        self._entities = WeakValueDictionary()
         self.db.initdb()
+        self.caching = caching
         # I will be recursing a lot so just cache all the branch info
         if caching:
-            self.caching = True
             self._global_cache = self.db._global_cache = {}
             for k, v in self.db.global_items():
                 if k == 'branch':
@@ -58,12 +140,7 @@ class ORM(object):
                 self._childbranch[parent].add(branch)
             self.graph = {}
             for (graph, typ) in self.db.graphs_types():
-                self.graph[graph] = {
-                    'Graph': Graph,
-                    'DiGraph': DiGraph,
-                    'MultiGraph': MultiGraph,
-                    'MultiDiGraph': MultiDiGraph
-                }[typ](self, graph)
+                self.graph[graph] = graph_class(typ)(self, graph)
             self._obranch = self.branch
             self._orev = self.rev
             self._active_branches_cache = []
@@ -73,7 +150,7 @@ class ORM(object):
                 (branch, parent, parent_tick) = working = todo.popleft()
                 if branch == 'master':
                     continue
-                if parent in self._branches:
+                if parent == 'master' or parent in self._parentbranch_rev:
                     self._parentbranch_rev[branch] = (parent, parent_tick)
                     self._childbranch[parent].add(branch)
                 else:
@@ -151,6 +228,7 @@ class ORM(object):
             if self.caching:
                 if v not in self._parentbranch_rev:
                     self._parentbranch_rev[v] = (curbranch, currev)
+                    self._childbranch[curbranch].add(v)
                 parrev = self._parentbranch_rev[v][1]
             else:
                 parrev = self.db.parrev(v)
@@ -162,7 +240,8 @@ class ORM(object):
                         rv=parrev
                     )
                 )
-        if self.caching:
+        self._owned.clear()
+        if self.caching or self.readonly:
             self._obranch = v
         else:
             self.db.globl['branch'] = v
@@ -187,28 +266,29 @@ class ORM(object):
             if self.caching:
                 (parent, parent_rev) = self._parentbranch_rev[branch]
             else:
-                (parent, parent_rev) = self.db.parparrev(branch)
+                (parent, parent_rev) = self.db.parparrev(branch).fetchone()
             if v < int(parent_rev):
                 raise ValueError(
                     "The revision number {revn} "
                     "occurs before the start of "
                     "the branch {brnch}".format(revn=v, brnch=branch)
                 )
-        if self.caching:
+        self._owned.clear()
+        if self.caching or self.readonly:
             self._orev = v
         else:
             self.db.globl['rev'] = v
 
     def commit(self):
         """Alias of ``self.db.commit``"""
-        if self.caching:
+        if self.caching and not self.readonly:
             self.db.globl['branch'] = self._obranch
             self.db.globl['rev'] = self._orev
         self.db.commit()
 
     def close(self):
         """Alias of ``self.db.close``"""
-        if self.caching:
+        if self.caching and not self.readonly:
             self.db.globl['branch'] = self._obranch
             self.db.globl['rev'] = self._orev
         self.db.close()
@@ -217,6 +297,15 @@ class ORM(object):
         """Alias of ``self.db.initdb``"""
         self.db.initdb()
 
+    def archive(self, rev):
+        """Alias of ``self.db.archive``
+
+        The caches keep all of history regardless, so only queries on
+        the database notice the difference.
+
+        """
+        self.db.archive(rev)
+
     def _init_graph(self, name, type_s='Graph'):
         if self.db.have_graph(name):
             raise GraphNameError("Already have a graph by that name")
@@ -228,7 +317,7 @@ class ORM(object):
 
         """
         self._init_graph(name, 'Graph')
-        g = Graph(self, name, data, **attr)
+        g = graph_class('Graph')(self, name, data, **attr)
         if self.caching:
             self.graph[name] = g
         return g
@@ -239,7 +328,7 @@ class ORM(object):
 
         """
         self._init_graph(name, 'DiGraph')
-        dg = DiGraph(self, name, data, **attr)
+        dg = graph_class('DiGraph')(self, name, data, **attr)
         if self.caching:
             self.graph[name] = dg
         return dg
@@ -250,7 +339,7 @@ class ORM(object):
 
         """
         self._init_graph(name, 'MultiGraph')
-        mg = MultiGraph(self, name, data, **attr)
+        mg = graph_class('MultiGraph')(self, name, data, **attr)
         if self.caching:
             self.graph[name] = mg
         return mg
@@ -261,7 +350,7 @@ class ORM(object):
 
         """
         self._init_graph(name, 'MultiDiGraph')
-        mdg = MultiDiGraph(self, name, data, **attr)
+        mdg = graph_class('MultiDiGraph')(self, name, data, **attr)
         if self.caching:
             self.graph[name] = mdg
         return mdg
@@ -274,16 +363,10 @@ class ORM(object):
         """
         if self.caching and name in self.graph:
             return self.graph[name]
-        graphtypes = {
-            'Graph': Graph,
-            'DiGraph': DiGraph,
-            'MultiGraph': MultiGraph,
-            'MultiDiGraph': MultiDiGraph
-        }
         type_s = self.db.graph_type(name)
-        if type_s not in graphtypes:
+        if type_s not in graph_types:
             raise GraphNameError("I don't know of a graph named {}".format(name))
-        g = graphtypes[type_s](self, name)
+        g = graph_class(type_s)(self, name)
         if self.caching:
             self.graph[name] = g
         return g
@@ -293,9 +376,59 @@ class ORM(object):
         # make sure the graph exists before deleting anything
         self.get_graph(name)
         self.db.del_graph(name)
+        self._snapshots.pop(name, None)
         if self.caching and name in self.graph:
             del self.graph[name]
 
+    def del_branch(self, name, recursive=True):
+        """Remove all traces of a branch's existence from the database and
+        the caches.
+
+        With ``recursive``, delete the branches descended from it as
+        well. Otherwise, refuse to delete a branch that has children.
+
+        """
+        if name == 'master':
+            raise ValueError("Can't delete the master branch")
+        if not self._havebranch(name):
+            raise ValueError("No such branch: {}".format(name))
+        if self.caching:
+            children = self._childbranch
+        else:
+            children = defaultdict(set)
+            for (branch, parent, parent_rev) in self.db.all_branches():
+                children[parent].add(branch)
+        doomed = [name]
+        for branch in doomed:
+            kids = children.get(branch, set()) - {'master'}
+            if kids and not recursive:
+                raise ValueError(
+                    "Branch {} has children: {}".format(branch, ', '.join(kids))
+                )
+            doomed.extend(kids)
+        if self.branch in doomed:
+            raise ValueError(
+                "Can't delete the branch {}, because I'm in it".format(self.branch)
+            )
+        self.db.del_branches(doomed)
+        for snaps in self._snapshots.values():
+            for (branch, rev) in [k for k in snaps if k[0] in doomed]:
+                del snaps[branch, rev]
+        if self.caching:
+            for branch in doomed:
+                (parent, parent_rev) = self._parentbranch_rev.pop(branch)
+                self._childbranch[parent].discard(branch)
+                if branch in self._childbranch:
+                    del self._childbranch[branch]
+            for cache in (
+                    self._graph_val_cache,
+                    self._node_val_cache,
+                    self._nodes_cache,
+                    self._edge_val_cache,
+                    self._edges_cache
+            ):
+                cache.remove_branches(doomed)
+
     def _active_branches(self, branch=None, rev=None):
         """Private use. Iterate over (branch, rev) pairs, where the branch is
         a descendant of the previous (starting with whatever branch is
@@ -303,8 +436,8 @@ class ORM(object):
         latest revision in the branch that matters.
 
         """
-        b = branch or self.branch
-        r = rev or self.rev
+        b = self.branch if branch is None else branch
+        r = self.rev if rev is None else rev
         if self.caching:
             yield b, r
             while b in self._parentbranch_rev:
@@ -315,6 +448,307 @@ class ORM(object):
         for pair in self.db.active_branches(b, r):
             yield pair
 
+    def _windows(self, branch, rev):
+        """Private use. Return a dict of the revisions of each branch whose
+        history matters as of the branch and revision, as pairs of
+        ``(after, upto)``. ``after`` is ``None`` for all of history.
+
+        """
+        lineage = list(self._active_branches(branch, rev))
+        starts = [r for (b, r) in lineage[1:]] + [None]
+        return {
+            b: (None if start is None else start - 1, r)
+            for ((b, r), start) in zip(lineage, starts)
+        }
+
+    def _history_caches(self):
+        """Private use. Return pairs of the name of each history table
+        and the cache that holds what's in it.
+
+        """
+        return (
+            ('graph_val', self._graph_val_cache),
+            ('nodes', self._nodes_cache),
+            ('node_val', self._node_val_cache),
+            ('edges', self._edges_cache),
+            ('edge_val', self._edge_val_cache)
+        )
+
+    def _value_at(self, table, graph, var, branch, rev):
+        """Private use. Return the value of something about the graph at
+        the branch and revision, as named by ``table`` and ``var`` like
+        in ``QueryEngine.changes``, or ``None`` if it has none.
+
+        Nodes and edges have ``True`` if they exist.
+
+        """
+        if self.caching:
+            cache = dict(self._history_caches())[table]
+            return cache._value_at((graph,) + var, branch, rev)
+        if table == 'nodes':
+            return self.db.node_exists(graph, var[0], branch, rev) or None
+        if table == 'edges':
+            return self.db.edge_exists(graph, *var + (branch, rev)) or None
+        get = {
+            'graph_val': self.db.graph_val_get,
+            'node_val': self.db.node_val_get,
+            'edge_val': self.db.edge_val_get
+        }[table]
+        try:
+            return get(graph, *var + (branch, rev))
+        except KeyError:
+            return None
+
+    def diff(self, graph, a, b):
+        """Return what's different about the graph at ``b`` than at ``a``,
+        each a pair of ``(branch, rev)``.
+
+        The result is a dict of:
+
+        * ``'nodes_added'`` and ``'nodes_removed'``: sets of nodes
+        * ``'edges_added'`` and ``'edges_removed'``: sets of pairs of
+          nodes, or triples of nodes and edge key in multigraphs
+        * ``'graph'``: a dict of changed graph attributes, with
+          ``(old, new)`` values, ``None`` meaning unset
+        * ``'node'`` and ``'edge'``: dicts like ``'graph'`` for each
+          node and edge with changed attributes
+
+        Only what was set in the revisions that one point sees and the
+        other doesn't gets looked at, so this takes time in proportion
+        to how much changed, not to the size of the graph.
+
+        """
+        (wa, wb) = (self._windows(*a), self._windows(*b))
+        spans = []
+        for branch in set(wa) | set(wb):
+            for (mine, theirs) in ((wa, wb), (wb, wa)):
+                if branch not in mine:
+                    continue
+                (lo, hi) = mine[branch]
+                if branch not in theirs:
+                    spans.append((branch, lo, hi))
+                    continue
+                (tlo, thi) = theirs[branch]
+                if tlo is not None and (lo is None or lo < tlo):
+                    spans.append((branch, lo, min(hi, tlo)))
+                if thi < hi:
+                    spans.append((branch, thi if lo is None else max(lo, thi), hi))
+        changed = set()
+        for (branch, lo, hi) in spans:
+            if lo is not None and lo >= hi:
+                continue
+            if self.caching:
+                for (table, cache) in self._history_caches():
+                    changed.update(
+                        (table, var[1:]) for var in
+                        cache.changes(graph, branch, lo, hi)
+                    )
+            else:
+                changed.update(self.db.changes(graph, branch, lo, hi))
+        multi = self.get_graph(graph).is_multigraph()
+        ret = {
+            'nodes_added': set(), 'nodes_removed': set(),
+            'edges_added': set(), 'edges_removed': set(),
+            'graph': {}, 'node': {}, 'edge': {}
+        }
+        for (table, var) in changed:
+            old = self._value_at(table, graph, var, *a)
+            new = self._value_at(table, graph, var, *b)
+            if old == new:
+                continue
+            if table == 'nodes':
+                ret['nodes_added' if new else 'nodes_removed'].add(var[0])
+            elif table == 'edges':
+                ret['edges_added' if new else 'edges_removed'].add(
+                    var if multi else var[:2]
+                )
+            elif table == 'graph_val':
+                ret['graph'][var[0]] = (old, new)
+            elif table == 'node_val':
+                ret['node'].setdefault(var[0], {})[var[1]] = (old, new)
+            else:
+                edge = var[:3] if multi else var[:2]
+                ret['edge'].setdefault(edge, {})[var[3]] = (old, new)
+        return ret
+
+    @property
+    def counting(self):
+        """Whether my caches are counting how they get used; see ``stats``.
+
+        Turning it on starts the counts from zero. It's off unless
+        you turn it on, and costs a check of a flag then.
+
+        """
+        return self.caching and self._node_val_cache.counting
+
+    @counting.setter
+    def counting(self, v):
+        if not self.caching:
+            raise ValueError("Not caching")
+        for (table, cache) in self._history_caches():
+            if cache.counting != v:
+                cache.count(v)
+
+    def stats(self):
+        """Return a dictionary of counts of how things have been looked up.
+
+        ``'caches'`` is ``None`` unless ``counting`` has been on;
+        otherwise it maps the name of each history table to the
+        ``counts`` of the cache that holds what's in it: which way
+        values were found, how many branches were looked in for them,
+        and how far :class:`gorm.cache.WindowDict` had to seek. See
+        :meth:`gorm.cache.Cache.count`.
+
+        ``'json'`` has the hits, misses, and sizes of the memos of
+        the JSON codec, which every ORM in the process shares; see
+        :func:`gorm.xjson.hint_stats`.
+
+        For how much memory the caches take, see ``cache_stats``.
+
+        """
+        caches = None
+        if self.caching and self._node_val_cache.counts is not None:
+            caches = {
+                table: {
+                    'retrieve': dict(cache.counts['retrieve']),
+                    'walked': dict(sorted(cache.counts['walked'].items())),
+                    'seek': dict(sorted(cache.counts['seek'].items()))
+                }
+                for (table, cache) in self._history_caches()
+            }
+        return {'caches': caches, 'json': hint_stats()}
+
+    def share(self, path):
+        """Write everything that's ever happened to the graphs to a file at
+        ``path``, for other processes to read from, all sharing the one
+        copy, with :class:`gorm.shared.Snapshot`
+
+        """
+        shared.build(self.db, path)
+
+    def cache_stats(self):
+        """Return a dictionary describing how much memory the caches take.
+
+        ``'caches'`` maps the name of each history table to the
+        ``stats`` of the cache that holds what's in it: entry counts,
+        approximate sizes in bytes, and histograms of how much
+        history each :class:`gorm.cache.WindowDict` holds, for each
+        structure in the cache and for each graph. ``'bytes'`` is the
+        approximate size of all the caches together.
+
+        """
+        if not self.caching:
+            raise ValueError("Not caching")
+        caches = self._history_caches()
+        return {
+            'caches': {table: cache.stats() for (table, cache) in caches},
+            'bytes': deep_sizeof([
+                getattr(cache, name) for (table, cache) in caches
+                for name in cache.structures
+            ])
+        }
+
+    def changes(self, rev_from, rev_to, branch=None, graph=None,
+                chunk_size=None):
+        """Iterate over ``(graph, entity, key, old, new, rev)`` for every
+        change to a graph seen in the branch after the revision
+        ``rev_from``, up to and including ``rev_to``, oldest first.
+        That includes changes in the branch's ancestors from before it
+        forked.
+
+        ``entity`` is ``None`` for graph attributes, a node for nodes,
+        and a pair of nodes for edges, or a triple of nodes and edge
+        key in multigraphs. ``key`` is ``None`` when the change is to
+        whether the node or edge exists, and then ``old`` and ``new``
+        are booleans. Otherwise ``None`` means unset.
+
+        With ``graph``, only iterate over changes to that graph. With
+        ``chunk_size``, iterate over lists of up to that many changes
+        instead.
+
+        Changes are read as they're needed, so don't write to the
+        branch while you're still iterating.
+
+        """
+        changes = self._changes(
+            rev_from, rev_to, self.branch if branch is None else branch,
+            graph
+        )
+        if chunk_size is None:
+            return changes
+        if chunk_size < 1:
+            raise ValueError("Chunks need at least one change")
+        return _chunks(changes, chunk_size)
+
+    def _changes(self, rev_from, rev_to, branch, graph):
+        windows = self._windows(branch, rev_to)
+        lineage = [b for (b, r) in self._active_branches(branch, rev_to)]
+        # old values come from the most recent branch that existed at rev_from
+        for start in lineage:
+            if windows[start][0] is None or windows[start][0] < rev_from:
+                break
+        multi = {}
+        last = {}
+        for b in reversed(lineage):
+            (after, upto) = windows[b]
+            lo = rev_from if after is None else max(after, rev_from)
+            hi = min(upto, rev_to)
+            if lo >= hi:
+                continue
+            if self.caching:
+                stream = heapq.merge(*[
+                    _tagged_stream(order, table, cache.stream(b, lo, hi))
+                    for (order, (table, cache))
+                    in enumerate(self._history_caches())
+                ])
+            else:
+                stream = (
+                    (rev, None, table, var, value) for (rev, table, var, value)
+                    in self.db.stream(b, lo, hi)
+                )
+            for (rev, order, table, var, new) in stream:
+                g = var[0]
+                if graph is not None and g != graph:
+                    continue
+                if (table, var) in last:
+                    old = last[table, var]
+                else:
+                    old = self._value_at(table, g, var[1:], start, rev_from)
+                if table in ('nodes', 'edges'):
+                    (old, new) = (bool(old), bool(new))
+                last[table, var] = new
+                if old == new:
+                    continue
+                if table == 'graph_val':
+                    yield (g, None, var[1], old, new, rev)
+                elif table == 'nodes':
+                    yield (g, var[1], None, old, new, rev)
+                elif table == 'node_val':
+                    yield (g, var[1], var[2], old, new, rev)
+                else:
+                    if g not in multi:
+                        multi[g] = self.get_graph(g).is_multigraph()
+                    edge = var[1:4] if multi[g] else var[1:3]
+                    yield (
+                        g, edge, var[4] if table == 'edge_val' else None,
+                        old, new, rev
+                    )
+
+    def _forget_snapshots(self, graph, branch, rev):
+        """Private use. Throw away the snapshots of the graph that something
+        set at this branch and revision would change.
+
+        """
+        snaps = self._snapshots.get(graph)
+        if not snaps:
+            return
+        for (b, r) in list(snaps):
+            for (lb, lr) in self._active_branches(b, r):
+                if lb == branch:
+                    if rev <= lr:
+                        del snaps[b, r]
+                    break
+
     def _branch_descendants(self, branch=None):
         """Iterate over all branches immediately descended from the current
         one (or the given one, if available).
@@ -330,4 +764,4 @@ class ORM(object):
                 yield child
 
 
-__all__ = [ORM, 'alchemy', 'graph', 'query', 'window', 'xjson']
+__all__ = [ORM, ReadOnlyError, 'alchemy', 'codec', 'graph', 'query', 'shared', 'window', 'xjson']
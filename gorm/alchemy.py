@@ -9,34 +9,49 @@ from sqlalchemy import (
     Integer,
     Boolean,
     String,
+    LargeBinary,
     DateTime,
     MetaData,
     ForeignKey,
     select,
+    exists,
     func,
     and_,
+    case,
     null
 )
-from sqlalchemy.sql import bindparam
+from sqlalchemy.sql import bindparam, literal_column
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.ddl import CreateTable, CreateIndex
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 from json import dumps
 from functools import partial
+from .codec import text_marker, reference_text_marker
+from .query import where_ops, where_queries
 
 length = 50
 
 TEXT = String(length)
+BLOB = LargeBinary()
 
 
-def tables_for_meta(meta):
+def tables_for_meta(meta, binary=False):
+    """Return the tables gorm uses, keyed by name.
+
+    With ``binary``, the columns holding encoded keys and values are
+    BLOBs, for use with a binary codec.
+
+    """
+    CODED = BLOB if binary else TEXT
     return {
         'global': Table(
             'global', meta,
-            Column('key', TEXT, primary_key=True),
+            Column('key', CODED, primary_key=True),
             Column('date', DateTime, nullable=True),
             Column('creator', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True)
+            Column('value', CODED, nullable=True)
         ),
         'branches': Table(
             'branches', meta,
@@ -52,7 +67,7 @@ def tables_for_meta(meta):
         ),
         'graphs': Table(
             'graphs', meta,
-            Column('graph', TEXT, primary_key=True),
+            Column('graph', CODED, primary_key=True),
             Column('date', DateTime, nullable=True),
             Column('creator', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
@@ -63,22 +78,22 @@ def tables_for_meta(meta):
         ),
         'graph_val': Table(
             'graph_val', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', CODED, ForeignKey('graphs.graph'),
                    primary_key=True),
-            Column('key', TEXT, primary_key=True),
+            Column('key', CODED, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True)
+            Column('value', CODED, nullable=True)
         ),
         'nodes': Table(
             'nodes', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', CODED, ForeignKey('graphs.graph'),
                    primary_key=True),
-            Column('node', TEXT, primary_key=True),
+            Column('node', CODED, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
@@ -89,26 +104,26 @@ def tables_for_meta(meta):
         ),
         'node_val': Table(
             'node_val', meta,
-            Column('graph', TEXT, primary_key=True),
-            Column('node', TEXT, primary_key=True),
-            Column('key', TEXT, primary_key=True),
+            Column('graph', CODED, primary_key=True),
+            Column('node', CODED, primary_key=True),
+            Column('key', CODED, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True),
+            Column('value', CODED, nullable=True),
             ForeignKeyConstraint(
                 ['graph', 'node'], ['nodes.graph', 'nodes.node']
             )
         ),
         'edges': Table(
             'edges', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', CODED, ForeignKey('graphs.graph'),
                    primary_key=True),
-            Column('nodeA', TEXT, primary_key=True),
-            Column('nodeB', TEXT, primary_key=True),
+            Column('nodeA', CODED, primary_key=True),
+            Column('nodeB', CODED, primary_key=True),
             Column('idx', Integer, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
@@ -126,52 +141,178 @@ def tables_for_meta(meta):
         ),
         'edge_val': Table(
             'edge_val', meta,
-            Column('graph', TEXT, primary_key=True),
-            Column('nodeA', TEXT, primary_key=True),
-            Column('nodeB', TEXT, primary_key=True),
+            Column('graph', CODED, primary_key=True),
+            Column('nodeA', CODED, primary_key=True),
+            Column('nodeB', CODED, primary_key=True),
             Column('idx', Integer, primary_key=True),
-            Column('key', TEXT, primary_key=True),
+            Column('key', CODED, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True),
+            Column('value', CODED, nullable=True),
             ForeignKeyConstraint(
                 ['graph', 'nodeA', 'nodeB', 'idx'],
                 ['edges.graph', 'edges.nodeA', 'edges.nodeB', 'edges.idx']
             )
+        ),
+        'vals': Table(
+            'vals', meta,
+            Column('hash', CODED, primary_key=True),
+            Column('value', CODED, nullable=True)
         )
     }
 
 
-def indices_for_table_dict(table):
+class json_value(FunctionElement):
+    """The JSON value stored in a column, as something SQL can compare"""
+    name = 'json_value'
+
+
+@compiles(json_value)
+def compile_json_value(element, compiler, **kw):
+    return "json_extract({}, '$')".format(
+        compiler.process(element.clauses, **kw)
+    )
+
+
+@compiles(json_value, 'postgresql')
+def compile_json_value_postgresql(element, compiler, **kw):
+    return "CAST({} AS JSONB)".format(
+        compiler.process(element.clauses, **kw)
+    )
+
+
+class json_kind_is(FunctionElement):
+    """Whether the JSON value stored in a column is a ``'number'`` or a
+    ``'string'``
+
+    """
+    name = 'json_kind_is'
+    type = Boolean()
+
+    def __init__(self, col, kind):
+        self.kind = kind
+        super(json_kind_is, self).__init__(col)
+
+
+@compiles(json_kind_is)
+def compile_json_kind_is(element, compiler, **kw):
+    col = compiler.process(element.clauses, **kw)
+    if element.kind == 'number':
+        return "(json_type({}, '$') IN ('integer', 'real'))".format(col)
+    return "(json_type({}, '$') = 'text')".format(col)
+
+
+@compiles(json_kind_is, 'postgresql')
+def compile_json_kind_is_postgresql(element, compiler, **kw):
+    return "(jsonb_typeof(CAST({} AS JSONB)) = '{}')".format(
+        compiler.process(element.clauses, **kw), element.kind
+    )
+
+
+def is_json(col):
+    """Return a condition that ``col`` holds JSON and not a compressed
+    value or a reference to one in the ``vals`` table
+
+    """
+    return and_(
+        col.isnot(None),
+        col.notlike(literal_column("'{}%'".format(text_marker))),
+        col.notlike(literal_column("'{}%'".format(reference_text_marker)))
+    )
+
+
+history_tables = ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val')
+"""Tables that keep values over time, and may have old ones archived"""
+
+history_keys = {
+    'graph_val': ('graph', 'key'),
+    'nodes': ('graph', 'node'),
+    'node_val': ('graph', 'node', 'key'),
+    'edges': ('graph', 'nodeA', 'nodeB', 'idx'),
+    'edge_val': ('graph', 'nodeA', 'nodeB', 'idx', 'key')
+}
+"""Columns identifying the variable that each row of a history table
+sets, not counting branch and rev
+
+"""
+
+history_values = {
+    'graph_val': 'value',
+    'nodes': 'extant',
+    'node_val': 'value',
+    'edges': 'extant',
+    'edge_val': 'value'
+}
+"""The column holding what each row of a history table sets the
+variable to
+
+"""
+
+archive_queries = (
+    'graph_val_dump', 'graph_val_items', 'graph_val_get', 'graph_val_ins',
+    'nodes_dump', 'nodes_extant', 'node_exists', 'exist_node_ins',
+    'node_val_dump', 'node_val_items', 'node_val_get', 'node_val_ins',
+    'graph_node_vals', 'graph_val_history', 'node_val_history',
+    'edge_val_history',
+    'edges_dump', 'edges_extant', 'edge_exists', 'nodeAs', 'nodeBs',
+    'multi_edges', 'edge_exist_ins', 'graph_edges', 'graph_edge_vals',
+    'edge_val_dump', 'edge_val_items', 'edge_val_get', 'edge_val_ins',
+    'del_edge_val_graph', 'del_edge_graph', 'del_node_val_graph',
+    'del_node_graph', 'del_edge_val_branches', 'del_edge_branches',
+    'del_node_val_branches', 'del_node_branches', 'del_graph_val_branches'
+) + tuple(where_queries) + tuple(
+    name + suffix for name in history_tables
+    for suffix in ('_changes', '_stream')
+)
+"""Queries that have a variant, prefixed ``archive_``, to run against
+the archive tables instead of the hot ones
+
+"""
+
+
+def archive_tables_for_meta(meta, table):
+    """Return tables just like the history tables, to hold revisions
+    older than the archival watermark.
+
+    """
     return {
+        name: Table(
+            name + '_archive', meta,
+            *[col.copy() for col in table[name].columns]
+        ) for name in history_tables
+    }
+
+
+def indices_for_table_dict(table, suffix=''):
+    r = {
         'graph_val': Index(
-            "graph_val_idx",
+            "graph_val_idx" + suffix,
             table['graph_val'].c.graph,
             table['graph_val'].c.key
         ),
         'nodes': Index(
-            "nodes_idx",
+            "nodes_idx" + suffix,
             table['nodes'].c.graph,
             table['nodes'].c.node
         ),
         'node_val': Index(
-            "node_val_idx",
+            "node_val_idx" + suffix,
             table['node_val'].c.graph,
             table['node_val'].c.node
         ),
         'edges': Index(
-            "edges_idx",
+            "edges_idx" + suffix,
             table['edges'].c.graph,
             table['edges'].c.nodeA,
             table['edges'].c.nodeB,
             table['edges'].c.idx
         ),
         'edge_val': Index(
-            "edge_val_idx",
+            "edge_val_idx" + suffix,
             table['edge_val'].c.graph,
             table['edge_val'].c.nodeA,
             table['edge_val'].c.nodeB,
@@ -179,6 +320,13 @@ def indices_for_table_dict(table):
             table['edge_val'].c.key
         )
     }
+    for name in history_tables:
+        r[name + '_rev'] = Index(
+            name + '_rev_idx' + suffix,
+            table[name].c.branch,
+            table[name].c.rev
+        )
+    return r
 
 
 def queries_for_table_dict(table):
@@ -318,12 +466,13 @@ def queries_for_table_dict(table):
                 table['edge_val'].c.nodeA == hirev.c.nodeA,
                 table['edge_val'].c.nodeB == hirev.c.nodeB,
                 table['edge_val'].c.idx == hirev.c.idx,
+                table['edge_val'].c.key == hirev.c.key,
                 table['edge_val'].c.branch == hirev.c.branch,
                 table['edge_val'].c.rev == hirev.c.rev
             )
         )
 
-    return {
+    r = {
         'ctbranch': select(
             [func.COUNT(table['branches'].c.branch)]
         ).where(
@@ -346,6 +495,15 @@ def queries_for_table_dict(table):
         ).where(
             table['global'].c.key == bindparam('key')
         ),
+        'vals_get': select(
+            [table['vals'].c.value]
+        ).where(
+            table['vals'].c.hash == bindparam('hash')
+        ),
+        'vals_ins': table['vals'].insert().prefix_with('OR IGNORE').values(
+            hash=bindparam('hash'),
+            value=bindparam('value')
+        ),
         'edge_val_ins': table['edge_val'].insert().prefix_with('OR REPLACE').values(
             graph=bindparam('graph'),
             nodeA=bindparam('orig'),
@@ -407,6 +565,24 @@ def queries_for_table_dict(table):
         'del_graph': table['graphs'].delete().where(
             table['graphs'].c.graph == bindparam('graph')
         ),
+        'del_edge_val_branches': table['edge_val'].delete().where(
+            table['edge_val'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
+        'del_edge_branches': table['edges'].delete().where(
+            table['edges'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
+        'del_node_val_branches': table['node_val'].delete().where(
+            table['node_val'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
+        'del_node_branches': table['nodes'].delete().where(
+            table['nodes'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
+        'del_graph_val_branches': table['graph_val'].delete().where(
+            table['graph_val'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
+        'del_branches': table['branches'].delete().where(
+            table['branches'].c.branch.in_(bindparam('branches', expanding=True))
+        ),
         'parrev': select(
             [table['branches'].c.parent_rev]
         ).where(
@@ -481,7 +657,7 @@ def queries_for_table_dict(table):
             table['nodes'].c.branch,
             table['nodes'].c.rev,
             table['nodes'].c.extant
-        ]),
+        ]).order_by(table['nodes'].c.rev),
         'graph_val_items': select(
             [
                 table['graph_val'].c.key,
@@ -502,7 +678,7 @@ def queries_for_table_dict(table):
             table['graph_val'].c.branch,
             table['graph_val'].c.rev,
             table['graph_val'].c.value
-        ]),
+        ]).order_by(table['graph_val'].c.rev),
         'graph_val_get': select(
             [
                 table['graph_val'].c.value
@@ -556,7 +732,7 @@ def queries_for_table_dict(table):
             table['node_val'].c.branch,
             table['node_val'].c.rev,
             table['node_val'].c.value
-        ]),
+        ]).order_by(table['node_val'].c.rev),
         'node_val_get': select(
             [
                 table['node_val'].c.value
@@ -656,6 +832,97 @@ def queries_for_table_dict(table):
                 ]
             )
         ),
+        'graph_val_history': select(
+            [
+                table['graph_val'].c.branch,
+                table['graph_val'].c.rev,
+                table['graph_val'].c.value
+            ]
+        ).where(
+            and_(
+                table['graph_val'].c.graph == bindparam('graph'),
+                table['graph_val'].c.key == bindparam('key'),
+                table['graph_val'].c.rev <= bindparam('rev')
+            )
+        ),
+        'node_val_history': select(
+            [
+                table['node_val'].c.branch,
+                table['node_val'].c.rev,
+                table['node_val'].c.value
+            ]
+        ).where(
+            and_(
+                table['node_val'].c.graph == bindparam('graph'),
+                table['node_val'].c.node == bindparam('node'),
+                table['node_val'].c.key == bindparam('key'),
+                table['node_val'].c.rev <= bindparam('rev')
+            )
+        ),
+        'edge_val_history': select(
+            [
+                table['edge_val'].c.branch,
+                table['edge_val'].c.rev,
+                table['edge_val'].c.value
+            ]
+        ).where(
+            and_(
+                table['edge_val'].c.graph == bindparam('graph'),
+                table['edge_val'].c.nodeA == bindparam('orig'),
+                table['edge_val'].c.nodeB == bindparam('dest'),
+                table['edge_val'].c.idx == bindparam('idx'),
+                table['edge_val'].c.key == bindparam('key'),
+                table['edge_val'].c.rev <= bindparam('rev')
+            )
+        ),
+        'graph_node_vals': select(
+            [
+                table['node_val'].c.node,
+                table['node_val'].c.value
+            ]
+        ).select_from(
+            node_val_hirev_join(
+                [
+                    table['node_val'].c.graph == bindparam('graph'),
+                    table['node_val'].c.key == bindparam('key'),
+                    table['node_val'].c.branch == bindparam('branch'),
+                    table['node_val'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'graph_edges': select(
+            [
+                table['edges'].c.nodeA,
+                table['edges'].c.nodeB,
+                table['edges'].c.idx,
+                table['edges'].c.extant
+            ]
+        ).select_from(
+            edges_recent_join(
+                [
+                    table['edges'].c.graph == bindparam('graph'),
+                    table['edges'].c.branch == bindparam('branch'),
+                    table['edges'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'graph_edge_vals': select(
+            [
+                table['edge_val'].c.nodeA,
+                table['edge_val'].c.nodeB,
+                table['edge_val'].c.idx,
+                table['edge_val'].c.value
+            ]
+        ).select_from(
+            edge_val_recent_join(
+                [
+                    table['edge_val'].c.graph == bindparam('graph'),
+                    table['edge_val'].c.key == bindparam('key'),
+                    table['edge_val'].c.branch == bindparam('branch'),
+                    table['edge_val'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
         'edges_dump': select([
             table['edges'].c.graph,
             table['edges'].c.nodeA,
@@ -664,7 +931,7 @@ def queries_for_table_dict(table):
             table['edges'].c.branch,
             table['edges'].c.rev,
             table['edges'].c.extant
-        ]),
+        ]).order_by(table['edges'].c.rev),
         'edge_exist_ins': table['edges'].insert().prefix_with('OR REPLACE').values(
             graph=bindparam('graph'),
             nodeA=bindparam('orig'),
@@ -695,7 +962,7 @@ def queries_for_table_dict(table):
             table['edge_val'].c.branch,
             table['edge_val'].c.rev,
             table['edge_val'].c.value
-        ]),
+        ]).order_by(table['edge_val'].c.rev),
         'edge_val_items': select(
             [
                 table['edge_val'].c.key,
@@ -731,33 +998,177 @@ def queries_for_table_dict(table):
             )
         )
     }
+    for name in history_tables:
+        r[name + '_changes'] = select(
+            [table[name].c[col] for col in history_keys[name][1:]]
+        ).where(
+            and_(
+                table[name].c.graph == bindparam('graph'),
+                table[name].c.branch == bindparam('branch'),
+                table[name].c.rev > bindparam('after'),
+                table[name].c.rev <= bindparam('upto')
+            )
+        ).distinct()
+        r[name + '_stream'] = select(
+            [table[name].c[col] for col in history_keys[name]] + [
+                table[name].c.rev,
+                table[name].c[history_values[name]]
+            ]
+        ).where(
+            and_(
+                table[name].c.branch == bindparam('branch'),
+                table[name].c.rev > bindparam('after'),
+                table[name].c.rev <= bindparam('upto')
+            )
+        ).order_by(table[name].c.rev)
+    for (name, (opname, kind)) in where_queries.items():
+        comparable = is_json(table['node_val'].c.value)
+        if kind is not None:
+            comparable = and_(
+                comparable, json_kind_is(table['node_val'].c.value, kind)
+            )
+        r[name] = select(
+            [
+                table['node_val'].c.node,
+                case(
+                    [(comparable, where_ops[opname](
+                        json_value(table['node_val'].c.value),
+                        json_value(bindparam('value'))
+                    ))],
+                    else_=null()
+                ).label('hit'),
+                case(
+                    [(is_json(table['node_val'].c.value), null())],
+                    else_=table['node_val'].c.value
+                ).label('raw')
+            ]
+        ).select_from(
+            node_val_hirev_join(
+                [
+                    table['node_val'].c.graph == bindparam('graph'),
+                    table['node_val'].c.key == bindparam('key'),
+                    table['node_val'].c.branch == bindparam('branch'),
+                    table['node_val'].c.rev <= bindparam('rev')
+                ]
+            )
+        )
+    return r
+
+
+def queries_for_archive(table, archive):
+    """Return queries that move old history from the tables in ``table``
+    to those in ``archive``.
 
+    ``<table>_archive`` copies every row older than the given rev into
+    the archive. ``<table>_purge`` then deletes those rows from the hot
+    table that have been superseded by the given rev. The latest row
+    before the watermark stays in both, so that reads at or after the
+    watermark need only the hot table, and reads before it need only
+    the archive.
 
-def compile_sql(dialect, meta):
+    """
+    r = {}
+    for name in history_tables:
+        hot = table[name]
+        newer = hot.alias('newer')
+        r[name + '_archive'] = archive[name].insert().prefix_with(
+            'OR IGNORE'
+        ).from_select(
+            [col.name for col in hot.columns],
+            select(list(hot.c)).where(hot.c.rev < bindparam('rev'))
+        )
+        r[name + '_purge'] = hot.delete().where(
+            and_(
+                hot.c.rev < bindparam('rev'),
+                exists(
+                    select([newer.c.rev]).where(
+                        and_(
+                            *[
+                                newer.c[col] == hot.c[col]
+                                for col in history_keys[name] + ('branch',)
+                            ] + [
+                                newer.c.rev > hot.c.rev,
+                                newer.c.rev <= bindparam('rev')
+                            ]
+                        )
+                    )
+                )
+            )
+        )
+    return r
+
+
+def compile_sql(dialect, meta, blobmeta=None):
     r = {}
     table = tables_for_meta(meta)
+    archive = archive_tables_for_meta(meta, table)
+    blob = tables_for_meta(blobmeta or MetaData(), binary=True)
+    blob_archive = archive_tables_for_meta(blob['global'].metadata, blob)
     index = indices_for_table_dict(table)
+    archive_index = indices_for_table_dict(archive, '_archive')
+    indices_for_table_dict(blob)
+    indices_for_table_dict(blob_archive, '_archive')
     query = queries_for_table_dict(table)
+    archive_query = queries_for_table_dict(dict(table, **archive))
 
     for t in table.values():
         r['create_' + t.name] = CreateTable(t).compile(dialect=dialect)
+    for t in archive.values():
+        r['create_' + t.name] = CreateTable(t).compile(dialect=dialect)
+    for t in list(blob.values()) + list(blob_archive.values()):
+        r['blob_create_' + t.name] = CreateTable(t).compile(dialect=dialect)
     for (tab, idx) in index.items():
         r['index_' + tab] = CreateIndex(idx).compile(dialect=dialect)
+    for (tab, idx) in archive_index.items():
+        r['index_' + tab + '_archive'] = CreateIndex(idx).compile(dialect=dialect)
     for (name, q) in query.items():
         r[name] = q.compile(dialect=dialect)
+    for name in archive_queries:
+        r['archive_' + name] = archive_query[name].compile(dialect=dialect)
+    for (name, q) in queries_for_archive(table, archive).items():
+        r[name] = q.compile(dialect=dialect)
 
     return r
 
 
+compiled_sql = {}
+"""``(meta, blobmeta, compiled)`` triples already made by ``compile_sql``,
+keyed by the dialect they're for
+
+"""
+
+
+def dialect_key(dialect):
+    """Return a key that's the same for dialects that compile alike"""
+    return (dialect.name, dialect.driver, dialect.paramstyle)
+
+
+def compiled_sql_for(dialect):
+    """Return a ``MetaData`` for text-encoded databases, another for
+    binary-encoded ones, and the queries compiled for this dialect,
+    compiling them only the first time.
+
+    """
+    k = dialect_key(dialect)
+    if k not in compiled_sql:
+        meta = MetaData()
+        blobmeta = MetaData()
+        compiled_sql[k] = (meta, blobmeta, compile_sql(dialect, meta, blobmeta))
+    return compiled_sql[k]
+
+
 class Alchemist(object):
     """Holds an engine and runs queries on it.
 
+    The compiled queries are shared by every Alchemist whose engine
+    uses the same dialect.
+
     """
     def __init__(self, engine):
         self.engine = engine
         self.conn = self.engine.connect()
-        self.meta = MetaData()
-        self.sql = compile_sql(self.engine.dialect, self.meta)
+        (self.meta, self.blobmeta, self.sql) \
+            = compiled_sql_for(self.engine.dialect)
         def caller(k, *largs):
             statement = self.sql[k]
             if hasattr(statement, 'positiontup'):
@@ -775,6 +1186,29 @@ class Alchemist(object):
             setattr(self, key, partial(caller, key))
             setattr(self.many, key, partial(manycaller, key))
 
+    def create_rev_indices(self, meta):
+        """Make whichever of the ``*_rev_idx`` indices are missing from
+        the history and archive tables in ``meta``.
+
+        ``meta.create_all`` won't do it, because it skips tables that
+        exist already, and databases made before those indices lack them.
+
+        """
+        inspector = inspect(self.engine)
+        for name in history_tables:
+            for (tabname, idxname) in (
+                    (name, name + '_rev_idx'),
+                    (name + '_archive', name + '_rev_idx_archive')
+            ):
+                have = {
+                    idx['name'] for idx in inspector.get_indexes(tabname)
+                }
+                if idxname in have:
+                    continue
+                for idx in meta.tables[tabname].indexes:
+                    if idx.name == idxname:
+                        idx.create(self.engine)
+
 
 if __name__ == '__main__':
     e = create_engine('sqlite:///:memory:')
@@ -0,0 +1,7 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Benchmarks for gorm. Each module here has a ``run`` function that
+returns a dictionary of timings, and prints them as JSON when run as
+a script. ``python -m gorm.bench`` runs them all.
+
+"""
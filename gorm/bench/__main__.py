@@ -0,0 +1,46 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Run the benchmarks and print their results as one JSON object, keyed
+by the name of the benchmark module::
+
+    python -m gorm.bench [name ...]
+
+With no names, run them all. The ``meta`` key says what they ran on,
+for comparing results across commits and machines.
+
+"""
+import sys
+import platform
+import sqlite3
+from importlib import import_module
+from json import dumps
+
+
+benchmarks = (
+    'imports', 'startup', 'hotpaths', 'codec', 'compression', 'dedup',
+    'wrappers'
+)
+
+
+def main(names=()):
+    unknown = [name for name in names if name not in benchmarks]
+    if unknown:
+        raise SystemExit(
+            "No such benchmark: {}. Choose from: {}".format(
+                ', '.join(unknown), ', '.join(benchmarks)
+            )
+        )
+    r = {
+        name: import_module('gorm.bench.' + name).run()
+        for name in names or benchmarks
+    }
+    r['meta'] = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform()
+    }
+    return r
+
+
+if __name__ == '__main__':
+    print(dumps(main(sys.argv[1:]), indent=4, sort_keys=True))
@@ -0,0 +1,75 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Compare how fast, and how compactly, the codecs in :mod:`gorm.codec`
+encode and decode typical keys and values.
+
+"""
+from random import Random
+from timeit import repeat
+from gorm import xjson
+from gorm.codec import codecs
+
+
+def sample_values(n=1000, seed=0):
+    """Return a list of ``n`` assorted values, mostly numeric, like a
+    simulation might store.
+
+    """
+    rand = Random(seed)
+    makers = (
+        lambda: rand.randint(-1000, 1000),
+        lambda: rand.randint(0, 2**40),
+        lambda: rand.random(),
+        lambda: tuple(rand.random() for _ in range(3)),
+        lambda: [rand.randint(0, 100) for _ in range(8)],
+        lambda: 'node{}'.format(rand.randint(0, 10000)),
+        lambda: {'x': rand.random(), 'y': rand.random(), 'tags': ('a', 'b')},
+        lambda: rand.random() < 0.5
+    )
+    return [rand.choice(makers)() for _ in range(n)]
+
+
+def forget_hints():
+    """Clear the memos that ``xjson`` keeps, so it has to do the work"""
+    xjson.json_dump_hints.clear()
+    xjson.json_load_hints.clear()
+
+
+def run(n=1000, repetitions=5):
+    """Return, for each codec, the number of values encoded and decoded
+    per second, and the mean encoded size in bytes.
+
+    """
+    values = sample_values(n)
+    r = {}
+    for (name, codec) in codecs.items():
+        encoded = [codec.dump(v) for v in values]
+        assert [codec.load(s) for s in encoded] == values
+
+        def dump():
+            for v in values:
+                codec.dump(v)
+
+        def load():
+            for s in encoded:
+                codec.load(s)
+        dumptime = min(repeat(
+            dump, forget_hints, number=1, repeat=repetitions
+        ))
+        loadtime = min(repeat(
+            load, forget_hints, number=1, repeat=repetitions
+        ))
+        r[name] = {
+            'dumps_per_second': n / dumptime,
+            'loads_per_second': n / loadtime,
+            'mean_size': sum(
+                len(s.encode('utf-8') if isinstance(s, str) else s)
+                for s in encoded
+            ) / n
+        }
+    return r
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
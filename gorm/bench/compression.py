@@ -0,0 +1,79 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Measure how much space compressing large values saves, and what it
+costs in time, writing and reading many revisions of a big document.
+
+"""
+from random import Random
+from time import perf_counter
+from gorm import ORM
+from gorm.codec import compressors
+
+
+def document(rand, fields=500):
+    """Return a dictionary that encodes to some tens of kilobytes"""
+    return {
+        'field{}'.format(i): {
+            'value': rand.random(),
+            'history': [rand.randint(0, 100) for _ in range(5)],
+            'label': 'label{}'.format(rand.randint(0, 50))
+        } for i in range(fields)
+    }
+
+
+def measure(codec='json', compression=None, revs=50, seed=0):
+    """Write ``revs`` revisions of a document to a node, changing one
+    field each time, then read them all back.
+
+    Return the seconds taken to write and read, and the total size
+    of the stored values in bytes.
+
+    """
+    rand = Random(seed)
+    doc = document(rand)
+    engine = ORM(
+        'sqlite:///:memory:', codec=codec,
+        compress_threshold=None if compression is None else 1024,
+        compression=compression or 'zlib'
+    )
+    db = engine.db
+    db.new_graph('bench', 'Graph')
+    db.exist_node('bench', 0, 'master', 0, True)
+    rows = []
+    for rev in range(revs):
+        doc['field{}'.format(rand.randrange(500))]['value'] = rand.random()
+        rows.append(('bench', 0, 'doc', 'master', rev, doc))
+    start = perf_counter()
+    db.node_val_ins_many(*rows)
+    written = perf_counter()
+    for rev in range(revs):
+        db.node_val_get('bench', 0, 'doc', 'master', rev)
+    read = perf_counter()
+    size = sum(
+        len(value) for (graph, node, key, branch, rev, value)
+        in db.sql('node_val_dump')
+    )
+    engine.close()
+    return {
+        'write_seconds': written - start,
+        'read_seconds': read - written,
+        'stored_bytes': size
+    }
+
+
+def run(revs=50):
+    """Return measurements for each codec, uncompressed and with each
+    compression method.
+
+    """
+    r = {}
+    for codec in ('json', 'binary'):
+        for compression in (None,) + tuple(compressors):
+            r['{}_{}'.format(codec, compression or 'raw')] \
+                = measure(codec, compression, revs)
+    return r
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
@@ -0,0 +1,69 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Measure the space saved by storing identical values only once, on
+disk and in the caches, on a workload where many nodes share a few big
+template values across revisions and branches.
+
+"""
+import os
+from random import Random
+from tempfile import mkdtemp
+from gorm import ORM
+from gorm.cache import deep_sizeof
+
+
+def templates(rand, n=5, fields=200):
+    """Return ``n`` big dictionaries for nodes to share"""
+    return [
+        {'stat{}'.format(i): rand.random() for i in range(fields)}
+        for _ in range(n)
+    ]
+
+
+def populate(db, rand, nodes=200, revs=5, branches=3):
+    """Give each node a template value in each revision of each branch"""
+    shared = templates(rand)
+    db.new_graph('bench', 'Graph')
+    for b in range(1, branches):
+        db.new_branch('branch{}'.format(b), 'master', 0)
+    rows = []
+    for node in range(nodes):
+        db.exist_node('bench', node, 'master', 0, True)
+        for b in range(branches):
+            branch = 'master' if b == 0 else 'branch{}'.format(b)
+            for rev in range(revs):
+                rows.append((
+                    'bench', node, 'template', branch, rev,
+                    rand.choice(shared)
+                ))
+    db.node_val_ins_many(*rows)
+
+
+def measure(dedup_threshold=None, seed=0):
+    """Populate a database, then reopen it and return the size of the
+    database file and of the node value cache, in bytes.
+
+    """
+    path = os.path.join(mkdtemp(), 'dedup.db')
+    engine = ORM('sqlite:///' + path, dedup_threshold=dedup_threshold)
+    populate(engine.db, Random(seed))
+    engine.close()
+    disk = os.path.getsize(path)
+    engine = ORM('sqlite:///' + path, dedup_threshold=dedup_threshold)
+    memory = deep_sizeof(engine._node_val_cache)
+    engine.close()
+    os.remove(path)
+    return {'database_bytes': disk, 'cache_bytes': memory}
+
+
+def run():
+    """Return sizes with and without deduplication"""
+    return {
+        'plain': measure(None),
+        'dedup': measure(64)
+    }
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
@@ -0,0 +1,196 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Time the operations that simulations do most: opening an ORM on
+databases of different sizes, adding nodes and edges, getting and
+setting attributes, switching branch and revision, and iterating
+over nodes, successors, and predecessors, with caching and without.
+
+Times are in seconds per operation.
+
+"""
+import os
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import repeat
+from gorm import ORM
+from gorm.bench import workloads
+
+
+def populate(
+        orm, nodes=100, revs=10, branches=3, seed=0, name='bench',
+        directed=False
+):
+    """Make a graph of ``nodes`` nodes in a ring, then give a random
+    tenth of them new hit points in each of ``revs`` revisions of
+    each of ``branches`` branches. Return the graph.
+
+    """
+    rand = Random(seed)
+    g = (orm.new_digraph if directed else orm.new_graph)(name)
+    for n in range(nodes):
+        g.add_node(n, hp=100)
+    g.add_edges_from((n, (n + 1) % nodes) for n in range(nodes))
+    for b in range(branches):
+        orm.branch = 'master' if b == 0 else 'branch{}'.format(b)
+        for rev in range(1, revs):
+            orm.rev = rev
+            for n in rand.sample(range(nodes), max(1, nodes // 10)):
+                g.node[n]['hp'] = rand.randint(0, 100)
+        orm.branch = 'master'
+        orm.rev = 0
+    orm.commit()
+    return g
+
+
+def best(stmt, setup=None, number=1, repetitions=5):
+    """Return the best time, in seconds, of ``repetitions`` runs of
+    ``number`` calls to ``stmt``, calling ``setup`` before each run
+
+    """
+    return min(repeat(
+        stmt, setup or (lambda: None), number=number, repeat=repetitions
+    )) / number
+
+
+def time_startup(sizes=(100, 1000), caching=True, repetitions=5):
+    """Return the time it takes to open and close an ORM on a database
+    file with each number of nodes in ``sizes``, twice as many edges,
+    and a branching history; see :func:`gorm.bench.workloads.generate`
+
+    """
+    r = {}
+    tmp = mkdtemp()
+    try:
+        for size in sizes:
+            path = os.path.join(tmp, '{}.db'.format(size))
+            workloads.make(
+                'sqlite:///' + path, nodes=size, edges=2 * size,
+                churn=size // 10, depth=2, fanout=2
+            )
+            r[str(size)] = best(
+                lambda: ORM('sqlite:///' + path, caching=caching).close(),
+                repetitions=repetitions
+            )
+    finally:
+        rmtree(tmp)
+    return r
+
+
+def time_writes(n=100, caching=True, repetitions=5):
+    """Return the time it takes to add a node, to add an edge with
+    ``add_edge``, and to add an edge with ``add_edges_from``
+
+    """
+    state = {}
+
+    def fresh():
+        if 'orm' in state:
+            state['orm'].close()
+        orm = state['orm'] = ORM('sqlite:///:memory:', caching=caching)
+        g = state['g'] = orm.new_graph('bench')
+        for node in range(n):
+            g.add_node(node)
+
+    def add_nodes():
+        g = state['g']
+        for node in range(n, 2 * n):
+            g.add_node(node)
+
+    def add_edges():
+        g = state['g']
+        for node in range(n):
+            g.add_edge(node, (node + 1) % n)
+
+    def add_edges_from():
+        state['g'].add_edges_from(
+            (node, (node + 1) % n) for node in range(n)
+        )
+    r = {
+        name: best(stmt, fresh, repetitions=repetitions) / n
+        for (name, stmt) in (
+            ('add_node', add_nodes),
+            ('add_edge', add_edges),
+            ('add_edges_from', add_edges_from)
+        )
+    }
+    state['orm'].close()
+    return r
+
+
+def time_reads(nodes=100, revs=10, branches=3, caching=True, repetitions=5):
+    """Return the time it takes to get and set a node attribute, switch
+    revision and branch, iterate over the nodes, iterate over the
+    successors or predecessors of a node, and look up a predecessor
+
+    """
+    orm = ORM('sqlite:///:memory:', caching=caching)
+    g = populate(orm, nodes, revs, branches)
+    dg = populate(orm, nodes, revs, branches, name='dibench', directed=True)
+    node = g.node[0]
+    branchnames = ['master'] + [
+        'branch{}'.format(b) for b in range(1, branches)
+    ]
+
+    def get_attr():
+        for i in range(nodes):
+            node['hp']
+
+    def set_attr():
+        for i in range(nodes):
+            node['hp'] = i
+
+    def switch_rev():
+        for rev in range(revs):
+            orm.rev = rev
+
+    def switch_branch():
+        for branch in branchnames:
+            orm.branch = branch
+
+    def iter_nodes():
+        list(g.nodes())
+
+    def iter_adj():
+        for n in dg.adj:
+            list(dg.adj[n])
+
+    def iter_pred():
+        for n in dg.pred:
+            list(dg.pred[n])
+
+    def lookup_pred():
+        for n in range(nodes):
+            dg.pred[(n + 1) % nodes].get(n)
+    r = {
+        'get_attr': best(get_attr, repetitions=repetitions) / nodes,
+        'set_attr': best(set_attr, repetitions=repetitions) / nodes,
+        'switch_rev': best(switch_rev, repetitions=repetitions) / revs,
+        'switch_branch': best(
+            switch_branch, repetitions=repetitions
+        ) / len(branchnames),
+        'iter_nodes': best(iter_nodes, repetitions=repetitions) / nodes,
+        'iter_adj': best(iter_adj, repetitions=repetitions) / nodes,
+        'iter_pred': best(iter_pred, repetitions=repetitions) / nodes,
+        'lookup_pred': best(lookup_pred, repetitions=repetitions) / nodes
+    }
+    orm.close()
+    return r
+
+
+def run(sizes=(100, 1000), n=100, repetitions=5):
+    """Return timings of every operation, with caching and without"""
+    r = {}
+    for caching in (True, False):
+        times = {
+            'startup': time_startup(sizes, caching, repetitions)
+        }
+        times.update(time_writes(n, caching, repetitions))
+        times.update(time_reads(n, caching=caching, repetitions=repetitions))
+        r['caching' if caching else 'no_caching'] = times
+    return r
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
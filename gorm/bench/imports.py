@@ -0,0 +1,54 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Measure how long it takes to import gorm, and which of the heavy
+dependencies get imported along the way, using ``python -X importtime``
+in a fresh interpreter.
+
+"""
+import sys
+from subprocess import run as run_process, PIPE
+
+
+heavy = ('gorm', 'gorm.graph', 'networkx', 'sqlalchemy')
+scripts = {
+    'import': "import gorm",
+    'sqlite3': "import gorm; gorm.ORM(':memory:', alchemy=False).close()",
+    'alchemy': "import gorm; gorm.ORM('sqlite:///:memory:').close()"
+}
+
+
+def import_times(script):
+    """Run ``script`` in a new interpreter and return a dictionary mapping
+    the names in ``heavy`` that it imported to their cumulative import
+    time in microseconds.
+
+    """
+    proc = run_process(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        stdout=PIPE, stderr=PIPE, universal_newlines=True, check=True
+    )
+    r = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        (selfus, cumulative, name) = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name in heavy:
+            try:
+                r[name] = int(cumulative)
+            except ValueError:
+                continue  # the header
+    return r
+
+
+def run():
+    """Return import times for importing gorm alone, then for starting an
+    ORM on each backend.
+
+    """
+    return {k: import_times(script) for (k, script) in scripts.items()}
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
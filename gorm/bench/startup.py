@@ -0,0 +1,59 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Time how long it takes to open an ORM on an empty in-memory database,
+with and without the queries already compiled.
+
+"""
+from timeit import repeat
+from gorm import ORM, alchemy, query
+
+
+def forget_compiled():
+    """Clear the module-level caches of compiled queries, so that the
+    next ORM has to compile them all again.
+
+    """
+    alchemy.compiled_sql.clear()
+    query.sqlite_strings.clear()
+
+
+def time_startup(
+        dbstring='sqlite:///:memory:',
+        cold=False,
+        number=20,
+        repetitions=5,
+        **kwargs
+):
+    """Return the best time, in seconds, that it took to open and close
+    an ORM on ``dbstring``. With ``cold``, forget the compiled queries
+    before each one.
+
+    """
+    def startup():
+        if cold:
+            forget_compiled()
+        ORM(dbstring, **kwargs).close()
+    return min(repeat(startup, number=number, repeat=repetitions)) / number
+
+
+def run(number=20, repetitions=5):
+    """Return a dictionary of startup times for the SQLAlchemy and sqlite3
+    backends, cold and warm.
+
+    """
+    r = {}
+    for (backend, dbstring, alchemize) in (
+            ('alchemy', 'sqlite:///:memory:', True),
+            ('sqlite3', ':memory:', False)
+    ):
+        for cold in (True, False):
+            r['{}_{}'.format(backend, 'cold' if cold else 'warm')] \
+                = time_startup(
+                    dbstring, cold, number, repetitions, alchemy=alchemize
+                )
+    return r
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
@@ -0,0 +1,182 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Make gorm databases with histories of a controlled shape, for
+benchmarks and tests: how many graphs, nodes, and edges; how many
+node attributes change each revision; how long each branch's
+history is; and how deep and bushy the tree of branches is.
+
+Everything's written through the bulk ``*_many`` methods of the query
+engine, and comes out the same every time for the same seed.
+
+"""
+from random import Random
+from gorm import ORM
+
+
+scenarios = {
+    'deep_branch_tree': dict(
+        nodes=100, edges=200, churn=10, revs=10, depth=30, fanout=1
+    ),
+    'bushy_branch_tree': dict(
+        nodes=100, edges=200, churn=10, revs=10, depth=4, fanout=3
+    ),
+    'long_history': dict(
+        nodes=100, edges=200, churn=10, revs=10000
+    ),
+    'wide_graph': dict(
+        nodes=100000, edges=200000, churn=100, revs=10
+    )
+}
+"""Keyword arguments to ``generate`` for some typical shapes"""
+
+
+class Batch(object):
+    """Rows waiting to be written with one of the query engine's bulk
+    methods, written whenever there are ``size`` of them
+
+    """
+    def __init__(self, write, size):
+        self.write = write
+        self.size = size
+        self.rows = []
+        self.written = 0
+
+    def add(self, *row):
+        self.rows.append(row)
+        if len(self.rows) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.write(*self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+
+
+def branch_tree(depth, fanout, revs):
+    """Return a list of ``(branch, parent, fork_rev)`` for a tree of
+    branches under ``'master'``, ``depth`` deep with ``fanout``
+    children each, parents first. Every branch is ``revs`` revisions
+    long, and its children fork from the middle of it.
+
+    """
+    r = []
+    level = [('master', 0)]
+    for d in range(depth):
+        nextlevel = []
+        for (parent, start) in level:
+            fork = start + revs // 2
+            for i in range(fanout):
+                branch = '{}/{}'.format(parent, i)
+                r.append((branch, parent, fork))
+                nextlevel.append((branch, fork))
+        level = nextlevel
+    return r
+
+
+def random_edges(rand, nodes, edges, directed):
+    """Return a sorted list of ``edges`` distinct pairs of distinct nodes,
+    in both orders unless ``directed``
+
+    """
+    possible = nodes * (nodes - 1)
+    if not directed:
+        possible //= 2
+    if edges > possible:
+        raise ValueError(
+            "Can't have {} edges between {} nodes".format(edges, nodes)
+        )
+    r = set()
+    while len(r) < edges:
+        (a, b) = (rand.randrange(nodes), rand.randrange(nodes))
+        if a == b:
+            continue
+        if not directed:
+            (a, b) = (min(a, b), max(a, b))
+        r.add((a, b))
+    if not directed:
+        r.update([(b, a) for (a, b) in r])
+    return sorted(r)
+
+
+def generate(
+        db, graphs=1, nodes=100, edges=200, keys=('hp', 'mp'), churn=10,
+        revs=10, depth=0, fanout=1, directed=False, seed=0, batch=10000
+):
+    """Write a synthetic history into ``db``, a query engine.
+
+    There are ``graphs`` graphs named ``graph0`` and so on, each
+    with ``nodes`` nodes and ``edges`` edges, chosen at random and
+    existing from revision 0 of ``'master'``. Every node starts with a
+    value for each of ``keys``. Each branch is ``revs`` revisions
+    long; in every revision after its first, ``churn`` random node
+    attributes in each graph get new values, and the graph attribute
+    ``'tick'`` is set to the revision. See ``branch_tree`` for the
+    shape of the branches; there are ``fanout ** depth`` at the
+    bottom.
+
+    Rows are written ``batch`` at a time. Return a dictionary of the
+    graph names, the branches as ``(branch, parent, fork_rev)``, and
+    how many rows went in each table.
+
+    """
+    rand = Random(seed)
+    names = ['graph{}'.format(i) for i in range(graphs)]
+    branches = branch_tree(depth, fanout, revs)
+    batches = {
+        'nodes': Batch(db.exist_node_many, batch),
+        'edges': Batch(db.exist_edge_many, batch),
+        'graph_val': Batch(db.graph_val_ins_many, batch),
+        'node_val': Batch(db.node_val_ins_many, batch)
+    }
+    for name in names:
+        db.new_graph(name, 'DiGraph' if directed else 'Graph')
+    for (branch, parent, fork) in branches:
+        db.new_branch(branch, parent, fork)
+    for name in names:
+        for node in range(nodes):
+            batches['nodes'].add(name, node, 'master', 0, True)
+            for key in keys:
+                batches['node_val'].add(
+                    name, node, key, 'master', 0, rand.randint(0, 100)
+                )
+        for (a, b) in random_edges(rand, nodes, edges, directed):
+            batches['edges'].add(name, a, b, 0, 'master', 0, True)
+    for (branch, start) in [('master', 0)] + [
+            (branch, fork) for (branch, parent, fork) in branches
+    ]:
+        for rev in range(start + 1, start + revs):
+            for name in names:
+                batches['graph_val'].add(name, 'tick', branch, rev, rev)
+                changed = set()
+                for i in range(min(churn, nodes * len(keys))):
+                    var = (rand.randrange(nodes), rand.choice(keys))
+                    while var in changed:
+                        var = (rand.randrange(nodes), rand.choice(keys))
+                    changed.add(var)
+                    batches['node_val'].add(
+                        name, var[0], var[1], branch, rev,
+                        rand.randint(0, 100)
+                    )
+    for b in batches.values():
+        b.flush()
+    return {
+        'graphs': names,
+        'branches': branches,
+        'rows': {table: b.written for (table, b) in batches.items()}
+    }
+
+
+def make(dbstring, scenario=None, **kwargs):
+    """Open an ORM on ``dbstring``, ``generate`` a history in it with the
+    keyword arguments for the named ``scenario`` updated with
+    ``kwargs``, and close it. Return what ``generate`` did.
+
+    """
+    if scenario is not None:
+        kwargs = dict(scenarios[scenario], **kwargs)
+    orm = ORM(dbstring, caching=False)
+    try:
+        return generate(orm.db, **kwargs)
+    finally:
+        orm.close()
@@ -0,0 +1,95 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Measure the time taken, wrappers made, and memory allocated reading
+list and dictionary attributes of nodes in a loop, which goes through
+the wrappers in :mod:`gorm.xjson`.
+
+"""
+import tracemalloc
+from time import perf_counter
+from gorm import ORM, xjson
+
+
+wrapper_classes = (
+    xjson.JSONWrapper,
+    xjson.JSONListWrapper,
+    xjson.JSONReWrapper,
+    xjson.JSONListReWrapper
+)
+
+
+class counting(object):
+    """Context manager counting how many wrappers get made in it"""
+    def __enter__(self):
+        self.count = 0
+        self.inits = {cls: cls.__init__ for cls in wrapper_classes}
+        for (cls, init) in self.inits.items():
+            def counted(wrapper, *args, init=init, **kwargs):
+                self.count += 1
+                init(wrapper, *args, **kwargs)
+            cls.__init__ = counted
+        return self
+
+    def __exit__(self, *args):
+        for (cls, init) in self.inits.items():
+            cls.__init__ = init
+
+
+def populate(orm, nodes=100):
+    g = orm.new_graph('wrapbench')
+    for n in range(nodes):
+        g.add_node(n)
+        g.node[n]['hp'] = n
+        g.node[n]['stats'] = {'str': n, 'dex': n, 'inv': {'gold': n}}
+        g.node[n]['path'] = list(range(10))
+    return g
+
+
+readers = {
+    'scalar': lambda node: node['hp'],
+    'dict': lambda node: node['stats']['dex'],
+    'nested_dict': lambda node: node['stats']['inv']['gold'],
+    'list': lambda node: node['path'][5]
+}
+
+
+def measure(g, read, passes=20):
+    """Read an attribute of every node in ``g``, ``passes`` times over.
+    Return microseconds per read, wrappers made per read, and the peak
+    bytes allocated while doing it.
+
+    """
+    nodes = [g.node[n] for n in g.node]
+    for node in nodes:
+        read(node)
+    with counting() as counter:
+        for node in nodes:
+            read(node)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = perf_counter()
+    for _ in range(passes):
+        for node in nodes:
+            read(node)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    reads = passes * len(nodes)
+    return {
+        'usec_per_read': elapsed / reads * 1e6,
+        'wrappers_per_read': counter.count / len(nodes),
+        'peak_bytes': peak
+    }
+
+
+def run():
+    orm = ORM('sqlite:///:memory:')
+    g = populate(orm)
+    r = {name: measure(g, read) for (name, read) in readers.items()}
+    orm.close()
+    return r
+
+
+if __name__ == '__main__':
+    from json import dumps
+    print(dumps(run(), indent=4, sort_keys=True))
@@ -1,4 +1,6 @@
 from collections import deque, MutableMapping, ItemsView, ValuesView
+from sys import getsizeof
+import heapq
 
 
 class WindowDictItemsView(ItemsView):
@@ -81,6 +83,36 @@ class WindowDict(MutableMapping):
         if self._future:
             return self._future[0][0]
 
+    def value_at(self, rev):
+        """Return the value as of the revision, even if it's ``None``.
+        Raise ``KeyError`` if the revision is before the start of
+        history.
+
+        """
+        self.seek(rev)
+        if not self._past:
+            raise KeyError("Revision {} is before the start of history".format(rev))
+        return self._past[-1][1]
+
+    def values_from(self, rev):
+        """Iterate over the values set at the revision and after it"""
+        self.seek(rev)
+        if self._past and self._past[-1][0] == rev:
+            yield self._past[-1][1]
+        for (r, v) in self._future:
+            yield v
+
+    def changes(self, after, upto):
+        """Iterate over ``(rev, value)`` for the revisions set after
+        ``after``, up to and including ``upto``
+
+        """
+        self.seek(after)
+        for (r, v) in self._future:
+            if r > upto:
+                return
+            yield (r, v)
+
     def items(self):
         return WindowDictItemsView(self)
 
@@ -249,8 +281,119 @@ class StructuredDefaultDict(dict):
         raise TypeError("Can't set layer {}".format(self.layer))
 
 
+def _prune_branches(d, depth, branches):
+    """Delete ``branches`` from the dicts ``depth`` layers down in ``d``"""
+    for v in d.values():
+        if depth:
+            _prune_branches(v, depth - 1, branches)
+        else:
+            for branch in branches.intersection(v):
+                del v[branch]
+
+
+def deep_sizeof(obj, seen=None):
+    """Return the size of ``obj`` in bytes, along with everything in it,
+    counting each object only once however often it's referred to.
+
+    Follows the contents of containers and the attributes of other
+    objects, except the ``gorm`` attribute, and not into classes or
+    functions. Objects whose ids are in ``seen`` are skipped; pass
+    the same set to several calls to avoid counting anything twice.
+
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, type) or callable(o):
+            continue
+        seen.add(id(o))
+        size += getsizeof(o)
+        if isinstance(o, dict):
+            todo.extend(o.keys())
+            todo.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            todo.extend(o)
+        if hasattr(o, '__dict__'):
+            todo.extend(
+                v for (k, v) in vars(o).items() if k != 'gorm'
+            )
+        for k in getattr(type(o), '__slots__', ()):
+            if hasattr(o, k):
+                todo.append(getattr(o, k))
+    return size
+
+
+def window_dicts(obj):
+    """Iterate over the :class:`WindowDict` in ``obj``, which may be one,
+    or dictionaries of them nested to any depth
+
+    """
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if isinstance(o, WindowDict):
+            yield o
+        elif isinstance(o, dict):
+            todo.extend(o.values())
+
+
+def length_bucket(n):
+    """Return the greatest power of two no more than ``n``, or 0 for 0"""
+    return 1 << (n.bit_length() - 1) if n else 0
+
+
+def lineage_history(branches, lineage, rev_from, rev_to):
+    """Iterate over ``(rev, value)`` for the value a variable had at
+    ``rev_from``, and then for each revision up to ``rev_to`` where it
+    changed. ``None`` means it had none.
+
+    ``branches`` maps branch names to :class:`WindowDict` of the
+    variable's values in them. ``lineage`` is a list of the ``(branch,
+    rev)`` pairs from ``ORM._active_branches(branch, rev_to)``. Each
+    branch in it is followed back to the revision where its child
+    starts, and no further.
+
+    """
+    starts = [r for (b, r) in lineage[1:]] + [None]
+    uppers = [rev_to] + starts[:-1]
+
+    def value_at(rev):
+        for (i, start) in enumerate(starts):
+            if start is None or rev >= start:
+                break
+        for (j, (b, r)) in enumerate(lineage[i:], i):
+            if b in branches:
+                try:
+                    return branches[b].value_at(rev if j == i else r)
+                except KeyError:
+                    continue
+        return None
+
+    revs = {rev_from}
+    for ((b, r), start, upper) in zip(lineage, starts, uppers):
+        if b not in branches:
+            continue
+        lo = rev_from if start is None else max(start, rev_from)
+        hi = min(upper, rev_to)
+        if lo <= hi:
+            revs.update(r for (r, v) in branches[b].changes(lo - 1, hi))
+    last = first = object()
+    for rev in sorted(revs):
+        v = value_at(rev)
+        if last is first or v != last:
+            yield (rev, v)
+        last = v
+
 
 class Cache(object):
+    structures = (
+        'parents', 'keys', 'branches', 'shallow', 'shallower', 'keycache',
+        'memos', 'indices', 'changelog'
+    )
+    """Names of my attributes that hold what I've cached; see ``stats``"""
+
     def __init__(self, gorm):
         self.gorm = gorm
         self.parents = StructuredDefaultDict(3, FuturistWindowDict)
@@ -259,6 +402,39 @@ class Cache(object):
         self.branches = StructuredDefaultDict(1, FuturistWindowDict)
         self.shallow = PickyDefaultDict(FuturistWindowDict)
         self.shallower = {}
+        # the arguments to ``retrieve`` that I've remembered answers to in
+        # ``shallower``, keyed by entity and key, to forget when they change
+        self.memos = {}
+        self.indices = {}
+        # what was set in each graph, keyed by graph and branch, then by
+        # revision; for diffs and change streams
+        self.changelog = {}
+        self.counting = False
+        self.counts = None
+
+    def count(self, on=True):
+        """Start counting how I'm used, from zero, or stop.
+
+        While ``counting``, ``counts`` has how many times ``retrieve``
+        found its answer remembered in ``shallower``, found it in the
+        branch it was asked about, found it in an ancestor branch, or
+        found there was no value, under ``'retrieve'``; a histogram of
+        how many branches each retrieval not remembered in
+        ``shallower`` looked in, under ``'walked'``; and a histogram of
+        how many entries those retrievals made :meth:`WindowDict.seek`
+        move, 0, at least 1, 2, 4, 8..., under ``'seek'``. The counts
+        stay after I stop.
+
+        """
+        if on:
+            self.counts = {
+                'retrieve': {
+                    'shallower': 0, 'branch': 0, 'ancestor': 0, 'unset': 0
+                },
+                'walked': {},
+                'seek': {}
+            }
+        self.counting = on
 
     def _forward_keycache(self, parentity, branch, rev):
         keycache_key = parentity + (branch,)
@@ -275,12 +451,27 @@ class Cache(object):
     def store(self, *args):
         entity, key, branch, rev, value = args[-5:]
         parent = args[:-5]
+        indexed = parent + (key,) in self.indices
+        if indexed:
+            replaced = self._value_at(parent+(entity,key), branch, rev, exact=True)
         if parent:
             self.parents[parent][entity][key][branch][rev] = value
         self.keys[parent+(entity,)][key][branch][rev] = value
         self.branches[parent+(entity,key)][branch][rev] = value
         self.shallow[parent+(entity,key,branch)][rev] = value
+        for memo in self.memos.pop(parent+(entity,key), ()):
+            self.shallower.pop(memo, None)
         self.shallower[parent+(entity,key,branch,rev)] = value
+        try:
+            log = self.changelog[args[0], branch]
+        except KeyError:
+            log = self.changelog[args[0], branch] = WindowDict()
+        if log.has_exact_rev(rev):
+            log.value_at(rev).add(parent+(entity,key))
+        else:
+            log[rev] = {parent+(entity,key)}
+        if indexed:
+            self._index_store(parent+(key,), entity, branch, rev, value, replaced)
         self._forward_keycache(parent+(entity,), branch, rev)
         self._forward_keycache((entity,), branch, rev)
         keycached = None
@@ -298,28 +489,339 @@ class Cache(object):
             else:
                 kc[rev] = set([key])
 
+    def remove_branches(self, branches):
+        """Forget everything that happened in any of these branches."""
+        branches = set(branches)
+        _prune_branches(self.parents, 2, branches)
+        _prune_branches(self.keys, 1, branches)
+        _prune_branches(self.branches, 0, branches)
+        for k in [k for k in self.shallow if k[-1] in branches]:
+            del self.shallow[k]
+        for k in [k for k in self.shallower if k[-2] in branches]:
+            del self.shallower[k]
+        for memos in self.memos.values():
+            memos.difference_update(
+                [memo for memo in memos if memo[-2] in branches]
+            )
+        for k in [k for k in self.keycache if k[-1] in branches]:
+            del self.keycache[k]
+        for k in [k for k in self.changelog if k[-1] in branches]:
+            del self.changelog[k]
+        for index in self.indices.values():
+            for values in index.values():
+                for branch in branches.intersection(values):
+                    del values[branch]
+
+    def _value_at(self, k, branch, rev, exact=False):
+        """Return the value of ``k``, an entity and key, as of the branch
+        and revision, or ``None`` if it has none. Store nothing.
+
+        With ``exact``, only return a value set at that very
+        revision in that very branch.
+
+        """
+        if k not in self.branches or branch is None:
+            return None
+        branches = self.branches[k]
+        if exact:
+            if branch in branches and branches[branch].has_exact_rev(rev):
+                return branches[branch].value_at(rev)
+            return None
+        return self._lineage_value(branches, branch, rev)[0]
+
+    def _lineage_value(self, branches, branch, rev, seeks=None):
+        """Return the value in ``branches``, a dict of :class:`WindowDict`,
+        as of the branch and revision, or ``None`` if there's none;
+        and how many branches were looked in to find it.
+
+        If ``seeks`` is a dict, count how far each window dict had to
+        seek in it, bucketed by ``length_bucket``.
+
+        """
+        walked = 0
+        for (b, r) in self.gorm._active_branches(branch, rev):
+            walked += 1
+            if b in branches:
+                wd = branches[b]
+                if seeks is not None:
+                    before = len(wd._past)
+                    wd.seek(r)
+                    bucket = length_bucket(abs(len(wd._past) - before))
+                    seeks[bucket] = seeks.get(bucket, 0) + 1
+                try:
+                    return wd.value_at(r), walked
+                except KeyError:
+                    continue
+        return None, walked
+
+    def history(self, *args):
+        """Iterate over ``(rev, value)`` for the value of a key of an entity
+        at the start of a range of revisions, and then for every
+        revision in the range where it changed. Store nothing.
+
+        ``args`` are the entity, the key, the branch, and the first
+        and last revisions. See ``lineage_history``.
+
+        """
+        k = args[:-3]
+        (branch, rev_from, rev_to) = args[-3:]
+        branches = self.branches[k] if k in self.branches else {}
+        return lineage_history(
+            branches,
+            list(self.gorm._active_branches(branch, rev_to)),
+            rev_from,
+            rev_to
+        )
+
+    def changes(self, graph, branch, after, upto):
+        """Iterate over the variables of the graph set in the branch after
+        the revision ``after``, up to and including ``upto``. Each is a
+        tuple of the arguments to ``store`` besides the branch, rev, and
+        value.
+
+        """
+        if (graph, branch) not in self.changelog:
+            return
+        seen = set()
+        for (rev, changed) in self.changelog[graph, branch].changes(after, upto):
+            for var in changed - seen:
+                yield var
+            seen.update(changed)
+
+    def stream(self, branch, after, upto):
+        """Iterate over ``(rev, variable, value)`` for everything set in
+        the branch after the revision ``after``, up to and including
+        ``upto``, in order of revision, for every graph. ``variable`` is
+        a tuple of the arguments to ``store`` besides the branch, rev,
+        and value. Store nothing.
+
+        """
+        def tagged(i, log):
+            for (rev, changed) in log.changes(after, upto):
+                yield (rev, i, changed)
+        for (rev, i, changed) in heapq.merge(*[
+                tagged(i, log) for (i, ((graph, b), log))
+                in enumerate(self.changelog.items()) if b == branch
+        ]):
+            for var in changed:
+                yield (rev, var, self._value_at(var, branch, rev, exact=True))
+
+    def _graph_of(self, name, k):
+        """Private use. Return the graph that the key ``k`` of my structure
+        named ``name`` is about, or ``None`` if I can't tell.
+
+        """
+        if name == 'keycache' and len(k) == 2 and self.parents:
+            # keyed by the bare entity, which might be in any graph
+            return None
+        return k[0] if k[0] in self.gorm.graph else None
+
+    def stats(self):
+        """Return a dictionary describing how much I've cached.
+
+        ``'structures'`` has, for each of my ``structures``, the
+        number of entries in it, the number of :class:`WindowDict`, an
+        approximate number of bytes taken up by the structure and
+        everything in it, and a histogram of the lengths of the
+        window dicts: how many are at least 1, 2, 4, 8... long. An
+        entry is a revision in a window dict, or a remembered value in
+        ``shallower`` or ``memos``.
+
+        ``'graphs'`` has, for each graph, how many entries and
+        approximate bytes in all the structures are about it.
+        Entries about no particular graph are under ``None``.
+
+        ``'bytes'`` is the approximate size of everything, with what's
+        in several structures counted only once.
+
+        """
+        structures = {}
+        graphs = {}
+        graphseen = {}
+        for name in self.structures:
+            structure = getattr(self, name)
+            entries = windows = 0
+            lengths = {}
+            for (k, v) in structure.items():
+                if name == 'shallower':
+                    n = 1
+                elif name == 'memos':
+                    n = len(v)
+                else:
+                    n = 0
+                    for wd in window_dicts(v):
+                        windows += 1
+                        n += len(wd)
+                        bucket = length_bucket(len(wd))
+                        lengths[bucket] = lengths.get(bucket, 0) + 1
+                entries += n
+                g = self._graph_of(name, k)
+                if g not in graphs:
+                    graphs[g] = {'entries': 0, 'bytes': 0}
+                    graphseen[g] = set()
+                graphs[g]['entries'] += n
+                graphs[g]['bytes'] += deep_sizeof(k, graphseen[g]) \
+                    + deep_sizeof(v, graphseen[g])
+            structures[name] = {
+                'entries': entries,
+                'windows': windows,
+                'bytes': deep_sizeof(structure),
+                'lengths': dict(sorted(lengths.items()))
+            }
+        return {
+            'structures': structures,
+            'graphs': graphs,
+            'bytes': deep_sizeof(
+                [getattr(self, name) for name in self.structures]
+            )
+        }
+
+    def add_index(self, *args):
+        """Keep track of which entities have which values for a key, so
+        that ``index_lookup`` can find them without a scan.
+
+        ``args`` are the parent of the entities, if they have one, and
+        the key. Only hashable values are indexed.
+
+        """
+        if args in self.indices:
+            return
+        self.indices[args] = {}
+        (parent, key) = (args[:-1], args[-1])
+        events = []
+        for (k, branches) in self.branches.items():
+            if k[-1] != key or k[:-2] != parent:
+                continue
+            for (branch, revs) in branches.items():
+                depth = len(list(self.gorm._active_branches(branch, 0)))
+                for (rev, value) in revs.items():
+                    events.append((rev, depth, branch, k[-2], value))
+        # parent branches need to be complete as of when their children
+        # fork, so that the children copy the right sets
+        events.sort(key=lambda e: e[:2])
+        for (rev, depth, branch, entity, value) in events:
+            self._index_store(args, entity, branch, rev, value, None)
+
+    def _index_series(self, index, value, branch, rev):
+        """Return the sets of entities that have ``value`` in ``branch``,
+        over time, starting it with the set in the parent branch if need
+        be
+
+        """
+        values = index.setdefault(value, {})
+        if branch not in values:
+            series = values[branch] = WindowDict()
+            for (b, r) in self.gorm._active_branches(branch, rev):
+                if b != branch and b in values:
+                    try:
+                        series[r] = set(values[b][r])
+                    except KeyError:
+                        continue
+                    break
+        return values[branch]
+
+    def _index_update(self, series, rev, entity, present):
+        """Put ``entity`` in the set at ``rev`` and every later set, or take
+        it out
+
+        """
+        if not series.has_exact_rev(rev):
+            try:
+                series[rev] = set(series.value_at(rev))
+            except KeyError:
+                series[rev] = set()
+        for entities in series.values_from(rev):
+            if present:
+                entities.add(entity)
+            else:
+                entities.discard(entity)
+
+    def _index_store(self, ikey, entity, branch, rev, value, replaced):
+        """Note in the index that ``entity`` has ``value`` as of the branch
+        and revision, where it used to have ``replaced``
+
+        """
+        index = self.indices[ikey]
+        before = self._value_at(ikey[:-1]+(entity,ikey[-1]), branch, rev - 1)
+        if value == before and (replaced is None or replaced == value):
+            return
+        for old in (before, replaced):
+            if old is None or old == value:
+                continue
+            try:
+                series = self._index_series(index, old, branch, rev)
+            except TypeError:
+                continue
+            self._index_update(series, rev, entity, False)
+        if value is None:
+            return
+        try:
+            series = self._index_series(index, value, branch, rev)
+        except TypeError:
+            return
+        self._index_update(series, rev, entity, True)
+
+    def index_lookup(self, *args):
+        """Return a frozenset of the entities whose key has the value, as
+        of the branch and revision.
+
+        ``args`` are the parent, if any, the key, the value, the
+        branch, and the revision. The key must have been passed to
+        ``add_index``.
+
+        """
+        ikey = args[:-3]
+        (value, branch, rev) = args[-3:]
+        values = self.indices[ikey].get(value)
+        if values:
+            for (b, r) in self.gorm._active_branches(branch, rev):
+                if b in values:
+                    try:
+                        return frozenset(values[b][r])
+                    except KeyError:
+                        continue
+        return frozenset()
+
     def retrieve(self, *args):
+        """Return the value of a key of an entity at a branch and revision,
+        or raise ``KeyError`` if it hasn't got one.
+
+        Remember the answer until the key is stored again. Store
+        nothing else: a value inherited from another branch, or an
+        earlier revision, stays there.
+
+        While ``counting``, count which way I found the answer.
+
+        """
+        counts = self.counts if self.counting else None
         try:
             ret = self.shallower[args]
-            if ret is None:
-                raise ValueError
-            return ret
-        except ValueError:
-            raise KeyError("Set, then deleted")
         except KeyError:
-            pass
-        entity = args[:-3]
-        key, branch, rev = args[-3:]
-        if rev not in self.shallow[entity+(key, branch)]:
-            for (b, r) in self.gorm._active_branches(branch, rev):
-                if b in self.branches[entity+(key,)]:
-                    v = self.branches[entity+(key,)][b][r]
-                    self.store(*entity+(key, branch, rev, v))
-                    self.store(*entity+(key, b, r, v))
-                    break
+            k = args[:-2]
+            (branch, rev) = args[-2:]
+            if k not in self.branches or branch is None:
+                (ret, walked) = (None, 0)
             else:
-                self.store(*entity+(key, branch, rev, None))
-        ret = self.shallower[args] = self.shallow[entity+(key,branch)][rev]
+                (ret, walked) = self._lineage_value(
+                    self.branches[k], branch, rev,
+                    None if counts is None else counts['seek']
+                )
+            self.shallower[args] = ret
+            self.memos.setdefault(k, set()).add(args)
+            if counts is not None:
+                if ret is None:
+                    path = 'unset'
+                elif walked == 1:
+                    path = 'branch'
+                else:
+                    path = 'ancestor'
+                counts['retrieve'][path] += 1
+                counts['walked'][walked] = counts['walked'].get(walked, 0) + 1
+        else:
+            if counts is not None:
+                counts['retrieve']['shallower'] += 1
+        if ret is None:
+            raise KeyError("Set, then deleted")
         return ret
 
     def iter_entities_or_keys(self, *args):
@@ -369,6 +871,8 @@ class NodesCache(Cache):
 
 
 class EdgesCache(Cache):
+    structures = Cache.structures + ('predecessors',)
+
     def __init__(self, gorm):
         Cache.__init__(self, gorm)
         self.predecessors = StructuredDefaultDict(3, FuturistWindowDict)
@@ -378,3 +882,8 @@ class EdgesCache(Cache):
             ex = None
         Cache.store(self, graph, nodeA, nodeB, idx, branch, rev, ex)
         self.predecessors[(graph, nodeB)][nodeA][idx][branch][rev] = ex
+
+    def remove_branches(self, branches):
+        Cache.remove_branches(self, branches)
+        _prune_branches(self.predecessors, 2, set(branches))
+
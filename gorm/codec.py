@@ -0,0 +1,317 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Ways of turning keys and values into something the database can
+store, and back again.
+
+Each database uses one codec for all its keys and values. Pick it with
+the ``codec`` argument to :class:`gorm.ORM` when you make the database;
+gorm remembers which it was from then on.
+
+"""
+from struct import Struct
+from base64 import b64encode, b64decode
+from hashlib import blake2b
+import zlib
+from . import xjson
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+class Codec(object):
+    """Abstract class for turning Python objects into something to put in
+    the database.
+
+    ``binary`` says whether I make ``bytes``, in which case the
+    database gets BLOB columns for keys and values, or ``str``.
+
+    """
+    name = None
+    binary = False
+
+    def dump(self, obj):
+        raise NotImplementedError
+
+    def load(self, s):
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """The original gorm encoding, JSON that distinguishes lists from
+    tuples. See :mod:`gorm.xjson`.
+
+    """
+    name = 'json'
+
+    def dump(self, obj):
+        return xjson.json_dump(obj)
+
+    def load(self, s):
+        return xjson.json_load(s)
+
+
+NONE = 0
+FALSE = 1
+TRUE = 2
+INT32 = 3
+INT64 = 4
+BIGINT = 5
+FLOAT = 6
+STR = 7
+BYTES = 8
+TUPLE = 9
+LIST = 10
+DICT = 11
+
+tag = Struct('<B')
+int32 = Struct('<Bi')
+int64 = Struct('<Bq')
+double = Struct('<Bd')
+sized = Struct('<BI')
+unpack_int32 = Struct('<i').unpack_from
+unpack_int64 = Struct('<q').unpack_from
+unpack_double = Struct('<d').unpack_from
+unpack_size = Struct('<I').unpack_from
+singletons = {
+    None: tag.pack(NONE),
+    False: tag.pack(FALSE),
+    True: tag.pack(TRUE)
+}
+
+
+def _enc(o, out):
+    """Append the encoding of ``o`` to the list ``out``"""
+    if o is None or o is True or o is False:
+        out.append(singletons[o])
+    elif isinstance(o, int):
+        if -0x80000000 <= o < 0x80000000:
+            out.append(int32.pack(INT32, o))
+        elif -0x8000000000000000 <= o < 0x8000000000000000:
+            out.append(int64.pack(INT64, o))
+        else:
+            b = o.to_bytes(
+                (o + (o < 0)).bit_length() // 8 + 1, 'little', signed=True
+            )
+            out.append(sized.pack(BIGINT, len(b)))
+            out.append(b)
+    elif isinstance(o, float):
+        out.append(double.pack(FLOAT, o))
+    elif isinstance(o, str):
+        b = o.encode('utf-8')
+        out.append(sized.pack(STR, len(b)))
+        out.append(b)
+    elif isinstance(o, bytes):
+        out.append(sized.pack(BYTES, len(o)))
+        out.append(o)
+    elif isinstance(o, tuple):
+        out.append(sized.pack(TUPLE, len(o)))
+        for p in o:
+            _enc(p, out)
+    elif isinstance(o, list):
+        out.append(sized.pack(LIST, len(o)))
+        for p in o:
+            _enc(p, out)
+    elif isinstance(o, dict):
+        out.append(sized.pack(DICT, len(o)))
+        # in order of the keys' encodings, which needn't be comparable
+        # themselves, so that equal dicts encode the same
+        items = []
+        for (k, v) in o.items():
+            kout = []
+            _enc(k, kout)
+            items.append((b''.join(kout), v))
+        items.sort(key=lambda item: item[0])
+        for (k, v) in items:
+            out.append(k)
+            _enc(v, out)
+    else:
+        raise TypeError(
+            "Can't encode {} of type {}".format(repr(o), type(o).__name__)
+        )
+
+
+def _dec(b, i):
+    """Decode the object at offset ``i`` of ``b``. Return it along with
+    the offset just past it.
+
+    """
+    t = b[i]
+    i += 1
+    if t == INT32:
+        return unpack_int32(b, i)[0], i + 4
+    if t == STR:
+        (n,) = unpack_size(b, i)
+        i += 4
+        return str(b[i:i+n], 'utf-8'), i + n
+    if t == FLOAT:
+        return unpack_double(b, i)[0], i + 8
+    if t == NONE:
+        return None, i
+    if t == FALSE:
+        return False, i
+    if t == TRUE:
+        return True, i
+    if t == INT64:
+        return unpack_int64(b, i)[0], i + 8
+    (n,) = unpack_size(b, i)
+    i += 4
+    if t == BIGINT:
+        return int.from_bytes(b[i:i+n], 'little', signed=True), i + n
+    if t == BYTES:
+        return bytes(b[i:i+n]), i + n
+    if t == TUPLE or t == LIST:
+        r = []
+        for _ in range(n):
+            (v, i) = _dec(b, i)
+            r.append(v)
+        return (tuple(r) if t == TUPLE else r), i
+    if t == DICT:
+        r = {}
+        for _ in range(n):
+            (k, i) = _dec(b, i)
+            (v, i) = _dec(b, i)
+            r[k] = v
+        return r, i
+    raise ValueError("Unknown type tag {} at offset {}".format(t, i - 1))
+
+
+class BinaryCodec(Codec):
+    """Compact encoding with :mod:`struct`, for ``None``, booleans, ints,
+    floats, strings, bytes, and tuples, lists, and dicts of those.
+
+    Each object starts with a one-byte type tag. Numbers are
+    fixed-width little-endian, and everything else is prefixed with
+    its length. Dicts are written in the order of their keys'
+    encodings, and so load in that order, however they were built.
+
+    Objects of the same types that are equal have equal encodings,
+    so encodings can serve as keys. But the tag keeps the type:
+    ``1``, ``1.0``, and ``True`` are equal in Python and encode
+    differently, as do a list and a tuple of the same things, and
+    dicts holding them.
+
+    """
+    name = 'binary'
+    binary = True
+
+    def dump(self, obj):
+        out = []
+        _enc(obj, out)
+        return b''.join(out)
+
+    def load(self, s):
+        if s is None:
+            return None
+        if not isinstance(s, bytes):
+            s = bytes(s)
+        (r, i) = _dec(s, 0)
+        if i != len(s):
+            raise ValueError(
+                "{} trailing bytes after encoded object".format(len(s) - i)
+            )
+        return r
+
+
+codecs = {codec.name: codec for codec in (JSONCodec(), BinaryCodec())}
+"""Instances of the codecs available, keyed by name"""
+
+
+def get_codec(codec):
+    """Return the codec by this name, or ``codec`` itself if it's already
+    a :class:`Codec`
+
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in codecs:
+        raise ValueError("Unknown codec: {}".format(codec))
+    return codecs[codec]
+
+
+compressors = {'zlib': (zlib.compress, zlib.decompress)}
+"""Pairs of functions to compress and decompress bytes, keyed by name"""
+if lzma is not None:
+    compressors['lzma'] = (lzma.compress, lzma.decompress)
+compression_ids = {'zlib': 1, 'lzma': 2}
+compression_names = {v: k for (k, v) in compression_ids.items()}
+text_marker = '~'
+"""What compressed text starts with. No JSON does."""
+binary_marker = 0xff
+"""What compressed bytes start with. It's not a type tag of the
+binary codec.
+
+"""
+
+
+def compress(s, method='zlib'):
+    """Return ``s``, the output of some codec's ``dump``, compressed with
+    the named method and marked so that ``decompress`` knows it.
+
+    Compressed text is base64-encoded, to stay text.
+
+    """
+    squash = compressors[method][0]
+    if isinstance(s, str):
+        return '{}{}:{}'.format(
+            text_marker, method,
+            b64encode(squash(s.encode('utf-8'))).decode('ascii')
+        )
+    return bytes((binary_marker, compression_ids[method])) + squash(s)
+
+
+def decompress(s):
+    """If ``s`` was made by ``compress``, return it as it was before.
+    Otherwise return it unchanged.
+
+    """
+    if not s:
+        return s
+    if isinstance(s, str):
+        if s[0] != text_marker:
+            return s
+        (method, data) = s[1:].split(':', 1)
+        return compressors[method][1](b64decode(data)).decode('utf-8')
+    if s[0] != binary_marker:
+        return s
+    return compressors[compression_names[s[1]]][1](bytes(s[2:]))
+
+
+def decompressing(load):
+    """Return a function like ``load`` that decompresses its argument
+    first, if need be
+
+    """
+    def load_decompressed(s):
+        return load(decompress(s))
+    return load_decompressed
+
+
+reference_text_marker = '#'
+"""What references to stored text start with"""
+reference_binary_marker = 0xfe
+"""What references to stored bytes start with"""
+
+
+def reference(s):
+    """Return a reference to ``s``, an encoded value, made from its hash.
+
+    No codec and no compression makes anything that looks like a
+    reference.
+
+    """
+    if isinstance(s, str):
+        return reference_text_marker + blake2b(
+            s.encode('utf-8'), digest_size=20
+        ).hexdigest()
+    return bytes((reference_binary_marker,)) \
+        + blake2b(s, digest_size=20).digest()
+
+
+def is_reference(s):
+    """Return whether ``s`` was made by ``reference``"""
+    if not s:
+        return False
+    if isinstance(s, str):
+        return s[0] == reference_text_marker
+    return s[0] == reference_binary_marker
@@ -2,8 +2,10 @@
 # Copyright (C) 2014 Zachary Spector.
 import networkx
 from networkx.exception import NetworkXError
-from collections import MutableMapping, defaultdict
+from collections import MutableMapping
 from operator import attrgetter
+from array import array
+from .query import where_op, where_ops
 from .xjson import (
     JSONWrapper,
     JSONListWrapper,
@@ -16,8 +18,52 @@ def getatt(attribute_name):
     """An easy way to make an alias"""
     return property(attrgetter(attribute_name))
 
+
+def _intern(graph, cls, key, *args):
+    """Return the instance of ``cls`` for ``key`` in ``graph`` that its
+    ORM already has, if it does, or else make one with ``args``.
+
+    The ORM only keeps weak references to these, so they go away when
+    nobody's using them.
+
+    """
+    k = (cls, graph.name) + key
+    ret = graph.gorm._entities.get(k)
+    if ret is None:
+        ret = graph.gorm._entities[k] = cls(*args)
+    return ret
+
+def _array(typecode, items):
+    """Return ``items`` in a NumPy array if NumPy is installed, else in an
+    :class:`array.array`. ``typecode`` is ``'q'`` for integers or
+    ``'d'`` for floats.
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        return array(typecode, items)
+    return numpy.array(
+        items, dtype={'q': numpy.int64, 'd': numpy.float64}[typecode]
+    )
+
+
+def _matrix(rows, width):
+    """Return ``rows``, lists of floats ``width`` long, as a 2-D NumPy
+    array if NumPy is installed, else as a list of
+    :class:`array.array`
+
+    """
+    try:
+        import numpy
+    except ImportError:
+        return [array('d', row) for row in rows]
+    return numpy.array(rows, dtype=numpy.float64).reshape(len(rows), width)
+
+
 def convert_to_networkx_graph(data,create_using=None,multigraph_input=False):
     if isinstance(data, GormGraph):
+        data = data.snapshot()
         result = networkx.convert.from_dict_of_dicts(
             data.adj,
             create_using=create_using,
@@ -31,6 +77,8 @@ def convert_to_networkx_graph(data,create_using=None,multigraph_input=False):
 
 
 class NeatMapping(MutableMapping):
+    __slots__ = ()
+
     def clear(self):
         """Delete everything"""
         for k in list(self.keys()):
@@ -55,6 +103,8 @@ class NeatMapping(MutableMapping):
 
 
 class AbstractEntityMapping(NeatMapping):
+    __slots__ = ('graph', '_wrappers', '__weakref__')
+
     def _iter_keys_db(self):
         """Return a list of keys from the database (not the cache)."""
         raise NotImplementedError
@@ -84,6 +134,28 @@ class AbstractEntityMapping(NeatMapping):
     def _del_cache(self, key):
         self._set_cache(key, None)
 
+    def _history_db(self, key, branch, rev_from, rev_to):
+        """Return the history of a key from the database (not the cache)."""
+        raise NotImplementedError
+
+    def _history_cache(self, key, branch, rev_from, rev_to):
+        raise NotImplementedError
+
+    def history(self, key, rev_from, rev_to, branch=None):
+        """Iterate over ``(rev, value)`` for my value for ``key`` at
+        ``rev_from``, and then at each revision up to ``rev_to`` where
+        it changed, in the branch (by default, the present one) and
+        the ones it's descended from. ``None`` means the key wasn't set.
+
+        This doesn't change the present revision, nor put anything in
+        the cache.
+
+        """
+        branch = self.gorm.branch if branch is None else branch
+        if self.gorm.caching:
+            return self._history_cache(key, branch, rev_from, rev_to)
+        return self._history_db(key, branch, rev_from, rev_to)
+
     def __iter__(self):
         if self.gorm.caching:
             return self._iter_keys_cache()
@@ -101,21 +173,32 @@ class AbstractEntityMapping(NeatMapping):
         value of the key and return that
 
         """
-        def wrapval(v):
-            if isinstance(v, list):
-                if self.gorm.caching:
-                    return JSONListReWrapper(self, key, v)
-                return JSONListWrapper(self, key)
-            elif isinstance(v, dict):
-                if self.gorm.caching:
-                    return JSONReWrapper(self, key, v)
-                return JSONWrapper(self, key)
-            else:
-                return v
-
         if self.gorm.caching:
-            return wrapval(self._get_cache(key))
-        return wrapval(self._get(key))
+            v = self._get_cache(key)
+            if isinstance(v, (list, dict)):
+                return self._wrap(key, v)
+            return v
+        v = self._get_db(key)
+        if isinstance(v, list):
+            return JSONListWrapper(self, key)
+        elif isinstance(v, dict):
+            return JSONWrapper(self, key)
+        return v
+
+    def _wrap(self, key, v):
+        """Return a copy-on-write wrapper for ``v``, the value of ``key``,
+        reusing the one I made last time if it still wraps ``v``
+
+        """
+        try:
+            wrappers = self._wrappers
+        except AttributeError:
+            wrappers = self._wrappers = {}
+        w = wrappers.get(key)
+        if w is None or w._v is not v:
+            cls = JSONReWrapper if isinstance(v, dict) else JSONListReWrapper
+            w = wrappers[key] = cls(self, key, v, self.gorm._owned)
+        return w
 
     def __setitem__(self, key, value):
         """Set key=value at the present branch and revision"""
@@ -133,7 +216,9 @@ class AbstractEntityMapping(NeatMapping):
 
 class GraphMapping(AbstractEntityMapping):
     """Mapping for graph attributes"""
+    __slots__ = ()
     gorm = getatt('graph.gorm')
+
     def __init__(self, graph):
         """Initialize private dict and store pointers to the graph and ORM"""
         self.graph = graph
@@ -166,6 +251,16 @@ class GraphMapping(AbstractEntityMapping):
         )
     _get = _get_cache
 
+    def _history_db(self, key, branch, rev_from, rev_to):
+        return self.gorm.db.graph_val_history(
+            self.graph.name, key, branch, rev_from, rev_to
+        )
+
+    def _history_cache(self, key, branch, rev_from, rev_to):
+        return self.gorm._graph_val_cache.history(
+            self.graph.name, key, branch, rev_from, rev_to
+        )
+
     def _set_db(self, key, value):
         """Set key=value in the database (not the cache)"""
         self.gorm.db.graph_val_set(
@@ -194,6 +289,7 @@ class GraphMapping(AbstractEntityMapping):
 
 class Node(AbstractEntityMapping):
     """Mapping for node attributes"""
+    __slots__ = ('node',)
     gorm = getatt('graph.gorm')
 
     def __init__(self, graph, node):
@@ -228,6 +324,16 @@ class Node(AbstractEntityMapping):
             self.graph.name, self.node, key, self.gorm.branch, self.gorm.rev
         )
 
+    def _history_db(self, key, branch, rev_from, rev_to):
+        return self.gorm.db.node_val_history(
+            self.graph.name, self.node, key, branch, rev_from, rev_to
+        )
+
+    def _history_cache(self, key, branch, rev_from, rev_to):
+        return self.gorm._node_val_cache.history(
+            self.graph.name, self.node, key, branch, rev_from, rev_to
+        )
+
     def _set_db(self, key, value):
         self.gorm.db.node_val_set(
             self.graph.name,
@@ -260,6 +366,7 @@ class Node(AbstractEntityMapping):
 
 class Edge(AbstractEntityMapping):
     """Mapping for edge attributes"""
+    __slots__ = ('nodeA', 'nodeB', 'idx')
     gorm = getatt('graph.gorm')
 
     def __init__(self, graph, nodeA, nodeB, idx=0):
@@ -315,6 +422,18 @@ class Edge(AbstractEntityMapping):
             self.gorm.rev
         )
 
+    def _history_db(self, key, branch, rev_from, rev_to):
+        return self.gorm.db.edge_val_history(
+            self.graph.name, self.nodeA, self.nodeB, self.idx, key,
+            branch, rev_from, rev_to
+        )
+
+    def _history_cache(self, key, branch, rev_from, rev_to):
+        return self.gorm._edge_val_cache.history(
+            self.graph.name, self.nodeA, self.nodeB, self.idx, key,
+            branch, rev_from, rev_to
+        )
+
     def _set_db(self, key, value):
         self.gorm.db.edge_val_set(
             self.graph.name,
@@ -386,7 +505,7 @@ class GraphNodeMapping(NeatMapping):
         """If the node exists at present, return it, else throw KeyError"""
         if node not in self:
             raise KeyError("Node doesn't exist")
-        return Node(self.graph, node)
+        return _intern(self.graph, Node, (node,), self.graph, node)
 
     def __setitem__(self, node, dikt):
         """Only accept dict-like values for assignment. These are taken to be
@@ -401,7 +520,7 @@ class GraphNodeMapping(NeatMapping):
             self.gorm.rev,
             True
         )
-        n = Node(self.graph, node)
+        n = _intern(self.graph, Node, (node,), self.graph, node)
         n.clear()
         n.update(dikt)
         if self.gorm.caching:
@@ -459,11 +578,7 @@ class GraphEdgeMapping(NeatMapping):
     for a graph.
 
     """
-    _metacache = defaultdict(dict)
-
-    @property
-    def _cache(self):
-        return self._metacache[id(self)]
+    __slots__ = ('__weakref__',)
 
     @property
     def gorm(self):
@@ -496,13 +611,9 @@ class GraphEdgeMapping(NeatMapping):
 
 
 class AbstractSuccessors(GraphEdgeMapping):
+    __slots__ = ('container', 'nodeA')
     graph = getatt('container.graph')
     gorm = getatt('container.graph.gorm')
-    _metacache = defaultdict(dict)
-
-    @property
-    def _cache(self):
-        return self._metacache[id(self)]
 
     def __init__(self, container, nodeA):
         """Store container and node"""
@@ -554,16 +665,15 @@ class AbstractSuccessors(GraphEdgeMapping):
         return n
 
     def _make_edge(self, nodeB):
-        return Edge(self.graph, self.nodeA, nodeB)
+        return _intern(
+            self.graph, Edge, (self.nodeA, nodeB, 0),
+            self.graph, self.nodeA, nodeB
+        )
 
     def __getitem__(self, nodeB):
         """Get the edge between my nodeA and the given node"""
         if nodeB not in self:
             raise KeyError("No edge {}->{}".format(self.nodeA, nodeB))
-        if self.gorm.caching:
-            if nodeB not in self._cache:
-                self._cache[nodeB] = self._make_edge(nodeB)
-            return self._cache[nodeB]
         return self._make_edge(nodeB)
 
     def __setitem__(self, nodeB, value):
@@ -625,35 +735,36 @@ class AbstractSuccessors(GraphEdgeMapping):
 class GraphSuccessorsMapping(GraphEdgeMapping):
     """Mapping for Successors (itself a MutableMapping)"""
     class Successors(AbstractSuccessors):
+        __slots__ = ()
+
         def _order_nodes(self, nodeB):
             if nodeB < self.nodeA:
                 return (nodeB, self.nodeA)
             else:
                 return (self.nodeA, nodeB)
 
+    def _getsucc(self, nodeA):
+        return _intern(
+            self.graph, self.Successors, (nodeA,), self, nodeA
+        )
+
     def __getitem__(self, nodeA):
         if nodeA not in self:
             raise KeyError("No edges from {}".format(nodeA))
-        if nodeA not in self._cache:
-            self._cache[nodeA] = self.Successors(self, nodeA)
-        return self._cache[nodeA]
+        return self._getsucc(nodeA)
 
     def __setitem__(self, nodeA, val):
         """Wipe out any edges presently emanating from nodeA and replace them
         with those described by val
 
         """
-        if nodeA in self:
-            sucs = self[nodeA]
-        else:
-            sucs = self._cache[nodeA] = self.Successors(self, nodeA)
+        sucs = self._getsucc(nodeA)
         sucs.clear()
         sucs.update(val)
 
     def __delitem__(self, nodeA):
         """Wipe out edges emanating from nodeA"""
         self[nodeA].clear()
-        del self._cache[nodeA]
 
     def __iter__(self):
         return iter(self.graph.node)
@@ -667,6 +778,8 @@ class GraphSuccessorsMapping(GraphEdgeMapping):
 
 class DiGraphSuccessorsMapping(GraphSuccessorsMapping):
     class Successors(AbstractSuccessors):
+        __slots__ = ()
+
         def _order_nodes(self, nodeB):
             return (self.nodeA, nodeB)
 
@@ -676,7 +789,6 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
     the nodeB provided to this
 
     """
-    _predcache = defaultdict(dict)
     def __contains__(self, nodeB):
         return nodeB in self.graph.node
 
@@ -687,15 +799,12 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
         """
         if nodeB not in self:
             raise KeyError("No edges available")
-        if nodeB not in self._cache:
-            self._cache[nodeB] = self.Predecessors(self, nodeB)
-        return self._cache[nodeB]
+        return self._getpreds(nodeB)
 
     def _getpreds(self, nodeB):
-        cache = self._predcache[id(self)]
-        if nodeB not in cache:
-            cache[nodeB] = self.Predecessors(self, nodeB)
-        return cache[nodeB]
+        return _intern(
+            self.graph, self.Predecessors, (nodeB,), self, nodeB
+        )
 
     def __setitem__(self, nodeB, val):
         """Interpret ``val`` as a mapping of edges that end at ``nodeB``"""
@@ -715,6 +824,8 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
 
     class Predecessors(GraphEdgeMapping):
         """Mapping of Edges that end at a particular node"""
+        __slots__ = ('container', 'nodeB')
+
         @property
         def graph(self):
             return self.container.graph
@@ -780,7 +891,10 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
             return n
 
         def _make_edge(self, nodeA):
-            return Edge(self.graph, nodeA, self.nodeB)
+            return _intern(
+                self.graph, Edge, (nodeA, self.nodeB, 0),
+                self.graph, nodeA, self.nodeB
+            )
 
         def __getitem__(self, nodeA):
             """Get the edge from the given node to mine"""
@@ -851,15 +965,13 @@ class MultiEdges(GraphEdgeMapping):
     def __init__(self, graph, nodeA, nodeB):
         """Store graph and node IDs"""
         self.graph = graph
-        self.gorm = graph.gorm
         self.nodeA = nodeA
         self.nodeB = nodeB
-        self._cache = {}
 
     def __iter__(self):
         if self.gorm.caching:
             return self.gorm._edges_cache.iter_keys(
-                self.graph.name, self.nodeA, self.nodeB, self.gorm.brach, self.gorm.rev
+                self.graph.name, self.nodeA, self.nodeB, self.gorm.branch, self.gorm.rev
             )
         return self.gorm.db.multi_edges(
             self.graph.name,
@@ -891,9 +1003,10 @@ class MultiEdges(GraphEdgeMapping):
         )
 
     def _getedge(self, idx):
-        if idx not in self._cache:
-            self._cache[idx] = Edge(self.graph, self.nodeA, self.nodeB, idx)
-        return self._cache[idx]
+        return _intern(
+            self.graph, Edge, (self.nodeA, self.nodeB, idx),
+            self.graph, self.nodeA, self.nodeB, idx
+        )
 
     def __getitem__(self, idx):
         """Get an Edge with a particular index, if it exists at the present
@@ -932,7 +1045,6 @@ class MultiEdges(GraphEdgeMapping):
         if not e.exists:
             raise KeyError("No edge at that index")
         e.clear()
-        del self._cache[idx]
         if self.gorm.caching:
             self.gorm._edges_cache.remember(
                 self.graph.name, self.nodeA, self.nodeB, idx, self.gorm.branch, self.gorm.rev
@@ -950,12 +1062,7 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
         """If the node exists, return its Successors"""
         if nodeA not in self.graph.node:
             raise KeyError("No such node")
-        return self.Successors(self, nodeA)
-
-    def _getsucc(self, nodeA):
-        if nodeA not in self._cache:
-            self._cache[nodeA] = self.Successors(self, nodeA)
-        return self._cache[nodeA]
+        return self._getsucc(nodeA)
 
     def __setitem__(self, nodeA, val):
         """Interpret ``val`` as a mapping of successors, and turn it into a
@@ -968,23 +1075,23 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
 
     def __delitem__(self, nodeA):
         """Disconnect this node from everything"""
-        succs = self._getsucc(nodeA)
-        succs.clear()
-        del self._cache[nodeA]
+        self._getsucc(nodeA).clear()
 
     class Successors(AbstractSuccessors):
         """Edges succeeding a given node in a multigraph"""
+        __slots__ = ()
+
         def _order_nodes(self, nodeB):
             if nodeB < self.nodeA:
                 return(nodeB, self.nodeA)
             else:
                 return (self.nodeA, nodeB)
 
-        _multedge = {}
         def _get_multedge(self, nodeB):
-            if nodeB not in self._multedge:
-                self._multedge[nodeB] = MultiEdges(self.graph, *self._order_nodes(nodeB))
-            return self._multedge[nodeB]
+            nodes = self._order_nodes(nodeB)
+            return _intern(
+                self.graph, MultiEdges, nodes, self.graph, *nodes
+            )
 
         def __getitem__(self, nodeB):
             """Return MultiEdges to ``nodeB`` if it exists"""
@@ -1002,16 +1109,20 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
         def __delitem__(self, nodeB):
             """Delete all edges between my ``nodeA`` and the given ``nodeB``"""
             self[nodeB].clear()
-            del self._multedge[nodeB]
 
 
 class MultiDiGraphPredecessorsMapping(DiGraphPredecessorsMapping):
     """Version of DiGraphPredecessorsMapping for multigraphs"""
     class Predecessors(DiGraphPredecessorsMapping.Predecessors):
         """Predecessor edges from a given node"""
+        __slots__ = ()
+
         def __getitem__(self, nodeA):
             """Get MultiEdges"""
-            return MultiEdges(self.graph, nodeA, self.nodeB)
+            return _intern(
+                self.graph, MultiEdges, (nodeA, self.nodeB),
+                self.graph, nodeA, self.nodeB
+            )
 
         def __setitem__(self, nodeA, val):
             self[nodeA].update(val)
@@ -1025,20 +1136,24 @@ class GormGraph(object):
     common.
 
     """
-    _succs = {}
-    _statmaps = {}
+    def _mapping(self, attr, cls):
+        """Return my mapping of class ``cls``, kept in my attribute named
+        ``attr``, making it if need be
+
+        """
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            ret = self.__dict__[attr] = cls(self)
+            return ret
+
     @property
     def graph(self):
-        if self._name not in self._statmaps:
-            self._statmaps[self._name] = GraphMapping(self)
-        return self._statmaps[self._name]
+        return self._mapping('_statmap', GraphMapping)
 
-    _nodemaps = {}
     @property
     def node(self):
-        if self._name not in self._nodemaps:
-            self._nodemaps[self._name] = GraphNodeMapping(self)
-        return self._nodemaps[self._name]
+        return self._mapping('_nodemap', GraphNodeMapping)
 
     def nodes(self):
         if self.gorm.caching:
@@ -1051,6 +1166,346 @@ class GormGraph(object):
             ):
                 yield node
 
+    def nodes_where(self, key, op, value):
+        """Iterate over the nodes whose value for ``key`` compares to
+        ``value`` the way ``op`` says.
+
+        ``op`` is one of ``'=='``, ``'!='``, ``'<'``, ``'<='``,
+        ``'>'``, ``'>='``, or their names, like ``'le'``. Nodes that
+        don't have the key, or whose value can't be compared, are
+        left out. Without caching, the database does the comparing,
+        and values that don't match never get loaded. See also
+        ``add_node_index``.
+
+        """
+        op = where_op(op)
+        if not self.gorm.caching:
+            for node in self.gorm.db.nodes_where(
+                self._name, key, op, value, self.gorm.branch, self.gorm.rev
+            ):
+                yield node
+            return
+        cmp = where_ops[op]
+        branch = self.gorm.branch
+        rev = self.gorm.rev
+        cache = self.gorm._node_val_cache
+        if op == 'eq' and (self._name, key) in cache.indices:
+            try:
+                found = cache.index_lookup(self._name, key, value, branch, rev)
+            except TypeError:
+                pass
+            else:
+                extant = self.gorm._nodes_cache.contains_entity
+                for node in found:
+                    if extant(self._name, node, branch, rev):
+                        yield node
+                return
+        retrieve = cache.retrieve
+        for node in list(self.gorm._nodes_cache.iter_entities(self._name, branch, rev)):
+            try:
+                if cmp(retrieve(self._name, node, key, branch, rev), value):
+                    yield node
+            except (KeyError, TypeError):
+                continue
+
+    def snapshot(self, branch=None, rev=None):
+        """Return a frozen copy of me as I was at the given branch and
+        revision (by default, the present ones), as an instance of the
+        plain networkx class that I'm based on.
+
+        Snapshots are kept until something is set in this graph, in
+        their branch or one they're descended from, at or before their
+        revision, so asking for the same one again costs nothing.
+        Don't change the values in them; they may be shared with the
+        cache.
+
+        """
+        branch = self.gorm.branch if branch is None else branch
+        rev = self.gorm.rev if rev is None else rev
+        snaps = self.gorm._snapshots.setdefault(self._name, {})
+        if (branch, rev) not in snaps:
+            snaps[branch, rev] = networkx.freeze(self._snapshot(branch, rev))
+        return snaps[branch, rev]
+
+    def _nodes_at(self, branch, rev):
+        """Return a list of the nodes that exist at the branch and
+        revision, reading the cache without storing anything in it
+
+        """
+        if not self.gorm.caching:
+            return list(self.gorm.db.nodes_extant(self._name, branch, rev))
+        cache = self.gorm._nodes_cache
+        if (self._name,) not in cache.keys:
+            return []
+        return [
+            node for node in cache.keys[(self._name,)]
+            if cache._value_at((self._name, node), branch, rev)
+        ]
+
+    def _edges_at(self, nodes, branch, rev):
+        """Iterate over ``(nodeA, nodeB, idx)`` for the edges between
+        ``nodes`` that exist at the branch and revision
+
+        """
+        name = self._name
+        if not self.gorm.caching:
+            for (nodeA, nodeB, idx) in self.gorm.db.graph_edges(name, branch, rev):
+                if nodeA in nodes and nodeB in nodes:
+                    yield (nodeA, nodeB, idx)
+            return
+        cache = self.gorm._edges_cache
+        for nodeA in nodes:
+            for (nodeB, idxs) in cache.parents.get((name, nodeA), {}).items():
+                if nodeB not in nodes:
+                    continue
+                for idx in idxs:
+                    if cache._value_at((name, nodeA, nodeB, idx), branch, rev):
+                        yield (nodeA, nodeB, idx)
+
+    def _snapshot(self, branch, rev):
+        """Make the networkx graph for ``snapshot``, reading the caches
+        without storing anything in them
+
+        """
+        for cls in type(self).__mro__:
+            if cls.__module__.startswith('networkx.'):
+                break
+        result = cls()
+        name = self._name
+        gorm = self.gorm
+        nodes = {node: {} for node in self._nodes_at(branch, rev)}
+        edges = [
+            (nodeA, nodeB, idx, {})
+            for (nodeA, nodeB, idx) in self._edges_at(nodes, branch, rev)
+        ]
+        if gorm.caching:
+            cache = gorm._graph_val_cache
+            for key in cache.keys[(name,)] if (name,) in cache.keys else ():
+                v = cache._value_at((name, key), branch, rev)
+                if v is not None:
+                    result.graph[key] = v
+            node_vals = gorm._node_val_cache.parents.get((name,), {})
+            node_val = gorm._node_val_cache._value_at
+            for (node, attrs) in nodes.items():
+                for key in node_vals.get(node, ()):
+                    v = node_val((name, node, key), branch, rev)
+                    if v is not None:
+                        attrs[key] = v
+            edge_vals = gorm._edge_val_cache.parents
+            edge_val = gorm._edge_val_cache._value_at
+            for (nodeA, nodeB, idx, attrs) in edges:
+                for key in edge_vals.get((name, nodeA, nodeB), {}).get(idx, ()):
+                    v = edge_val((name, nodeA, nodeB, idx, key), branch, rev)
+                    if v is not None:
+                        attrs[key] = v
+        else:
+            db = gorm.db
+            for key in db.graph_val_keys(name, branch, rev):
+                result.graph[key] = db.graph_val_get(name, key, branch, rev)
+            for (node, attrs) in nodes.items():
+                for key in db.node_val_keys(name, node, branch, rev):
+                    attrs[key] = db.node_val_get(name, node, key, branch, rev)
+            for (nodeA, nodeB, idx, attrs) in edges:
+                for key in db.edge_val_keys(name, nodeA, nodeB, idx, branch, rev):
+                    attrs[key] = db.edge_val_get(name, nodeA, nodeB, idx, key, branch, rev)
+        result.add_nodes_from(nodes.items())
+        if result.is_multigraph():
+            result.add_edges_from(edges)
+        else:
+            result.add_edges_from(
+                (nodeA, nodeB, attrs) for (nodeA, nodeB, idx, attrs) in edges
+            )
+        return result
+
+    def _node_ids(self, branch, rev):
+        """Return a list of the nodes at the branch and revision, sorted if
+        they can be, and a dict of their positions in it
+
+        """
+        nodes = self._nodes_at(branch, rev)
+        try:
+            nodes.sort()
+        except TypeError:
+            pass
+        return (nodes, {node: i for (i, node) in enumerate(nodes)})
+
+    def node_attribute(self, key, default=None, as_array=False):
+        """Return a dict of every node's value for ``key`` at the present
+        branch and revision, with ``default`` for nodes that lack it.
+
+        With ``as_array``, return a dict of node ids like the one from
+        ``to_csr``, and an array of the values as floats in that
+        order. It's a NumPy array if NumPy is installed. Nodes that
+        lack the key get NaN there, unless you give another
+        ``default``.
+
+        Without caching, this takes one query for the nodes and one
+        for the values. Don't change the values; they may be shared
+        with the cache.
+
+        """
+        if as_array and default is None:
+            default = float('nan')
+        (branch, rev) = (self.gorm.branch, self.gorm.rev)
+        (nodes, node_ids) = self._node_ids(branch, rev)
+        if self.gorm.caching:
+            get = self.gorm._node_val_cache._value_at
+            vals = {node: get((self._name, node, key), branch, rev) for node in nodes}
+        else:
+            vals = dict.fromkeys(nodes)
+            for (node, value) in self.gorm.db.graph_node_vals(
+                    self._name, key, branch, rev
+            ):
+                if node in node_ids:
+                    vals[node] = value
+        for node in nodes:
+            if vals[node] is None:
+                vals[node] = default
+        if as_array:
+            return (node_ids, _array('d', [vals[node] for node in nodes]))
+        return vals
+
+    def node_history(
+            self, key, rev_from, rev_to, nodes=None, branch=None,
+            default=float('nan')
+    ):
+        """Return the values of ``key`` for many nodes over a range of
+        revisions, as a dict of node ids and a matrix.
+
+        Each row of the matrix is a node, numbered as in the dict,
+        and each column a revision from ``rev_from`` to ``rev_to``.
+        Values are floats, with ``default`` where the key wasn't set.
+        The nodes are ``nodes``, or else all those that exist at
+        ``rev_to``. The matrix is a NumPy array if NumPy is
+        installed, or a list of :class:`array.array` rows otherwise.
+
+        """
+        branch = self.gorm.branch if branch is None else branch
+        if nodes is None:
+            (nodes, node_ids) = self._node_ids(branch, rev_to)
+        else:
+            nodes = list(nodes)
+            node_ids = {node: i for (i, node) in enumerate(nodes)}
+        width = rev_to - rev_from + 1
+        rows = []
+        for node in nodes:
+            row = [default] * width
+            points = list(Node(self, node).history(key, rev_from, rev_to, branch))
+            ends = [rev for (rev, v) in points[1:]] + [rev_to + 1]
+            for ((rev, v), end) in zip(points, ends):
+                if v is not None:
+                    row[rev - rev_from:end - rev_from] = [float(v)] * (end - rev)
+            rows.append(row)
+        return (node_ids, _matrix(rows, width))
+
+    def edge_attribute(self, key, default=None):
+        """Return a dict of every edge's value for ``key`` at the present
+        branch and revision, with ``default`` for edges that lack it.
+
+        The dict's keys are pairs of nodes, or triples of nodes and
+        edge key in multigraphs. Undirected edges appear once in each
+        direction. For arrays, use ``to_csr``.
+
+        """
+        (branch, rev) = (self.gorm.branch, self.gorm.rev)
+        nodes = set(self._nodes_at(branch, rev))
+        edges = list(self._edges_at(nodes, branch, rev))
+        if self.gorm.caching:
+            get = self.gorm._edge_val_cache._value_at
+            vals = {
+                edge: get((self._name,) + edge + (key,), branch, rev)
+                for edge in edges
+            }
+        else:
+            vals = dict.fromkeys(edges)
+            for (nodeA, nodeB, idx, value) in self.gorm.db.graph_edge_vals(
+                    self._name, key, branch, rev
+            ):
+                if (nodeA, nodeB, idx) in vals:
+                    vals[nodeA, nodeB, idx] = value
+        multi = self.is_multigraph()
+        return {
+            (edge if multi else edge[:2]): default if v is None else v
+            for (edge, v) in vals.items()
+        }
+
+    def to_csr(self, branch=None, rev=None, attrs=(), default=float('nan')):
+        """Return the edges as they were at the given branch and revision
+        (by default, the present ones) as compressed sparse row
+        adjacency arrays, for algorithms that want plain numbers.
+
+        Return a tuple of:
+
+        * a dict mapping each node to its row and column number
+        * ``indptr``, such that the edges from the node numbered ``i``
+          are at ``indptr[i]`` up to ``indptr[i+1]`` in the other arrays
+        * ``indices``, the column number of the node each edge goes to
+        * a dict mapping each key in ``attrs`` to an array of the edges'
+          values for it as floats, with ``default`` for those that lack
+          it
+
+        The arrays are from NumPy if it's installed, and
+        :class:`array.array` otherwise. Undirected edges appear once
+        in each direction. Without caching, this takes one query for
+        the edges and one for each key in ``attrs``.
+
+        """
+        branch = self.gorm.branch if branch is None else branch
+        rev = self.gorm.rev if rev is None else rev
+        name = self._name
+        (nodes, node_ids) = self._node_ids(branch, rev)
+        rows = [[] for node in nodes]
+        for (nodeA, nodeB, idx) in self._edges_at(node_ids, branch, rev):
+            rows[node_ids[nodeA]].append((node_ids[nodeB], idx, nodeB))
+        if self.gorm.caching:
+            edge_val = self.gorm._edge_val_cache._value_at
+            vals = {
+                attr: {
+                    (nodes[i], nodeB, idx): edge_val(
+                        (name, nodes[i], nodeB, idx, attr), branch, rev
+                    )
+                    for (i, row) in enumerate(rows)
+                    for (j, idx, nodeB) in row
+                } for attr in attrs
+            }
+        else:
+            vals = {
+                attr: {
+                    (nodeA, nodeB, idx): value for (nodeA, nodeB, idx, value)
+                    in self.gorm.db.graph_edge_vals(name, attr, branch, rev)
+                } for attr in attrs
+            }
+        indptr = [0]
+        indices = []
+        data = {attr: [] for attr in attrs}
+        for (i, row) in enumerate(rows):
+            row.sort(key=lambda e: e[:2])
+            for (j, idx, nodeB) in row:
+                indices.append(j)
+                for attr in attrs:
+                    v = vals[attr].get((nodes[i], nodeB, idx))
+                    data[attr].append(default if v is None else float(v))
+            indptr.append(len(indices))
+        return (
+            node_ids,
+            _array('q', indptr),
+            _array('q', indices),
+            {attr: _array('d', data[attr]) for attr in attrs}
+        )
+
+    def add_node_index(self, key):
+        """Keep an index of which nodes have which values for ``key``, at
+        every revision, so that ``nodes_where(key, '==', value)`` takes
+        time in proportion to how many nodes it finds.
+
+        The index is kept in memory, in the cache. Only hashable values
+        are indexed.
+
+        """
+        if not self.gorm.caching:
+            raise ValueError("Indices are kept in the cache; turn caching on")
+        self.gorm._node_val_cache.add_index(self._name, key)
+
     @property
     def name(self):
         return self._name
@@ -1093,9 +1548,7 @@ class Graph(GormGraph, networkx.Graph):
     """
     @property
     def adj(self):
-        if self._name not in self._succs:
-            self._succs[self._name] = GraphSuccessorsMapping(self)
-        return self._succs[self._name]
+        return self._mapping('_succs', GraphSuccessorsMapping)
     edge = adj
     
     def __init__(self, gorm, name, data=None, **attr):
@@ -1113,16 +1566,12 @@ class DiGraph(GormGraph, networkx.DiGraph):
     """
     @property
     def adj(self):
-        if self._name not in self._succs:
-            self._succs[self._name] = DiGraphPredecessorsMapping(self)
-        return self._succs[self._name]
+        return self._mapping('_succs', DiGraphSuccessorsMapping)
     edge = succ = adj
 
-    _preds = {}
     @property
     def pred(self):
-        if self._name not in self._preds:
-            self._preds[self._name] = DiGraphPredecessorsMapping(self)
+        return self._mapping('_preds', DiGraphPredecessorsMapping)
 
     def __init__(self, gorm, name, data=None, **attr):
         self._name = name
@@ -1220,9 +1669,7 @@ class MultiGraph(GormGraph, networkx.MultiGraph):
     """
     @property
     def adj(self):
-        if self._name not in self._succs:
-            self._succs[self._name] = MultiGraphSuccessorsMapping(self)
-        return self._succs[self._name]
+        return self._mapping('_succs', MultiGraphSuccessorsMapping)
     edge = adj
 
     def __init__(self, gorm, name, data=None, **attr):
@@ -1240,17 +1687,12 @@ class MultiDiGraph(GormGraph, networkx.MultiDiGraph):
     """
     @property
     def adj(self):
-        if self._name not in self._succs:
-            self._succs[self._name] = MultiGraphSuccessorsMapping(self)
-        return self._succs[self._name]
+        return self._mapping('_succs', MultiGraphSuccessorsMapping)
     edge = succ = adj
 
-    _preds = {}
     @property
     def pred(self):
-        if self._name not in self._preds:
-            self._preds[self._name] = MultiDiGraphPredecessorsMapping(self)
-        return self._preds[self._name]
+        return self._mapping('_preds', MultiDiGraphPredecessorsMapping)
 
     def __init__(self, gorm, name, data=None, **attr):
         self.gorm = gorm
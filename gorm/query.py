@@ -5,7 +5,7 @@ code that's more to do with the queries than with the data per se
 doesn't pollute the other files so much.
 
 """
-from collections import MutableMapping
+from collections import MutableMapping, OrderedDict, defaultdict
 from sqlite3 import IntegrityError as sqliteIntegError
 try:
     # python 2
@@ -13,18 +13,117 @@ try:
 except ImportError:
     # python 3
     from gorm import xjson
+from urllib.parse import quote
 import os
+import re
+import operator
+import heapq
+from .cache import WindowDict, lineage_history
+from .codec import (
+    get_codec,
+    compress,
+    decompressing,
+    compressors,
+    reference,
+    is_reference
+)
 xjpath = os.path.dirname(xjson.__file__)
-alchemyIntegError = None
-try:
-    from sqlalchemy.exc import IntegrityError as alchemyIntegError
-except ImportError:
-    pass
+codec_key = 'codec'
+"""Key of the row in the ``global`` table naming the codec the database
+uses. The key and value are stored unencoded; no codec ever encodes
+anything as the bare string ``codec``, so it can't clash.
+
+"""
 
 
-IntegrityError = (
-    alchemyIntegError, sqliteIntegError
-) if alchemyIntegError is not None else sqliteIntegError
+def __getattr__(name):
+    """Only import SQLAlchemy's ``IntegrityError`` when someone asks for
+    it, so that the sqlite3 backend doesn't have to load SQLAlchemy
+    at all.
+
+    """
+    if name == 'IntegrityError':
+        try:
+            from sqlalchemy.exc import IntegrityError as alchemyIntegError
+        except ImportError:
+            return sqliteIntegError
+        return (alchemyIntegError, sqliteIntegError)
+    raise AttributeError(
+        "module {} has no attribute {}".format(__name__, name)
+    )
+
+
+where_ops = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge
+}
+"""Comparisons that ``nodes_where`` can make, by name"""
+where_op_names = {
+    '==': 'eq',
+    '!=': 'ne',
+    '<': 'lt',
+    '<=': 'le',
+    '>': 'gt',
+    '>=': 'ge'
+}
+"""Names of the comparisons in ``where_ops``, by symbol"""
+
+
+def where_op(op):
+    """Return the name of the comparison ``op``, which may be a symbol
+    like ``'<='`` or a name like ``'le'``
+
+    """
+    op = where_op_names.get(op, op)
+    if op not in where_ops:
+        raise ValueError("Unknown comparison: {}".format(op))
+    return op
+
+
+where_queries = {
+    'node_val_where_eq': ('eq', None),
+    'node_val_where_ne': ('ne', None)
+}
+"""Queries comparing node values in SQL, and the comparison and kind
+of JSON value each is for. Ordering comparisons only match values of
+the same kind, since SQL would order the others differently than
+Python does.
+
+"""
+for _op in ('lt', 'le', 'gt', 'ge'):
+    for _kind in ('number', 'string'):
+        where_queries['node_val_where_{}_{}'.format(_op, _kind)] = (_op, _kind)
+del _op, _kind
+
+
+def where_query(op, value):
+    """Return the name of the query that compares node values to
+    ``value`` the way Python would with ``op``, or ``None`` if SQL
+    can't.
+
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        kind = 'string'
+    elif isinstance(value, (int, float)):
+        kind = 'number'
+    else:
+        return None
+    if op in ('eq', 'ne'):
+        return 'node_val_where_' + op
+    return 'node_val_where_{}_{}'.format(op, kind)
+
+
+sqlite_strings = {}
+"""The contents of ``sqlite.json``, keyed by the directory it's in, so
+that it's only read and parsed once per process
+
+"""
 
 
 class GlobalKeyValueStore(MutableMapping):
@@ -70,14 +169,81 @@ class GlobalKeyValueStore(MutableMapping):
             del self.qe._global_cache[k]
 
 
+class ReadOnlyError(ValueError):
+    """Tried to write to a database opened read-only"""
+
+
+def read_only_uri(path, immutable=False):
+    """Return a URI for SQLite to open the database file at ``path``
+    read-only.
+
+    With ``immutable``, SQLite will assume nobody changes the file
+    while it's open, and take no locks on it at all.
+
+    """
+    if path in ('', ':memory:'):
+        raise ValueError("Can't open a new database read-only")
+    uri = 'file:{}?mode=ro'.format(quote(path))
+    if immutable:
+        uri += '&immutable=1'
+    return uri
+
+
+def _expand(s, args):
+    """Return the query ``s`` with a placeholder for each item of each
+    list in ``args`` in place of its expanding parameters, and the
+    arguments with the lists flattened
+
+    """
+    lists = iter([arg for arg in args if isinstance(arg, list)])
+    s = re.sub(
+        r'\[EXPANDING_\w+\]',
+        lambda m: ', '.join('?' * len(next(lists))),
+        s
+    )
+    flat = []
+    for arg in args:
+        if isinstance(arg, list):
+            flat.extend(arg)
+        else:
+            flat.append(arg)
+    return s, flat
+
+
+def _refuse(name):
+    """Return a function that raises ``ReadOnlyError`` about ``name``"""
+    def refuse(*args, **kwargs):
+        raise ReadOnlyError(
+            "Can't {}: the database is open read-only".format(name)
+        )
+    refuse.__name__ = name
+    return refuse
+
+
 class QueryEngine(object):
     """Wrapper around either a DBAPI2.0 connection or an
     Alchemist. Provides functions to run queries using either.
 
     """
     json_path = xjpath
-
-    def __init__(self, dbstring, connect_args, alchemy, json_dump=None, json_load=None):
+    IntegrityError = sqliteIntegError
+    writers = (
+        'archive', 'new_graph', 'del_graph', 'del_branches', 'global_set',
+        'global_del', 'new_branch', 'graph_val_ins_many', 'graph_val_set',
+        'graph_val_del', 'exist_node_many', 'exist_node',
+        'node_val_ins_many', 'node_val_set', 'node_val_del',
+        'exist_edge_many', 'exist_edge', 'edge_val_ins_many',
+        'edge_val_set', 'edge_val_del'
+    )
+    """Names of my methods that write to the database"""
+
+    def __init__(
+            self, dbstring, connect_args, alchemy,
+            json_dump=None, json_load=None, codec=None,
+            compress_threshold=None, compression='zlib',
+            dedup_threshold=None, readonly=False, immutable=False,
+            vals_maxsize=4096
+    ):
         """If ``alchemy`` is True and ``dbstring`` is a legit database URI,
         instantiate an Alchemist and start a transaction with
         it. Otherwise use sqlite3.
@@ -86,35 +252,77 @@ class QueryEngine(object):
         object in place of ``dbstring`` if you wish. I'll still create
         my own transaction though.
 
+        ``codec`` is the name of a codec from :mod:`gorm.codec`, or an
+        instance of one, to encode keys and values with. By default
+        it's whatever the database was made with, or ``'json'`` for a
+        new database. ``json_dump`` and ``json_load``, if supplied,
+        override the codec's own functions.
+
+        With ``compress_threshold``, values whose encodings are at
+        least that long get compressed with ``compression``, which is
+        ``'zlib'`` or ``'lzma'``. Compressed values are decompressed
+        when loaded regardless.
+
+        With ``dedup_threshold``, values whose encodings (after any
+        compression) are at least that long are stored just once, in
+        the ``vals`` table, and history refers to them by hash. The
+        ``vals_maxsize`` of them used most recently are kept decoded,
+        and shared.
+
+        With ``readonly``, refuse to write anything, including the
+        tables a new database needs, and take no transaction. SQLite
+        databases are opened read-only, so any number of processes may
+        read them at once; with ``immutable`` as well, SQLite takes no
+        locks at all, so nobody may write to the file while it's open.
+
         """
         dbstring = dbstring or 'sqlite:///:memory:'
+        self.readonly = readonly
         def alchem_init(dbstring, connect_args):
             from sqlalchemy import create_engine
             from sqlalchemy.engine.base import Engine
+            from sqlalchemy.exc import IntegrityError as alchemyIntegError
             from gorm.alchemy import Alchemist
+            self.IntegrityError = (alchemyIntegError, sqliteIntegError)
             if isinstance(dbstring, Engine):
                 self.engine = dbstring
+            elif readonly and dbstring.startswith('sqlite:///'):
+                from sqlite3 import connect
+                uri = read_only_uri(dbstring[len('sqlite:///'):], immutable)
+                self.engine = create_engine(
+                    'sqlite://',
+                    creator=lambda: connect(uri, uri=True)
+                )
             else:
                 self.engine = create_engine(
                     dbstring,
                     connect_args=connect_args
                 )
             self.alchemist = Alchemist(self.engine)
-            self.transaction = self.alchemist.conn.begin()
+            if not readonly:
+                self.transaction = self.alchemist.conn.begin()
 
         def lite_init(dbstring, connect_args):
             from sqlite3 import connect, Connection
             from json import loads
-            self.strings = loads(
-                open(self.json_path + '/sqlite.json', 'r').read()
-            )
+            if self.json_path not in sqlite_strings:
+                with open(self.json_path + '/sqlite.json', 'r') as jsonfile:
+                    sqlite_strings[self.json_path] = loads(jsonfile.read())
+            self.strings = sqlite_strings[self.json_path]
             if isinstance(dbstring, Connection):
                 self.connection = dbstring
             else:
-                if dbstring.startswith('sqlite:'):
+                if dbstring.startswith('sqlite:///'):
+                    dbstring = dbstring[len('sqlite:///'):]
+                elif dbstring.startswith('sqlite:'):
                     slashidx = dbstring.rindex('/')
                     dbstring = dbstring[slashidx+1:]
-                self.connection = connect(dbstring)
+                if readonly:
+                    self.connection = connect(
+                        read_only_uri(dbstring, immutable), uri=True
+                    )
+                else:
+                    self.connection = connect(dbstring)
 
         if alchemy:
             try:
@@ -124,15 +332,119 @@ class QueryEngine(object):
         else:
             lite_init(dbstring, connect_args)
 
+        if readonly:
+            for name in self.writers:
+                setattr(self, name, _refuse(name))
         self.globl = GlobalKeyValueStore(self)
         self._branches = {}
-        self._nodevals2set = []
-        self._edgevals2set = []
-        self._graphvals2set = []
-        self._nodes2set = []
-        self._edges2set = []
-        self.json_dump = json_dump or xjson.json_dump
-        self.json_load = json_load or xjson.json_load
+        # Writes not yet sent to the database, keyed by primary key, so
+        # that setting the same thing many times in one revision makes
+        # only one row.
+        self._nodevals2set = {}
+        self._edgevals2set = {}
+        self._graphvals2set = {}
+        self._nodes2set = {}
+        self._edges2set = {}
+        # Functions to call with (graph, branch, rev) whenever something
+        # about a graph is set
+        self.write_listeners = []
+        self._archive_rev = None
+        stored = self._stored_codec()
+        if readonly and stored is None:
+            raise ValueError("Can't open a new database read-only")
+        self.codec = get_codec(codec or stored or 'json')
+        if stored is not None and stored != self.codec.name:
+            raise ValueError(
+                "This database is encoded with the codec {}, not {}".format(
+                    stored, self.codec.name
+                )
+            )
+        self.json_dump = json_dump or self.codec.dump
+        self._load = decompressing(json_load or self.codec.load)
+        self.json_load = self._load_value
+        if compression not in compressors:
+            raise ValueError("Unknown compression: {}".format(compression))
+        self.compress_threshold = compress_threshold
+        self.compression = compression
+        self.dedup_threshold = dedup_threshold
+        self.vals_maxsize = vals_maxsize
+        # decoded values from the ``vals`` table, and the hashes of those
+        # known to be in it, most recently used last
+        self._vals = OrderedDict()
+        self._vals_stored = OrderedDict()
+
+    def _dump_value(self, value):
+        """Encode a value to be stored in history, compressing it if it's
+        long enough, and putting it in the ``vals`` table if it's
+        longer still
+
+        """
+        s = self.json_dump(value)
+        if self.compress_threshold is not None \
+                and len(s) >= self.compress_threshold:
+            s = compress(s, self.compression)
+        if self.dedup_threshold is not None \
+                and len(s) >= self.dedup_threshold:
+            ref = reference(s)
+            if ref in self._vals_stored:
+                self._vals_stored.move_to_end(ref)
+            else:
+                self.sql('vals_ins', ref, s)
+                self._remember_stored(ref)
+            return ref
+        return s
+
+    def _load_value(self, s):
+        """Decode something loaded from the database, looking it up in the
+        ``vals`` table if it's a reference to a value there
+
+        """
+        if not is_reference(s):
+            return self._load(s)
+        if not isinstance(s, (str, bytes)):
+            s = bytes(s)
+        try:
+            r = self._vals[s]
+        except KeyError:
+            row = self.sql('vals_get', s).fetchone()
+            if row is None:
+                raise KeyError("No stored value with hash {}".format(s))
+            r = self._vals[s] = self._load(row[0])
+            while len(self._vals) > self.vals_maxsize:
+                self._vals.popitem(last=False)
+            self._remember_stored(s)
+            return r
+        self._vals.move_to_end(s)
+        return r
+
+    def _remember_stored(self, ref):
+        """Note that the value with hash ``ref`` is in the ``vals`` table"""
+        self._vals_stored[ref] = True
+        while len(self._vals_stored) > self.vals_maxsize:
+            self._vals_stored.popitem(last=False)
+
+    def _stored_codec(self):
+        """Return the name of the codec the database was made with, or
+        ``None`` if it's a new database.
+
+        """
+        if hasattr(self, 'alchemist'):
+            if not self.engine.dialect.has_table(
+                    self.alchemist.conn, 'global'
+            ):
+                return None
+        else:
+            from sqlite3 import OperationalError
+            try:
+                self.connection.cursor().execute('SELECT * FROM global;')
+            except OperationalError:
+                return None
+        row = self.sql('global_get', codec_key).fetchone()
+        if row is None:
+            # made before there were codecs
+            return 'json'
+        name = row[0]
+        return name if isinstance(name, str) else bytes(name).decode()
 
     def sql(self, stringname, *args, **kwargs):
         """Wrapper for the various prewritten or compiled SQL calls.
@@ -140,16 +452,19 @@ class QueryEngine(object):
         First argument is the name of the query, either a key in
         ``sqlite.json`` or a method name in
         ``gorm.alchemy.Alchemist``. The rest of the arguments are
-        parameters to the query.
+        parameters to the query. A list is a parameter for an
+        expanding ``IN`` clause.
 
         """
         if hasattr(self, 'alchemist'):
             return getattr(self.alchemist, stringname)(*args, **kwargs)
         else:
             s = self.strings[stringname]
-            return self.connection.cursor().execute(
-                s.format(**kwargs) if kwargs else s, args
-            )
+            if kwargs:
+                s = s.format(**kwargs)
+            if '[EXPANDING_' in s:
+                (s, args) = _expand(s, args)
+            return self.connection.cursor().execute(s, args)
 
     def sqlmany(self, stringname, *args):
         if hasattr(self, 'alchemist'):
@@ -157,6 +472,168 @@ class QueryEngine(object):
         s = self.strings[stringname]
         return self.connection.cursor().executemany(s, args)
 
+    def _tier(self, stringname, rev):
+        """Return the name of the query to read history as of ``rev``.
+
+        That's the query on the archive tables if ``rev`` is older than
+        the archival watermark, or else the query on the hot tables.
+
+        """
+        if self._archive_rev is not None and rev < self._archive_rev:
+            return 'archive_' + stringname
+        return stringname
+
+    def _dump(self, stringname):
+        """Iterate over the rows from a dump query, including the archived
+        ones, oldest first.
+
+        The hot tables keep copies of some rows older than the
+        watermark, which the archive has as well; those come out only
+        once. Every dump query has the revision second to last.
+
+        """
+        if self._archive_rev is None:
+            yield from self.sql(stringname)
+            return
+        yield from self.sql('archive_' + stringname)
+        for row in self.sql(stringname):
+            if row[-2] >= self._archive_rev:
+                yield row
+
+    def _history(self, stringname, args, branch, rev_from, rev_to):
+        """Iterate over ``(rev, value)`` for a variable's value at
+        ``rev_from`` and its changes up to ``rev_to``, from a query that
+        selects ``(branch, rev, value)`` for it up to a revision.
+        ``args`` are the query's other arguments, already encoded.
+
+        """
+        branches = defaultdict(WindowDict)
+        tiers = ('',) if self._archive_rev is None else ('archive_', '')
+        for tier in tiers:
+            for (b, r, v) in self.sql(tier + stringname, *args + (rev_to,)):
+                branches[b][r] = v
+        for (rev, v) in lineage_history(
+                branches,
+                list(self.active_branches(branch, rev_to)),
+                rev_from,
+                rev_to
+        ):
+            yield (rev, None if v is None else self.json_load(v))
+
+    def changes(self, graph, branch, after, upto):
+        """Iterate over ``(table, variable)`` for everything about the
+        graph that was set in the branch after the revision ``after``,
+        up to and including ``upto``.
+
+        ``table`` is the name of a history table, and ``variable`` is
+        a tuple of what identifies the thing set there, besides the
+        graph: the key for ``graph_val``, the node for ``nodes``, the
+        node and key for ``node_val``, the nodes and index for
+        ``edges``, and those and the key for ``edge_val``.
+
+        """
+        self.flush()
+        graph = self.json_dump(graph)
+        if self._archive_rev is not None and after < self._archive_rev:
+            tiers = ('archive_', '')
+        else:
+            tiers = ('',)
+        for table in ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val'):
+            seen = set()
+            for tier in tiers:
+                for row in self.sql(
+                    tier + table + '_changes', graph, branch, after, upto
+                ):
+                    row = tuple(row)
+                    if row in seen:
+                        continue
+                    seen.add(row)
+                    yield (table, self._decode_var(table, (graph,) + row)[1:])
+
+    def _decode_var(self, table, row):
+        """Decode the columns of a history table's row that identify the
+        variable it sets. Edge indices aren't encoded.
+
+        """
+        if table in ('edges', 'edge_val'):
+            return tuple(map(self.json_load, row[:3])) + (row[3],) + tuple(
+                map(self.json_load, row[4:])
+            )
+        return tuple(map(self.json_load, row))
+
+    def stream(self, branch, after, upto):
+        """Iterate over ``(rev, table, variable, value)`` for everything set
+        in the branch after the revision ``after``, up to and including
+        ``upto``, in order of revision.
+
+        ``variable`` is like in ``changes``, but starts with the
+        graph. ``value`` is ``None`` for deletions, and a boolean for
+        the existence of nodes and edges.
+
+        Rows are read from the database as they're needed, using the
+        index on branch and revision.
+
+        """
+        self.flush()
+
+        def rows(order, table):
+            tiers = []
+            if self._archive_rev is not None and after < self._archive_rev - 1:
+                tiers.append(('archive_', after, min(upto, self._archive_rev - 1)))
+            if self._archive_rev is None:
+                tiers.append(('', after, upto))
+            elif upto >= self._archive_rev:
+                tiers.append(('', max(after, self._archive_rev - 1), upto))
+            for (tier, lo, hi) in tiers:
+                for row in self.sql(tier + table + '_stream', branch, lo, hi):
+                    value = row[-1]
+                    if table in ('nodes', 'edges'):
+                        value = bool(value)
+                    elif value is not None:
+                        value = self.json_load(value)
+                    yield (
+                        row[-2], order, table,
+                        self._decode_var(table, row[:-2]), value
+                    )
+        for (rev, order, table, var, value) in heapq.merge(*[
+                rows(order, table) for (order, table) in enumerate(
+                    ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val')
+                )
+        ]):
+            yield (rev, table, var, value)
+
+    def _archive_many(self, stringname, rows, revidx):
+        """Write those ``rows`` older than the archival watermark into the
+        archive too, so reads from there will find them.
+
+        """
+        if self._archive_rev is None:
+            return
+        old = [row for row in rows if row[revidx] < self._archive_rev]
+        if old:
+            self.sqlmany('archive_' + stringname, *old)
+
+    def archive(self, rev):
+        """Move history older than ``rev`` out of the hot tables and into
+        the archive tables.
+
+        For each variable, the last value set before ``rev`` stays in
+        the hot table, so reads at ``rev`` or later use only the hot
+        tables. Reads before ``rev`` use only the archive.
+
+        """
+        if self._archive_rev is not None and rev < self._archive_rev:
+            raise ValueError(
+                "Already archived history before revision {}".format(
+                    self._archive_rev
+                )
+            )
+        self.flush()
+        for tab in ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val'):
+            self.sql(tab + '_archive', rev)
+            self.sql(tab + '_purge', rev, rev)
+        self.globl['archive_rev'] = self._archive_rev = rev
+
     def timestream_data(self):
         for row in self.sql('allbranch'):
             yield tuple(row)
@@ -176,8 +653,9 @@ class QueryEngine(object):
         yield (branch, rev)
         while branch != 'master':
             if branch not in self._branches:
-                (b, r) = self.parparrev(branch)
-                self._branches[branch] = (b, self.json_load(r))
+                self._branches[branch] = tuple(
+                    self.parparrev(branch).fetchone()
+                )
             (branch, rev) = self._branches[branch]
             yield (branch, rev)
 
@@ -194,12 +672,31 @@ class QueryEngine(object):
     def del_graph(self, graph):
         """Delete all records to do with the graph"""
         g = self.json_dump(graph)
-        self.sql('del_edge_val_graph', g)
-        self.sql('del_edge_graph', g)
-        self.sql('del_node_val_graph', g)
-        self.sql('del_edge_val_graph', g)
+        for tier in ('', 'archive_') if self._archive_rev is not None else ('',):
+            self.sql(tier + 'del_edge_val_graph', g)
+            self.sql(tier + 'del_edge_graph', g)
+            self.sql(tier + 'del_node_val_graph', g)
+            self.sql(tier + 'del_node_graph', g)
         self.sql('del_graph', g)
 
+    def del_branches(self, branches):
+        """Delete all records made in any of these branches, and the
+        branches themselves.
+
+        """
+        self.flush()
+        branches = list(branches)
+        for tier in ('', 'archive_') if self._archive_rev is not None else ('',):
+            self.sql(tier + 'del_edge_val_branches', branches)
+            self.sql(tier + 'del_edge_branches', branches)
+            self.sql(tier + 'del_node_val_branches', branches)
+            self.sql(tier + 'del_node_branches', branches)
+            self.sql(tier + 'del_graph_val_branches', branches)
+        self.sql('del_branches', branches)
+        for branch in branches:
+            if branch in self._branches:
+                del self._branches[branch]
+
     def graph_type(self, graph):
         """What type of graph is this?"""
         graph = self.json_dump(graph)
@@ -227,6 +724,8 @@ class QueryEngine(object):
     def global_items(self):
         """Iterate over (key, value) pairs in the ``globals`` table."""
         for (k, v) in self.sql('global_items'):
+            if k == codec_key or k == codec_key.encode():
+                continue
             yield (self.json_load(k), self.json_load(v))
 
     def global_set(self, key, value):
@@ -237,7 +736,7 @@ class QueryEngine(object):
         (key, value) = map(self.json_dump, (key, value))
         try:
             return self.sql('global_ins', key, value)
-        except IntegrityError:
+        except self.IntegrityError:
             return self.sql('global_upd', value, key)
 
     def global_del(self, key):
@@ -263,7 +762,7 @@ class QueryEngine(object):
     def graph_val_dump(self):
         """Yield the entire contents of the graph_val table."""
         self.flush_graph_val()
-        for (graph, key, branch, rev, value) in self.sql('graph_val_dump'):
+        for (graph, key, branch, rev, value) in self._dump('graph_val_dump'):
             yield (
                 self.json_load(graph),
                 self.json_load(key),
@@ -282,7 +781,7 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             data = self.sql(
-                'graph_val_items', graph, b, r
+                self._tier('graph_val_items', r), graph, b, r
             )
             for (k, v) in data:
                 if k not in seen:
@@ -294,29 +793,49 @@ class QueryEngine(object):
         revision.
 
         """
+        pending = (graph, key, branch, rev)
+        if pending in self._graphvals2set:
+            if self._graphvals2set[pending] is None:
+                raise KeyError("Key not set")
+            return self._graphvals2set[pending]
         self.flush_graph_val()
         (graph, key) = map(self.json_dump, (graph, key))
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'graph_val_get',
+                self._tier('graph_val_get', r),
                 graph,
                 key,
-                branch,
-                rev
+                b,
+                r
             ):
                 if row is None:
                     raise KeyError("Key not set")
                 return self.json_load(row[0])
         raise KeyError("Key never set")
 
-    def graph_val_ins_many(self, *args):
+    def graph_val_history(self, graph, key, branch, rev_from, rev_to):
+        """Iterate over ``(rev, value)`` for the graph's value for the key
+        at ``rev_from`` and wherever it changed until ``rev_to``.
+
+        """
+        self.flush_graph_val()
+        return self._history(
+            'graph_val_history', tuple(map(self.json_dump, (graph, key))),
+            branch, rev_from, rev_to
+        )
+
+    def graph_val_ins_many(self, *args, notify=True):
+        """Write many rows at once. Unless ``notify`` is false, tell the
+        ``write_listeners``.
+
+        """
         def convert_arg(arg):
             if isinstance(arg, dict):
                 return (
                     self.json_dump(arg['graph']),
                     self.json_dump(arg['key']),
                     arg['branch'], arg['rev'],
-                    self.json_dump(arg['value'])
+                    self._dump_value(arg['value'])
                 )
             elif isinstance(arg, tuple) or isinstance(arg, list):
                 graph, key, branch, rev, value = arg
@@ -324,21 +843,58 @@ class QueryEngine(object):
                     self.json_dump(graph),
                     self.json_dump(key),
                     branch, rev,
-                    self.json_dump(value)
+                    self._dump_value(value)
                 )
             else:
                 raise TypeError('Expected dict, list, or tuple, got {}'.format(type(arg)))
-        return self.sqlmany('graph_val_ins', *map(convert_arg, args))
+        rows = list(map(convert_arg, args))
+        self._archive_many('graph_val_ins', rows, 3)
+        r = self.sqlmany('graph_val_ins', *rows)
+        if notify:
+            self._wrote_many(args, 2)
+        return r
 
     def flush_graph_val(self):
         if not self._graphvals2set:
             return
-        self.graph_val_ins_many(*self._graphvals2set)
-        self._graphvals2set = []
+        self.graph_val_ins_many(
+            *(k + (v,) for (k, v) in self._graphvals2set.items()),
+            notify=False
+        )
+        self._graphvals2set = {}
+
+    def _wrote(self, graph, branch, rev):
+        """Tell the ``write_listeners`` that something about the graph was
+        set at the branch and revision
+
+        """
+        for listener in self.write_listeners:
+            listener(graph, branch, rev)
+
+    def _wrote_many(self, args, branchidx):
+        """Tell the ``write_listeners`` about every graph, branch, and
+        revision written by one of the ``*_many`` methods, once each.
+        ``args`` are its arguments; those that aren't dicts have the
+        branch at ``branchidx``.
+
+        """
+        if not self.write_listeners:
+            return
+        written = set()
+        for arg in args:
+            if isinstance(arg, dict):
+                written.add((arg['graph'], arg['branch'], arg['rev']))
+            else:
+                written.add(
+                    (arg[0], arg[branchidx], arg[branchidx + 1])
+                )
+        for (graph, branch, rev) in written:
+            self._wrote(graph, branch, rev)
 
     def graph_val_set(self, graph, key, branch, rev, value):
         """Set a key to a value on a graph at a particular revision."""
-        self._graphvals2set.append((graph, key, branch, rev, value))
+        self._graphvals2set[graph, key, branch, rev] = value
+        self._wrote(graph, branch, rev)
 
     def graph_val_del(self, graph, key, branch, rev):
         """Indicate that the key is unset."""
@@ -358,10 +914,10 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             data = self.sql(
-                'nodes_extant',
+                self._tier('nodes_extant', r),
                 graph,
-                branch,
-                rev
+                b,
+                r
             )
             for (n,) in data:
                 if n is not None and n not in seen:
@@ -373,16 +929,23 @@ class QueryEngine(object):
         revision.
 
         """
+        pending = (graph, node, branch, rev)
+        if pending in self._nodes2set:
+            return bool(self._nodes2set[pending])
         self.flush_nodes()
         (graph, node) = map(self.json_dump, (graph, node))
         for (b, r) in self.active_branches(branch, rev):
             for x in self.sql(
-                'node_exists', graph, node, b, r
+                self._tier('node_exists', r), graph, node, b, r
             ):
                 return bool(x[0])
         return False
 
-    def exist_node_many(self, *args):
+    def exist_node_many(self, *args, notify=True):
+        """Write many rows at once. Unless ``notify`` is false, tell the
+        ``write_listeners``.
+
+        """
         def convert_arg(arg):
             if isinstance(arg, dict):
                 return (
@@ -400,13 +963,20 @@ class QueryEngine(object):
             else:
                 raise TypeError('Expected dict, list, or tuple, got {}'.format(type(arg)))
         arghs = list(map(convert_arg, args))
-        return self.sqlmany('exist_node_ins', *arghs)
+        self._archive_many('exist_node_ins', arghs, 3)
+        r = self.sqlmany('exist_node_ins', *arghs)
+        if notify:
+            self._wrote_many(args, 2)
+        return r
 
     def flush_nodes(self):
         if not self._nodes2set:
             return
-        self.exist_node_many(*self._nodes2set)
-        self._nodes2set = []
+        self.exist_node_many(
+            *(k + (v,) for (k, v) in self._nodes2set.items()),
+            notify=False
+        )
+        self._nodes2set = {}
 
     def exist_node(self, graph, node, branch, rev, extant):
         """Declare that the node exists or doesn't.
@@ -414,12 +984,13 @@ class QueryEngine(object):
         Inserts a new record or updates an old one, as needed.
 
         """
-        self._nodes2set.append((graph, node, branch, rev, extant))
+        self._nodes2set[graph, node, branch, rev] = extant
+        self._wrote(graph, branch, rev)
 
     def nodes_dump(self):
         """Dump the entire contents of the nodes table."""
         self.flush_nodes()
-        for (graph, node, branch, tick, extant) in self.sql('nodes_dump'):
+        for (graph, node, branch, tick, extant) in self._dump('nodes_dump'):
             yield (
                 self.json_load(graph),
                 self.json_load(node),
@@ -431,7 +1002,7 @@ class QueryEngine(object):
     def node_val_dump(self):
         """Yield the entire contents of the node_val table."""
         self.flush_node_val()
-        for (graph, node, key, branch, rev, value) in self.sql('node_val_dump'):
+        for (graph, node, key, branch, rev, value) in self._dump('node_val_dump'):
             yield (
                 self.json_load(graph),
                 self.json_load(node),
@@ -451,16 +1022,32 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for (k, v) in self.sql(
-                    'node_val_items',
+                    self._tier('node_val_items', r),
                     graph,
                     node,
-                    branch,
-                    rev
+                    b,
+                    r
             ):
                 if k not in seen and v is not None:
                     yield self.json_load(k)
                 seen.add(k)
 
+    def graph_node_vals(self, graph, key, branch, rev):
+        """Iterate over ``(node, value)`` for every node in the graph that
+        has a value for the key at this revision.
+
+        """
+        self.flush_node_val()
+        (graph, key) = map(self.json_dump, (graph, key))
+        seen = set()
+        for (b, r) in self.active_branches(branch, rev):
+            for (node, value) in self.sql(
+                self._tier('graph_node_vals', r), graph, key, b, r
+            ):
+                if node not in seen and value is not None:
+                    yield (self.json_load(node), self.json_load(value))
+                seen.add(node)
+
     def node_vals_ever(self, graph, node):
         """Iterate over all values set on a node through time."""
         self.flush_node_val()
@@ -472,23 +1059,43 @@ class QueryEngine(object):
 
     def node_val_get(self, graph, node, key, branch, rev):
         """Get the value of the node's key as it was at the given revision."""
+        pending = (graph, node, key, branch, rev)
+        if pending in self._nodevals2set:
+            if self._nodevals2set[pending] is None:
+                raise KeyError("Key not set")
+            return self._nodevals2set[pending]
         self.flush_node_val()
         (graph, node, key) = map(self.json_dump, (graph, node, key))
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'node_val_get',
+                self._tier('node_val_get', r),
                 graph,
                 node,
                 key,
-                branch,
-                rev
+                b,
+                r
             ):
                 if row[0] is None:
                     raise KeyError("Key not set")
                 return self.json_load(row[0])
         raise KeyError("Key {} never set".format(key))
 
-    def node_val_ins_many(self, *args):
+    def node_val_history(self, graph, node, key, branch, rev_from, rev_to):
+        """Iterate over ``(rev, value)`` for the node's value for the key
+        at ``rev_from`` and wherever it changed until ``rev_to``.
+
+        """
+        self.flush_node_val()
+        return self._history(
+            'node_val_history', tuple(map(self.json_dump, (graph, node, key))),
+            branch, rev_from, rev_to
+        )
+
+    def node_val_ins_many(self, *args, notify=True):
+        """Write many rows at once. Unless ``notify`` is false, tell the
+        ``write_listeners``.
+
+        """
         def convert_arg(arg):
             if isinstance(arg, dict):
                 return (
@@ -497,7 +1104,7 @@ class QueryEngine(object):
                     self.json_dump(arg['key']),
                     arg['branch'],
                     arg['rev'],
-                    self.json_dump(arg['value'])
+                    self._dump_value(arg['value'])
                 )
             elif isinstance(arg, tuple) or isinstance(arg, list):
                 graph, node, key, branch, rev, value = arg
@@ -507,28 +1114,84 @@ class QueryEngine(object):
                     self.json_dump(key),
                     branch,
                     rev,
-                    self.json_dump(value)
+                    self._dump_value(value)
                 )
             else:
                 raise TypeError("Need dict, list, or tuple, not {}".format(type(arg)))
-        self.sqlmany('node_val_ins', *map(convert_arg, args))
+        rows = list(map(convert_arg, args))
+        self._archive_many('node_val_ins', rows, 4)
+        self.sqlmany('node_val_ins', *rows)
+        if notify:
+            self._wrote_many(args, 3)
 
     def flush_node_val(self):
         if not self._nodevals2set:
             return
-        self.node_val_ins_many(*self._nodevals2set)
-        self._nodevals2set = []
+        self.node_val_ins_many(
+            *(k + (v,) for (k, v) in self._nodevals2set.items()),
+            notify=False
+        )
+        self._nodevals2set = {}
 
     def node_val_set(self, graph, node, key, branch, rev, value):
-        self._nodevals2set.append((graph, node, key, branch, rev, value))
+        self._nodevals2set[graph, node, key, branch, rev] = value
+        self._wrote(graph, branch, rev)
 
     def node_val_del(self, graph, node, key, branch, rev):
         self.node_val_set(graph, node, key, branch, rev, None)
 
+    def nodes_where(self, graph, key, op, value, branch, rev):
+        """Iterate over the nodes in the graph whose value for ``key``
+        compares to ``value`` as ``op`` says, at the given revision.
+
+        The comparison happens in SQL when ``value`` is a number or a
+        string. Values that are compressed or stored by reference,
+        and every value in a binary database, are loaded and compared
+        here instead.
+
+        """
+        op = where_op(op)
+        cmp = where_ops[op]
+        query = where_query(op, value)
+        self.flush_nodes()
+        self.flush_node_val()
+        extant = set(self.nodes_extant(graph, branch, rev))
+        if self.codec.binary or query is None:
+            for node in extant:
+                try:
+                    v = self.node_val_get(graph, node, key, branch, rev)
+                except KeyError:
+                    continue
+                try:
+                    if cmp(v, value):
+                        yield node
+                except TypeError:
+                    continue
+            return
+        args = (self.json_dump(value), self.json_dump(graph), self.json_dump(key))
+        seen = set()
+        for (b, r) in self.active_branches(branch, rev):
+            for (n, hit, raw) in self.sql(
+                self._tier(query, r), *args + (b, r)
+            ):
+                if n in seen:
+                    continue
+                seen.add(n)
+                if raw is not None:
+                    try:
+                        hit = cmp(self.json_load(raw), value)
+                    except TypeError:
+                        continue
+                if not hit:
+                    continue
+                node = self.json_load(n)
+                if node in extant:
+                    yield node
+
     def edges_dump(self):
         """Dump the entire contents of the edges table."""
         self.flush_edges()
-        for (graph, nodeA, nodeB, idx, branch, rev, extant) in self.sql('edges_dump'):
+        for (graph, nodeA, nodeB, idx, branch, rev, extant) in self._dump('edges_dump'):
             yield (
                 self.json_load(graph),
                 self.json_load(nodeA),
@@ -549,22 +1212,64 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'edges_extant', graph, branch, rev
+                self._tier('edges_extant', r), graph, b, r
             ):
                 if row[0] not in seen and row[1]:
                     yield self.json_load(row[0])
                 seen.add(row[0])
 
+    def graph_edges(self, graph, branch, rev):
+        """Iterate over ``(nodeA, nodeB, idx)`` for every edge in the graph
+        at this revision.
+
+        """
+        self.flush_edges()
+        graph = self.json_dump(graph)
+        seen = set()
+        for (b, r) in self.active_branches(branch, rev):
+            for (nodeA, nodeB, idx, extant) in self.sql(
+                self._tier('graph_edges', r), graph, b, r
+            ):
+                edge = (nodeA, nodeB, idx)
+                if edge not in seen and extant:
+                    yield (self.json_load(nodeA), self.json_load(nodeB), idx)
+                seen.add(edge)
+
+    def graph_edge_vals(self, graph, key, branch, rev):
+        """Iterate over ``(nodeA, nodeB, idx, value)`` for every edge in the
+        graph that has a value for the key at this revision.
+
+        """
+        self.flush_edge_val()
+        (graph, key) = map(self.json_dump, (graph, key))
+        seen = set()
+        for (b, r) in self.active_branches(branch, rev):
+            for (nodeA, nodeB, idx, value) in self.sql(
+                self._tier('graph_edge_vals', r), graph, key, b, r
+            ):
+                edge = (nodeA, nodeB, idx)
+                if edge not in seen and value is not None:
+                    yield (
+                        self.json_load(nodeA),
+                        self.json_load(nodeB),
+                        idx,
+                        self.json_load(value)
+                    )
+                seen.add(edge)
+
     def edge_exists(self, graph, nodeA, nodeB, idx, branch, rev):
         """Return whether the edge exists now, or None if there's no data
         about it in this branch.
 
         """
+        pending = (graph, nodeA, nodeB, idx, branch, rev)
+        if pending in self._edges2set:
+            return bool(self._edges2set[pending])
         self.flush_edges()
         (graph, nodeA, nodeB) = map(self.json_dump, (graph, nodeA, nodeB))
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'edge_exists',
+                self._tier('edge_exists', r),
                 graph,
                 nodeA,
                 nodeB,
@@ -572,7 +1277,7 @@ class QueryEngine(object):
                 b,
                 r
             ):
-                return bool(row[1])
+                return bool(row[0])
         return False
 
     def nodeAs(self, graph, nodeB, branch, rev):
@@ -586,7 +1291,7 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'nodeAs',
+                self._tier('nodeAs', r),
                 graph,
                 nodeB,
                 b,
@@ -604,7 +1309,7 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'nodeBs', graph, nodeA, b, r
+                self._tier('nodeBs', r), graph, nodeA, b, r
             ):
                 if row[0] not in seen and row[1]:
                     yield self.json_load(row[0])
@@ -621,13 +1326,17 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'multi_edges', graph, nodeA, nodeB, branch, rev
+                self._tier('multi_edges', r), graph, nodeA, nodeB, b, r
             ):
                 if row[0] not in seen and row[1]:
                     yield row[0]
                 seen.add(row[0])
 
-    def exist_edge_many(self, *args):
+    def exist_edge_many(self, *args, notify=True):
+        """Write many rows at once. Unless ``notify`` is false, tell the
+        ``write_listeners``.
+
+        """
         def convert_arg(arg):
             if isinstance(arg, dict):
                 return (
@@ -646,22 +1355,31 @@ class QueryEngine(object):
                 )
             else:
                 raise TypeError('Expected dict, list, or tuple, got {}'.format(type(arg)))
-        return self.sqlmany('edge_exist_ins', *map(convert_arg, args))
+        rows = list(map(convert_arg, args))
+        self._archive_many('edge_exist_ins', rows, 5)
+        r = self.sqlmany('edge_exist_ins', *rows)
+        if notify:
+            self._wrote_many(args, 4)
+        return r
 
     def flush_edges(self):
         if not self._edges2set:
             return
-        self.exist_edge_many(*self._edges2set)
-        self._edges2set = []
+        self.exist_edge_many(
+            *(k + (v,) for (k, v) in self._edges2set.items()),
+            notify=False
+        )
+        self._edges2set = {}
 
     def exist_edge(self, graph, nodeA, nodeB, idx, branch, rev, extant):
         """Declare whether or not this edge exists."""
-        self._edges2set.append((graph, nodeA, nodeB, idx, branch, rev, extant))
+        self._edges2set[graph, nodeA, nodeB, idx, branch, rev] = extant
+        self._wrote(graph, branch, rev)
 
     def edge_val_dump(self):
         """Yield the entire contents of the edge_val table."""
         self.flush_edge_val()
-        for (graph, nodeA, nodeB, idx, key, branch, rev, value) in self.sql('edge_val_dump'):
+        for (graph, nodeA, nodeB, idx, key, branch, rev, value) in self._dump('edge_val_dump'):
             yield (
                 self.json_load(graph),
                 self.json_load(nodeA),
@@ -680,7 +1398,7 @@ class QueryEngine(object):
         seen = set()
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'edge_val_items', graph, nodeA, nodeB, idx, b, r
+                self._tier('edge_val_items', r), graph, nodeA, nodeB, idx, b, r
             ):
                 if row[0] not in seen:
                     yield self.json_load(row[0])
@@ -688,18 +1406,39 @@ class QueryEngine(object):
 
     def edge_val_get(self, graph, nodeA, nodeB, idx, key, branch, rev):
         """Return the value of this key of this edge."""
+        pending = (graph, nodeA, nodeB, idx, key, branch, rev)
+        if pending in self._edgevals2set:
+            if self._edgevals2set[pending] is None:
+                raise KeyError("Key not set")
+            return self._edgevals2set[pending]
         self.flush_edge_val()
         (graph, nodeA, nodeB, key) = map(self.json_dump, (graph, nodeA, nodeB, key))
         for (b, r) in self.active_branches(branch, rev):
             for row in self.sql(
-                'edge_val_get', graph, nodeA, nodeB, idx, key, b, r
+                self._tier('edge_val_get', r), graph, nodeA, nodeB, idx, key, b, r
             ):
                 if row[0] is None:
                     raise KeyError("Key not set")
                 return self.json_load(row[0])
         raise KeyError("Key never set")
 
-    def edge_val_ins_many(self, *args):
+    def edge_val_history(self, graph, nodeA, nodeB, idx, key, branch, rev_from, rev_to):
+        """Iterate over ``(rev, value)`` for the edge's value for the key
+        at ``rev_from`` and wherever it changed until ``rev_to``.
+
+        """
+        self.flush_edge_val()
+        (graph, nodeA, nodeB, key) = map(self.json_dump, (graph, nodeA, nodeB, key))
+        return self._history(
+            'edge_val_history', (graph, nodeA, nodeB, idx, key),
+            branch, rev_from, rev_to
+        )
+
+    def edge_val_ins_many(self, *args, notify=True):
+        """Write many rows at once. Unless ``notify`` is false, tell the
+        ``write_listeners``.
+
+        """
         def convert_arg(arg):
             if isinstance(arg, dict):
                 return (
@@ -709,7 +1448,7 @@ class QueryEngine(object):
                     arg['idx'],
                     self.json_dump(arg['key']),
                     arg['branch'], arg['rev'],
-                    self.json_dump(arg['value'])
+                    self._dump_value(arg['value'])
                 )
             elif isinstance(arg, tuple) or isinstance(arg, list):
                 graph, nodeA, nodeB, idx, key, branch, rev, value = arg
@@ -720,21 +1459,30 @@ class QueryEngine(object):
                     idx,
                     self.json_dump(key),
                     branch, rev,
-                    self.json_dump(value)
+                    self._dump_value(value)
                 )
             else:
                 raise TypeError('Expected dict, list, or tuple, got {}'.format(type(arg)))
-        return self.sqlmany('edge_val_ins', *map(convert_arg, args))
+        rows = list(map(convert_arg, args))
+        self._archive_many('edge_val_ins', rows, 6)
+        r = self.sqlmany('edge_val_ins', *rows)
+        if notify:
+            self._wrote_many(args, 5)
+        return r
 
     def flush_edge_val(self):
         if not self._edgevals2set:
             return
-        self.edge_val_ins_many(*self._edgevals2set)
-        self._edgevals2set = []
+        self.edge_val_ins_many(
+            *(k + (v,) for (k, v) in self._edgevals2set.items()),
+            notify=False
+        )
+        self._edgevals2set = {}
 
     def edge_val_set(self, graph, nodeA, nodeB, idx, key, branch, rev, value):
         """Set this key of this edge to this value."""
-        self._edgevals2set.append((graph, nodeA, nodeB, idx, key, branch, rev, value))
+        self._edgevals2set[graph, nodeA, nodeB, idx, key, branch, rev] = value
+        self._wrote(graph, branch, rev)
 
     def edge_val_del(self, graph, nodeA, nodeB, idx, key, branch, rev):
         """Declare that the key no longer applies to this edge, as of this
@@ -744,20 +1492,38 @@ class QueryEngine(object):
         self.edge_val_set(graph, nodeA, nodeB, idx, key, branch, rev, None)
 
     def initdb(self):
-        """Create tables and indices."""
+        """Create tables and indices.
+
+        If I'm read-only, only find out what's been archived.
+
+        """
+        if self.readonly:
+            if 'archive_rev' in self.globl:
+                self._archive_rev = self.globl['archive_rev']
+            return
         if hasattr(self, 'alchemist'):
-            self.alchemist.meta.create_all(self.engine)
+            if self.codec.binary:
+                meta = self.alchemist.blobmeta
+            else:
+                meta = self.alchemist.meta
+            meta.create_all(self.engine)
+            self.alchemist.create_rev_indices(meta)
+            self._init_codec()
             if 'branch' not in self.globl:
                 self.globl['branch'] = 'master'
             if 'rev' not in self.globl:
                 self.globl['rev'] = 0
+            if 'archive_rev' in self.globl:
+                self._archive_rev = self.globl['archive_rev']
             return
         from sqlite3 import OperationalError
+        create = 'blob_create_' if self.codec.binary else 'create_'
         cursor = self.connection.cursor()
         try:
             cursor.execute('SELECT * FROM global;')
         except OperationalError:
-            cursor.execute(self.strings['create_global'])
+            cursor.execute(self.strings[create + 'global'])
+        self._init_codec()
         if 'branch' not in self.globl:
             self.globl['branch'] = 'master'
         if 'rev' not in self.globl:
@@ -765,7 +1531,7 @@ class QueryEngine(object):
         try:
             cursor.execute('SELECT * FROM branches;')
         except OperationalError:
-            cursor.execute(self.strings['create_branches'])
+            cursor.execute(self.strings[create + 'branches'])
             cursor.execute(
                 "INSERT INTO branches (branch, parent, parent_rev) "
                 "VALUES ('master', 'master', 0)"
@@ -773,33 +1539,58 @@ class QueryEngine(object):
         try:
             cursor.execute('SELECT * FROM graphs;')
         except OperationalError:
-            cursor.execute(self.strings['create_graphs'])
+            cursor.execute(self.strings[create + 'graphs'])
         try:
             cursor.execute('SELECT * FROM graph_val;')
         except OperationalError:
-            cursor.execute(self.strings['create_graph_val'])
+            cursor.execute(self.strings[create + 'graph_val'])
             cursor.execute(self.strings['index_graph_val'])
         try:
             cursor.execute('SELECT * FROM nodes;')
         except OperationalError:
-            cursor.execute(self.strings['create_nodes'])
+            cursor.execute(self.strings[create + 'nodes'])
             cursor.execute(self.strings['index_nodes'])
 
         try:
             cursor.execute('SELECT * FROM node_val;')
         except OperationalError:
-            cursor.execute(self.strings['create_node_val'])
+            cursor.execute(self.strings[create + 'node_val'])
             cursor.execute(self.strings['index_node_val'])
         try:
             cursor.execute('SELECT * FROM edges;')
         except OperationalError:
-            cursor.execute(self.strings['create_edges'])
+            cursor.execute(self.strings[create + 'edges'])
             cursor.execute(self.strings['index_edges'])
         try:
             cursor.execute('SELECT * FROM edge_val;')
         except OperationalError:
-            cursor.execute(self.strings['create_edge_val'])
+            cursor.execute(self.strings[create + 'edge_val'])
             cursor.execute(self.strings['index_edge_val'])
+        try:
+            cursor.execute('SELECT * FROM vals;')
+        except OperationalError:
+            cursor.execute(self.strings[create + 'vals'])
+        for tab in ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val'):
+            try:
+                cursor.execute('SELECT * FROM {}_archive;'.format(tab))
+            except OperationalError:
+                cursor.execute(self.strings[create + tab + '_archive'])
+                cursor.execute(self.strings['index_{}_archive'.format(tab)])
+            for idx in ('index_{}_rev', 'index_{}_rev_archive'):
+                try:
+                    cursor.execute(self.strings[idx.format(tab)])
+                except OperationalError:
+                    pass  # made already
+        if 'archive_rev' in self.globl:
+            self._archive_rev = self.globl['archive_rev']
+
+    def _init_codec(self):
+        """Record which codec the database uses, if it's not recorded
+        already.
+
+        """
+        if self.sql('global_get', codec_key).fetchone() is None:
+            self.sql('global_ins', codec_key, self.codec.name)
 
     def flush(self):
         self.flush_nodes()
@@ -809,15 +1600,28 @@ class QueryEngine(object):
         self.flush_edge_val()
 
     def commit(self):
-        """Commit the transaction"""
+        """Commit the transaction, and begin another"""
+        if self.readonly:
+            return
         self.flush()
         if hasattr(self, 'transaction'):
             self.transaction.commit()
+            self.transaction = self.alchemist.conn.begin()
         else:
             self.connection.commit()
 
     def close(self):
         """Commit the transaction, then close the connection"""
-        self.commit()
-        if hasattr(self, 'connection'):
+        if self.readonly:
+            if hasattr(self, 'alchemist'):
+                self.alchemist.conn.close()
+            else:
+                self.connection.close()
+            return
+        self.flush()
+        if hasattr(self, 'transaction'):
+            self.transaction.commit()
+            self.alchemist.conn.close()
+        else:
+            self.connection.commit()
             self.connection.close()
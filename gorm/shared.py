@@ -0,0 +1,397 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Read-only snapshots of a whole history, for many processes to share.
+
+One process writes a snapshot file with :func:`build`, or
+:meth:`gorm.ORM.share`. Any number of others open it as a
+:class:`Snapshot`, which maps the file into memory and looks things up
+in it where it lies, so they all share the one copy the operating
+system keeps of the file, and none of them has to load the history
+into caches of its own.
+
+Every key, value, and branch name in the file is written once, in a
+sorted table of their JSON encodings, and everywhere else referred to
+by its position in that table. Each history table is an array of
+variables, as tuples of those positions, sorted; and an array of
+``(branch, rev, value)`` records for each variable, sorted too, so
+that everything is found by binary search.
+
+"""
+from array import array
+from json import dumps, loads
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+import os
+from .xjson import json_dump, json_load
+
+
+magic = b'gormshr1'
+header_length = Struct('<q')
+tables = {
+    'graph_val': 2,
+    'nodes': 2,
+    'node_val': 3,
+    'edges': 4,
+    'predecessors': 4,
+    'edge_val': 5
+}
+"""The tables in a snapshot, and how many parts their variables have.
+``predecessors`` is ``edges`` with the nodes the other way around.
+
+"""
+
+
+def _pad(f):
+    """Write zeroes to ``f`` until its position is a multiple of 8, and
+    return the position
+
+    """
+    pos = f.tell()
+    if pos % 8:
+        f.write(bytes(8 - pos % 8))
+    return f.tell()
+
+
+def _history(db):
+    """Iterate over ``(table, variable, branch, rev, value)`` for
+    everything ever written with the query engine ``db``
+
+    """
+    for (graph, key, branch, rev, value) in db.graph_val_dump():
+        yield ('graph_val', (graph, key), branch, rev, value)
+    for (graph, node, branch, rev, extant) in db.nodes_dump():
+        yield ('nodes', (graph, node), branch, rev, True if extant else None)
+    for (graph, node, key, branch, rev, value) in db.node_val_dump():
+        yield ('node_val', (graph, node, key), branch, rev, value)
+    for (graph, nodeA, nodeB, idx, branch, rev, extant) in db.edges_dump():
+        extant = True if extant else None
+        yield ('edges', (graph, nodeA, nodeB, idx), branch, rev, extant)
+        yield ('predecessors', (graph, nodeB, nodeA, idx), branch, rev, extant)
+    for (graph, nodeA, nodeB, idx, key, branch, rev, value) \
+            in db.edge_val_dump():
+        yield (
+            'edge_val', (graph, nodeA, nodeB, idx, key), branch, rev, value
+        )
+
+
+def build(db, path):
+    """Write a snapshot of everything in the query engine ``db`` to a
+    file at ``path``, replacing whatever was there only once the
+    snapshot's complete
+
+    """
+    encoded = {table: {} for table in tables}
+    strings = set()
+    for (table, var, branch, rev, value) in _history(db):
+        var = tuple(json_dump(part) for part in var)
+        branch = json_dump(branch)
+        value = None if value is None else json_dump(value)
+        strings.update(var)
+        strings.add(branch)
+        if value is not None:
+            strings.add(value)
+        encoded[table][var, branch, rev] = value
+    branches = db.all_branches()
+    strings.update(json_dump(row[0]) for row in branches)
+    strings = sorted(s.encode('utf-8') for s in strings)
+    ids = {s.decode('utf-8'): i for (i, s) in enumerate(strings)}
+    sections = {}
+    part = path + '.part'
+    with open(part, 'wb') as f:
+        # leave room to say where the header is, and how long
+        f.write(bytes(len(magic) + 2 * header_length.size))
+        offsets = array('q', [0])
+        for s in strings:
+            offsets.append(offsets[-1] + len(s))
+        sections['offsets'] = _pad(f)
+        offsets.tofile(f)
+        sections['strings'] = f.tell()
+        for s in strings:
+            f.write(s)
+        sections['count'] = len(strings)
+        sections['tables'] = {}
+        for (table, width) in tables.items():
+            records = sorted(
+                (
+                    tuple(ids[p] for p in var), ids[branch], rev,
+                    -1 if value is None else ids[value]
+                )
+                for ((var, branch, rev), value) in encoded[table].items()
+            )
+            variables = array('q')
+            starts = array('q')
+            recs = array('q')
+            for (i, (var, branch, rev, value)) in enumerate(records):
+                if i == 0 or records[i - 1][0] != var:
+                    variables.extend(var)
+                    starts.append(i)
+                recs.extend((branch, rev, value))
+            starts.append(len(records))
+            section = sections['tables'][table] = {
+                'variables': len(starts) - 1
+            }
+            for (name, arr) in (
+                    ('vars', variables), ('starts', starts),
+                    ('records', recs)
+            ):
+                section[name] = _pad(f)
+                arr.tofile(f)
+        sections['branches'] = [list(row) for row in branches]
+        sections['graphs'] = [
+            [json_dump(graph), typ] for (graph, typ) in db.graphs_types()
+        ]
+        header = dumps(sections).encode('utf-8')
+        sections_at = _pad(f)
+        f.write(header)
+        f.seek(0)
+        f.write(magic)
+        f.write(header_length.pack(sections_at))
+        f.write(header_length.pack(len(header)))
+    os.replace(part, path)
+
+
+class Snapshot(object):
+    """A history written by :func:`build`, mapped into memory.
+
+    Look things up with the methods named after the tables, giving
+    the branch and revision every time. Values are decoded afresh
+    for every lookup, so they're yours to change.
+
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap(f.fileno(), 0, access=ACCESS_READ)
+        if self._mmap[:len(magic)] != magic:
+            self._mmap.close()
+            raise ValueError("{} isn't a gorm snapshot".format(path))
+        (at,) = header_length.unpack_from(self._mmap, len(magic))
+        (length,) = header_length.unpack_from(
+            self._mmap, len(magic) + header_length.size
+        )
+        sections = loads(self._mmap[at:at + length].decode('utf-8'))
+        self._views = []
+        n = sections['count']
+        self._offsets = self._ints(sections['offsets'], n + 1)
+        self._strings = sections['strings']
+        self._count = n
+        self._tables = {}
+        for (table, width) in tables.items():
+            section = sections['tables'][table]
+            nvars = section['variables']
+            starts = self._ints(section['starts'], nvars + 1)
+            self._tables[table] = (
+                width, nvars,
+                self._ints(section['vars'], nvars * width),
+                starts,
+                self._ints(section['records'], 3 * starts[nvars])
+            )
+        self.parentbranch_rev = {
+            branch: (parent, rev)
+            for (branch, parent, rev) in sections['branches']
+            if branch != 'master'
+        }
+        """Each branch but ``'master'``'s parent, and the revision it
+        started at"""
+        self.graphs = {
+            json_load(graph): typ for (graph, typ) in sections['graphs']
+        }
+        """The type of each graph"""
+
+    def _ints(self, offset, n):
+        view = memoryview(self._mmap)[offset:offset + 8 * n].cast('q')
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """Stop looking at the file"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _string(self, i):
+        return self._mmap[
+            self._strings + self._offsets[i]:
+            self._strings + self._offsets[i + 1]
+        ]
+
+    def _id(self, obj):
+        """Return where ``obj`` is in the strings, or -1 if it isn't"""
+        s = json_dump(obj).encode('utf-8')
+        (lo, hi) = (0, self._count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string(mid) < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._string(lo) == s:
+            return lo
+        return -1
+
+    def _load(self, i):
+        return json_load(self._string(i).decode('utf-8'), hint=False)
+
+    def _lineage(self, branch, rev):
+        """Iterate over ``(branch, rev)`` for the branch and its ancestors,
+        each with the last revision of it that matters
+
+        """
+        yield (branch, rev)
+        while branch in self.parentbranch_rev:
+            (branch, rev) = self.parentbranch_rev[branch]
+            yield (branch, rev)
+
+    def _variables(self, table, prefix):
+        """Return the range of the variables in the table that start with
+        the ids in ``prefix``
+
+        """
+        (width, nvars, variables, starts, records) = self._tables[table]
+        p = len(prefix)
+
+        def bound(upper):
+            (lo, hi) = (0, nvars)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                var = tuple(variables[mid * width:mid * width + p])
+                if var < prefix or (upper and var == prefix):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+        return (bound(False), bound(True))
+
+    def _value_id(self, table, i, lineage):
+        """Return the id of the value of the ``i``th variable in the table as
+        of the last of the ``(branch, rev)`` pairs in ``lineage`` that
+        has one, or -1 if none does
+
+        """
+        (width, nvars, variables, starts, records) = self._tables[table]
+        for (branch, rev) in lineage:
+            (lo, hi) = (starts[i], starts[i + 1])
+            # the first record after (branch, rev)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if (records[3 * mid], records[3 * mid + 1]) <= (branch, rev):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo > starts[i] and records[3 * (lo - 1)] == branch:
+                return records[3 * (lo - 1) + 2]
+        return -1
+
+    def _ids(self, var, branch, rev):
+        """Return the ids of the parts of ``var``, and the ids of the branches
+        in the lineage with their revisions; or ``None`` if any part of
+        ``var`` was never written
+
+        """
+        ids = tuple(self._id(part) for part in var)
+        if -1 in ids:
+            return None
+        return (ids, [
+            (self._id(b), r) for (b, r) in self._lineage(branch, rev)
+        ])
+
+    def _value(self, table, var, branch, rev):
+        """Return the value of ``var`` in the table as of the branch and
+        revision, or ``None`` if it hasn't got one
+
+        """
+        found = self._ids(var, branch, rev)
+        if found is None:
+            return None
+        (ids, lineage) = found
+        (lo, hi) = self._variables(table, ids)
+        if lo == hi:
+            return None
+        i = self._value_id(table, lo, lineage)
+        if i == -1:
+            return None
+        return self._load(i)
+
+    def _children(self, table, prefix, branch, rev):
+        """Iterate over every distinct thing that comes after ``prefix`` in
+        a variable of the table that has a value as of the branch and
+        revision
+
+        """
+        found = self._ids(prefix, branch, rev)
+        if found is None:
+            return
+        (ids, lineage) = found
+        (lo, hi) = self._variables(table, ids)
+        (width, nvars, variables, starts, records) = self._tables[table]
+        p = len(ids)
+        seen = -1
+        for i in range(lo, hi):
+            child = variables[i * width + p]
+            if child == seen:
+                continue
+            if self._value_id(table, i, lineage) != -1:
+                seen = child
+                yield self._load(child)
+
+    def _get(self, table, var, branch, rev):
+        value = self._value(table, var, branch, rev)
+        if value is None:
+            raise KeyError("No value for {} in {}".format(var, table))
+        return value
+
+    def graph_val(self, graph, key, branch, rev):
+        """Return the value of the graph's key, or raise ``KeyError``"""
+        return self._get('graph_val', (graph, key), branch, rev)
+
+    def graph_keys(self, graph, branch, rev):
+        """Iterate over the keys set on the graph"""
+        return self._children('graph_val', (graph,), branch, rev)
+
+    def nodes(self, graph, branch, rev):
+        """Iterate over the nodes in the graph"""
+        return self._children('nodes', (graph,), branch, rev)
+
+    def has_node(self, graph, node, branch, rev):
+        """Return whether the node is in the graph"""
+        return self._value('nodes', (graph, node), branch, rev) is not None
+
+    def node_val(self, graph, node, key, branch, rev):
+        """Return the value of the node's key, or raise ``KeyError``"""
+        return self._get('node_val', (graph, node, key), branch, rev)
+
+    def node_keys(self, graph, node, branch, rev):
+        """Iterate over the keys set on the node"""
+        return self._children('node_val', (graph, node), branch, rev)
+
+    def successors(self, graph, nodeA, branch, rev):
+        """Iterate over the nodes with edges from ``nodeA``"""
+        return self._children('edges', (graph, nodeA), branch, rev)
+
+    def predecessors(self, graph, nodeB, branch, rev):
+        """Iterate over the nodes with edges to ``nodeB``"""
+        return self._children('predecessors', (graph, nodeB), branch, rev)
+
+    def has_edge(self, graph, nodeA, nodeB, branch, rev, idx=0):
+        """Return whether there's an edge from ``nodeA`` to ``nodeB``"""
+        return self._value(
+            'edges', (graph, nodeA, nodeB, idx), branch, rev
+        ) is not None
+
+    def edge_val(self, graph, nodeA, nodeB, key, branch, rev, idx=0):
+        """Return the value of the edge's key, or raise ``KeyError``"""
+        return self._get(
+            'edge_val', (graph, nodeA, nodeB, idx, key), branch, rev
+        )
+
+    def edge_keys(self, graph, nodeA, nodeB, branch, rev, idx=0):
+        """Iterate over the keys set on the edge"""
+        return self._children(
+            'edge_val', (graph, nodeA, nodeB, idx), branch, rev
+        )
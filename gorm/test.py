@@ -1,5 +1,12 @@
 import unittest
+import gc
+import math
+import os
+import sqlite3
+import weakref
 from copy import deepcopy
+from shutil import rmtree
+from tempfile import mkdtemp
 import gorm
 
 
@@ -161,6 +168,932 @@ class StorageTest(GormTest):
             self.engine.del_graph('testgraph')
 
 
+class NestedEditTest(GormTest):
+    def runTest(self):
+        """Edit many fields of a dictionary attribute in one revision, and
+        make sure that only one row is pending for it.
+
+        """
+        g = self.engine.new_graph('nested')
+        g.add_node(0)
+        g.node[0]['stats'] = {}
+        for i in range(100):
+            g.node[0]['stats']['stat{}'.format(i)] = i
+        self.assertEqual(
+            [k for k in self.engine.db._nodevals2set if k[2] == 'stats'],
+            [('nested', 0, 'stats', 'master', 0)]
+        )
+        self.assertEqual(
+            self.engine.db.node_val_get('nested', 0, 'stats', 'master', 0),
+            {'stat{}'.format(i): i for i in range(100)}
+        )
+        self.engine.db.flush()
+        self.assertEqual(len(self.engine.db._nodevals2set), 0)
+        self.assertEqual(
+            self.engine.db.node_val_get('nested', 0, 'stats', 'master', 0)['stat99'],
+            99
+        )
+
+
+class CopyOnWriteTest(GormTest):
+    def runTest(self):
+        """Edit nested values in a later revision, and make sure the earlier
+        revision keeps its own.
+
+        """
+        g = self.engine.new_graph('cow')
+        g.add_node(0)
+        n = g.node[0]
+        n['stats'] = {'inv': {'gold': 1}, 'path': [0, 1]}
+        self.assertIs(n['stats'], n['stats'])
+        self.engine.rev = 1
+        n['stats']['inv']['gold'] = 2
+        n['stats']['path'].insert(0, -1)
+        copied = n['stats']._v
+        n['stats']['inv']['silver'] = 3
+        self.assertIs(n['stats']._v, copied)
+        self.assertEqual(n['stats'], {'inv': {'gold': 2, 'silver': 3}, 'path': [-1, 0, 1]})
+        self.engine.rev = 0
+        self.assertEqual(n['stats'], {'inv': {'gold': 1}, 'path': [0, 1]})
+        self.engine.db.flush()
+        self.assertEqual(
+            self.engine.db.node_val_get('cow', 0, 'stats', 'master', 0),
+            {'inv': {'gold': 1}, 'path': [0, 1]}
+        )
+        self.assertEqual(
+            self.engine.db.node_val_get('cow', 0, 'stats', 'master', 1),
+            {'inv': {'gold': 2, 'silver': 3}, 'path': [-1, 0, 1]}
+        )
+
+
+class UncachedNestedTest(unittest.TestCase):
+    def runTest(self):
+        """Read and edit dictionary and list attributes with caching off"""
+        engine = gorm.ORM('sqlite:///:memory:', caching=False)
+        self.addCleanup(engine.close)
+        g = engine.new_graph('uncached')
+        g.add_node(0)
+        g.node[0]['stats'] = {'inv': {'gold': 1}, 'path': [0, 1]}
+        self.assertEqual(g.node[0]['stats'], {'inv': {'gold': 1}, 'path': [0, 1]})
+        self.assertEqual(g.node[0]['stats']['inv']['gold'], 1)
+        g.node[0]['stats']['inv']['gold'] = 2
+        g.node[0]['stats']['path'].append(2)
+        self.assertEqual(
+            engine.db.node_val_get('uncached', 0, 'stats', 'master', 0),
+            {'inv': {'gold': 2}, 'path': [0, 1, 2]}
+        )
+        g.graph['list'] = [1, 2]
+        self.assertEqual(list(g.graph['list']), [1, 2])
+
+
+class ArchiveTest(GormTest):
+    def setUp(self):
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        self.path = os.path.join(tmp, 'archive.db')
+        self.engine = gorm.ORM('sqlite:///' + self.path)
+
+    def runTest(self):
+        """Archive old history and make sure it can still be read, from the
+        hot tables after the watermark and from the archive before it,
+        and after opening the database again.
+
+        """
+        g = self.engine.new_graph('archived')
+        g.add_node(0)
+        for rev in range(6):
+            self.engine.rev = rev
+            g.node[0]['hp'] = rev
+        self.engine.archive(3)
+        db = self.engine.db
+        self.assertEqual(
+            sorted(row[4] for row in db.sql('node_val_dump')), [3, 4, 5]
+        )
+        self.assertEqual(
+            sorted(row[4] for row in db.sql('archive_node_val_dump')), [0, 1, 2]
+        )
+        for rev in range(6):
+            self.assertEqual(db.node_val_get('archived', 0, 'hp', 'master', rev), rev)
+        db.node_val_set('archived', 0, 'hp', 'master', 1, 10)
+        self.assertEqual(db.node_val_get('archived', 0, 'hp', 'master', 1), 10)
+        self.assertEqual(db.node_val_get('archived', 0, 'hp', 'master', 2), 2)
+        self.assertEqual(
+            [row[4:] for row in db.node_val_dump()],
+            [(0, 0), (1, 10), (2, 2), (3, 3), (4, 4), (5, 5)]
+        )
+        self.engine.close()
+        self.engine = gorm.ORM('sqlite:///' + self.path)
+        g = self.engine.get_graph('archived')
+        for (rev, hp) in enumerate([0, 10, 2, 3, 4, 5]):
+            self.engine.rev = rev
+            self.assertEqual(g.node[0]['hp'], hp)
+
+
+class DelBranchTest(GormTest):
+    def runTest(self):
+        """Delete a branch and its descendants, and make sure the rest of
+        history survives.
+
+        """
+        g = self.engine.new_graph('pruned')
+        g.add_node(0)
+        self.engine.rev = 1
+        self.engine.branch = 'doomed'
+        g.add_node(1)
+        self.engine.rev = 2
+        self.engine.branch = 'also_doomed'
+        g.node[0]['hp'] = 3
+        self.engine.branch = 'master'
+        self.assertRaises(ValueError, self.engine.del_branch, 'doomed', False)
+        self.engine.del_branch('doomed')
+        self.assertEqual(
+            [branch for (branch, parent, rev) in self.engine.db.all_branches()],
+            ['master']
+        )
+        self.assertNotIn('doomed', self.engine._parentbranch_rev)
+        self.assertNotIn('also_doomed', self.engine._childbranch['doomed'])
+        self.assertEqual(
+            [row[2] for row in self.engine.db.nodes_dump()], ['master']
+        )
+        self.assertIn(0, g.node)
+        self.assertNotIn(1, g.node)
+        self.engine.branch = 'doomed'
+        self.assertNotIn(1, g.node)
+        self.assertNotIn('hp', g.node[0])
+
+
+class XJSONHintTest(unittest.TestCase):
+    def runTest(self):
+        """Make sure the memos of encodings tell apart values that are
+        equal but encode differently, and don't grow without bound.
+
+        """
+        from gorm import xjson
+        for v in ('1', 1, 1.0, True, (1,), (True,), (1.0,), ('1',)):
+            self.assertEqual(xjson.json_load(xjson.json_dump(v)), v)
+            self.assertIs(type(xjson.json_load(xjson.json_dump(v))), type(v))
+            self.assertEqual(
+                xjson.json_dump(v), xjson.json_dump(v, hint=False)
+            )
+        oldmax = xjson.hint_maxsize
+        xjson.hint_maxsize = 10
+        try:
+            for i in range(20):
+                xjson.json_load(xjson.json_dump((i,)))
+            self.assertLessEqual(len(xjson.json_dump_hints), 10)
+            self.assertLessEqual(len(xjson.json_load_hints), 10)
+        finally:
+            xjson.hint_maxsize = oldmax
+        loaded = xjson.json_load('["list", 1]')
+        loaded.append(2)
+        self.assertEqual(xjson.json_load('["list", 1]'), [1])
+
+
+history_tables = ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val')
+all_index_names = {
+    tab + idx + suffix
+    for tab in history_tables
+    for idx in ('_idx', '_rev_idx')
+    for suffix in ('', '_archive')
+}
+
+
+def index_names(path):
+    """Return the names of the indices in the SQLite database at
+    ``path``, which may be a SQLAlchemy URL.
+
+    """
+    if path.startswith('sqlite:///'):
+        path = path[len('sqlite:///'):]
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' "
+                "AND name NOT LIKE 'sqlite_autoindex%'"
+            )
+        }
+    finally:
+        conn.close()
+
+
+class BinaryCodecTest(unittest.TestCase):
+    def runTest(self):
+        """Store all the test data in a binary-encoded database, on both
+        backends, and make sure it comes back the same. Reopen the
+        database and check it remembers its codec.
+
+        """
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        for alchemy in (True, False):
+            path = os.path.join(tmp, 'binary{}.db'.format(alchemy))
+            if alchemy:
+                path = 'sqlite:///' + path
+            engine = gorm.ORM(path, alchemy=alchemy, codec='binary')
+            graphname = 'encoded{}'.format(alchemy)
+            g = engine.new_graph(graphname)
+            g.add_node(0)
+            n = g.node[0]
+            for (k, v) in testdata:
+                n[k] = v
+                self.assertEqual(n[k], v)
+            engine.db.flush()
+            self.assertIsInstance(next(engine.db.sql('node_val_dump'))[-1], bytes)
+            engine.close()
+            self.assertEqual(index_names(path), all_index_names)
+            self.assertRaises(
+                ValueError, gorm.ORM, path, alchemy=alchemy, codec='json'
+            )
+            engine = gorm.ORM(path, alchemy=alchemy)
+            self.assertEqual(engine.db.codec.name, 'binary')
+            for (k, v) in dict(testdata).items():
+                self.assertEqual(engine.db.node_val_get(graphname, 0, k, 'master', 0), v)
+            engine.close()
+        codec = gorm.codec.get_codec('binary')
+        self.assertEqual(
+            codec.dump({'a': 1, 'b': {0: 1, 'x': 2}}),
+            codec.dump({'b': {'x': 2, 0: 1}, 'a': 1})
+        )
+        self.assertNotEqual(codec.dump(1), codec.dump(1.0))
+        self.assertNotEqual(codec.dump([1]), codec.dump((1,)))
+
+
+class CompressionTest(unittest.TestCase):
+    def runTest(self):
+        """Store a big value with compression, in both codecs, and make sure
+        it's compressed in the database and loads the same.
+
+        """
+        from gorm.codec import compressors
+        big = {'field{}'.format(i): list(range(i % 10)) for i in range(500)}
+        for codec in ('json', 'binary'):
+            for compression in compressors:
+                engine = gorm.ORM(
+                    'sqlite:///:memory:', codec=codec,
+                    compress_threshold=256, compression=compression
+                )
+                db = engine.db
+                db.new_graph('squashed', 'Graph')
+                db.exist_node('squashed', 0, 'master', 0, True)
+                db.node_val_set('squashed', 0, 'big', 'master', 0, big)
+                db.node_val_set('squashed', 0, 'small', 'master', 0, 1)
+                db.flush()
+                stored = {
+                    db.json_load(key): value for (graph, node, key, branch, rev, value)
+                    in db.sql('node_val_dump')
+                }
+                self.assertLess(len(stored['big']), len(db.json_dump(big)))
+                self.assertEqual(stored['small'], db.json_dump(1))
+                self.assertEqual(db.node_val_get('squashed', 0, 'big', 'master', 0), big)
+                self.assertEqual(db.node_val_get('squashed', 0, 'small', 'master', 0), 1)
+                engine.close()
+
+
+class DedupTest(unittest.TestCase):
+    def runTest(self):
+        """Store the same big value many times with deduplication, and make
+        sure it's stored once and decoded once, unless it's been pushed
+        out of memory by others.
+
+        """
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        path = 'sqlite:///' + os.path.join(tmp, 'dedup.db')
+        template = {'stat{}'.format(i): i for i in range(100)}
+        engine = gorm.ORM(path, dedup_threshold=64)
+        db = engine.db
+        db.new_graph('deduped', 'Graph')
+        for node in range(5):
+            db.exist_node('deduped', node, 'master', 0, True)
+            for rev in range(3):
+                db.node_val_set('deduped', node, 'stats', 'master', rev, template)
+            db.node_val_set('deduped', node, 'small', 'master', 0, node)
+        db.flush()
+        self.assertEqual(
+            db.alchemist.conn.execute('SELECT COUNT(*) FROM vals').scalar(), 1
+        )
+        engine.close()
+        engine = gorm.ORM(path, dedup_threshold=64)
+        db = engine.db
+        self.assertEqual(db.node_val_get('deduped', 0, 'stats', 'master', 2), template)
+        self.assertIs(
+            db.node_val_get('deduped', 0, 'stats', 'master', 2),
+            db.node_val_get('deduped', 4, 'stats', 'master', 1)
+        )
+        self.assertEqual(db.node_val_get('deduped', 3, 'small', 'master', 0), 3)
+        engine.close()
+        engine = gorm.ORM(path, dedup_threshold=64, caching=False, vals_maxsize=1)
+        db = engine.db
+        other = dict(template, stat0=-1)
+        db.node_val_set('deduped', 0, 'stats', 'master', 3, other)
+        db.flush()
+        first = db.node_val_get('deduped', 0, 'stats', 'master', 2)
+        self.assertEqual(db.node_val_get('deduped', 0, 'stats', 'master', 3), other)
+        again = db.node_val_get('deduped', 0, 'stats', 'master', 2)
+        self.assertEqual(again, template)
+        self.assertIsNot(again, first)
+        engine.close()
+
+
+class NodesWhereTest(unittest.TestCase):
+    def runTest(self):
+        """Query nodes by an attribute in every configuration, in a branch
+        that inherits some of its values.
+
+        """
+        configs = [
+            dict(caching=True), dict(caching=False),
+            dict(caching=False, codec='binary'),
+            dict(caching=False, compress_threshold=8),
+            dict(caching=False, alchemy=False)
+        ]
+        for (i, kwargs) in enumerate(configs):
+            engine = gorm.ORM('sqlite:///:memory:', **kwargs)
+            g = engine.new_graph('where{}'.format(i))
+            for n in range(10):
+                g.add_node(n, hp=n, name='n{}'.format(n))
+            g.add_node('x', hp='lots')
+            g.node[9]['hp'] = [9] * 10
+            engine.branch = 'b'
+            engine.rev = 1
+            g.node[0]['hp'] = 100
+            del g.node[1]['hp']
+            self.assertEqual(set(g.nodes_where('hp', '<', 5)), {2, 3, 4})
+            self.assertEqual(set(g.nodes_where('hp', 'ge', 8)), {0, 8})
+            self.assertEqual(set(g.nodes_where('name', '==', 'n5')), {5})
+            self.assertEqual(set(g.nodes_where('hp', '==', [9] * 10)), {9})
+            engine.branch = 'master'
+            self.assertEqual(set(g.nodes_where('hp', '<', 3)), {0, 1, 2})
+            self.assertRaises(ValueError, list, g.nodes_where('hp', '~', 1))
+            engine.close()
+
+
+class NodeIndexTest(GormTest):
+    def runTest(self):
+        """Index nodes by location, both before and after setting locations,
+        and make sure lookups agree with a scan in every revision and
+        branch.
+
+        """
+        early = self.engine.new_graph('indexed_early')
+        early.add_node_index('location')
+        late = self.engine.new_graph('indexed_late')
+        for g in (early, late):
+            for n in range(6):
+                g.add_node(n, location=n % 3)
+            g.node[5]['location'] = ['unhashable']
+        self.engine.rev = 1
+        for g in (early, late):
+            g.node[0]['location'] = 2
+            del g.node[1]['location']
+        self.engine.branch = 'b'
+        self.engine.rev = 2
+        for g in (early, late):
+            g.node[3]['location'] = 1
+            g.node[5]['location'] = 0
+        self.engine.branch = 'master'
+        self.engine.rev = 3
+        for g in (early, late):
+            g.node[4]['location'] = 0
+        late.add_node_index('location')
+        expected = {
+            ('master', 0): {0: {0, 3}, 1: {1, 4}, 2: {2}},
+            ('master', 1): {0: {3}, 1: {4}, 2: {0, 2}},
+            ('b', 2): {0: {5}, 1: {3, 4}, 2: {0, 2}},
+            ('master', 3): {0: {3, 4}, 1: set(), 2: {0, 2}}
+        }
+        for ((branch, rev), locs) in expected.items():
+            self.engine.branch = branch
+            self.engine.rev = rev
+            for (loc, nodes) in locs.items():
+                for g in (early, late):
+                    self.assertEqual(set(g.nodes_where('location', '==', loc)), nodes)
+        self.assertEqual(
+            set(early.nodes_where('location', '==', ['unhashable'])), {5}
+        )
+
+
+class CSRTest(unittest.TestCase):
+    def runTest(self):
+        """Export a graph's edges as CSR arrays, now and in the past, with
+        and without caching.
+
+        """
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            g = engine.new_graph('csr{}'.format(caching))
+            for n in range(4):
+                g.add_node(n)
+            g.add_edge(0, 1, weight=2)
+            g.add_edge(1, 2, weight=3)
+            g.add_edge(2, 3)
+            engine.rev = 1
+            g.remove_edge(1, 2)
+            (ids, indptr, indices, data) = g.to_csr(attrs=('weight',), default=0)
+            self.assertEqual(ids, {0: 0, 1: 1, 2: 2, 3: 3})
+            self.assertEqual(list(indptr), [0, 1, 2, 3, 4])
+            self.assertEqual(list(indices), [1, 0, 3, 2])
+            self.assertEqual(list(data['weight']), [2, 2, 0, 0])
+            (ids, indptr, indices, data) = g.to_csr(rev=0, attrs=('weight',))
+            self.assertEqual(list(indptr), [0, 1, 3, 5, 6])
+            self.assertEqual(list(indices), [1, 0, 2, 1, 3, 2])
+            self.assertEqual(list(data['weight'])[:4], [2, 2, 3, 3])
+            self.assertNotEqual(data['weight'][4], data['weight'][4])
+            engine.close()
+
+
+class SnapshotTest(unittest.TestCase):
+    def runTest(self):
+        """Take snapshots of a graph, and make sure they're reused until
+        something they show changes, even in bulk.
+
+        """
+        import networkx
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            g = engine.new_graph('snap{}'.format(caching), colour='red')
+            g.add_node(0, hp=1)
+            g.add_node(1)
+            g.add_edge(0, 1, weight=2)
+            snap = g.snapshot()
+            self.assertIsInstance(snap, networkx.Graph)
+            self.assertNotIsInstance(snap, gorm.Graph)
+            self.assertEqual(snap.graph, {'colour': 'red'})
+            self.assertEqual(dict(snap.node), {0: {'hp': 1}, 1: {}})
+            self.assertEqual(snap.adj[0][1], {'weight': 2})
+            self.assertRaises(networkx.NetworkXError, snap.add_node, 2)
+            self.assertIs(g.snapshot(), snap)
+            engine.rev = 1
+            g.node[0]['hp'] = 2
+            self.assertIs(g.snapshot(rev=0), snap)
+            engine.branch = 'b'
+            g.add_node(2)
+            self.assertIs(g.snapshot('master', 0), snap)
+            self.assertIn(2, g.snapshot())
+            engine.branch = 'master'
+            engine.rev = 0
+            g.node[1]['hp'] = 3
+            self.assertIsNot(g.snapshot(), snap)
+            self.assertEqual(g.snapshot().node[1], {'hp': 3})
+            snap = g.snapshot()
+            engine.db.node_val_ins_many(
+                ('snap{}'.format(caching), 1, 'hp', 'master', 0, 4)
+            )
+            self.assertIsNot(g.snapshot(), snap)
+            if not caching:
+                self.assertEqual(g.snapshot().node[1], {'hp': 4})
+            engine.close()
+
+
+class BulkAttributeTest(unittest.TestCase):
+    def runTest(self):
+        """Read one attribute of every node and edge at once, with and
+        without caching.
+
+        """
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            g = engine.new_graph('bulk{}'.format(caching))
+            for n in range(4):
+                g.add_node(n, hp=n * 10)
+            del g.node[3]['hp']
+            g.add_edge(0, 1, weight=5)
+            g.add_edge(1, 2)
+            engine.branch = 'b'
+            engine.rev = 1
+            g.node[0]['hp'] = 7
+            self.assertEqual(
+                g.node_attribute('hp', -1), {0: 7, 1: 10, 2: 20, 3: -1}
+            )
+            (ids, hp) = g.node_attribute('hp', 0, as_array=True)
+            self.assertEqual(ids, {0: 0, 1: 1, 2: 2, 3: 3})
+            self.assertEqual(list(hp), [7, 10, 20, 0])
+            (ids, hp) = g.node_attribute('hp', as_array=True)
+            self.assertEqual(list(hp)[:3], [7, 10, 20])
+            self.assertTrue(math.isnan(hp[3]))
+            self.assertEqual(
+                g.edge_attribute('weight'),
+                {(0, 1): 5, (1, 0): 5, (1, 2): None, (2, 1): None}
+            )
+            engine.close()
+
+
+class HistoryTest(unittest.TestCase):
+    def runTest(self):
+        """Read the changes to values over ranges of revisions that cross
+        into parent branches, with and without caching.
+
+        """
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            g = engine.new_graph('hist{}'.format(caching))
+            g.add_node(0)
+            g.add_node(1)
+            g.add_edge(0, 1)
+            for rev in range(6):
+                engine.rev = rev
+                if rev != 4:
+                    g.node[0]['hp'] = rev * 10
+                g.graph['turn'] = rev
+            engine.rev = 2
+            engine.branch = 'b'
+            engine.rev = 3
+            g.node[0]['hp'] = -1
+            del g.node[1]
+            g.edge[0][1]['w'] = 1
+            engine.rev = 5
+            del g.node[0]['hp']
+            self.assertEqual(
+                list(g.node[0].history('hp', 0, 6)),
+                [(0, 0), (1, 10), (2, 20), (3, -1), (5, None)]
+            )
+            self.assertEqual(
+                list(g.node[0].history('hp', 3, 5, 'master')),
+                [(3, 30), (5, 50)]
+            )
+            self.assertEqual(list(g.graph.history('turn', 1, 4)), [(1, 1), (2, 2)])
+            self.assertEqual(list(g.edge[0][1].history('w', 0, 4)), [(0, None), (3, 1)])
+            engine.branch = 'master'
+            (ids, matrix) = g.node_history('hp', 1, 5, default=0)
+            self.assertEqual(ids, {0: 0, 1: 1})
+            self.assertEqual(list(matrix[0]), [10, 20, 30, 30, 50])
+            self.assertEqual(list(matrix[1]), [0] * 5)
+            engine.close()
+
+
+class DiffTest(unittest.TestCase):
+    def runTest(self):
+        """Diff a graph between revisions and between branches, with and
+        without caching.
+
+        """
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            name = 'diff{}'.format(caching)
+            g = engine.new_graph(name, turn=0)
+            for n in range(3):
+                g.add_node(n, hp=10)
+            g.add_edge(0, 1, weight=1)
+            engine.rev = 1
+            g.graph['turn'] = 1
+            g.node[0]['hp'] = 5
+            g.add_node(3)
+            engine.rev = 2
+            engine.branch = 'b'
+            engine.rev = 3
+            g.node[1]['hp'] = 7
+            del g.node[2]
+            g.add_edge(1, 3)
+            g.edge[0][1]['weight'] = 2
+            engine.branch = 'master'
+            engine.rev = 4
+            g.node[0]['hp'] = 0
+            self.assertEqual(engine.diff(name, ('master', 0), ('master', 1)), {
+                'nodes_added': {3}, 'nodes_removed': set(),
+                'edges_added': set(), 'edges_removed': set(),
+                'graph': {'turn': (0, 1)}, 'node': {0: {'hp': (10, 5)}},
+                'edge': {}
+            })
+            self.assertEqual(engine.diff(name, ('master', 4), ('b', 3)), {
+                'nodes_added': set(), 'nodes_removed': {2},
+                'edges_added': {(1, 3), (3, 1)}, 'edges_removed': set(),
+                'graph': {},
+                'node': {0: {'hp': (0, 5)}, 1: {'hp': (10, 7)}},
+                'edge': {(0, 1): {'weight': (1, 2)}}
+            })
+            self.assertEqual(engine.diff(name, ('b', 3), ('b', 3)), {
+                'nodes_added': set(), 'nodes_removed': set(),
+                'edges_added': set(), 'edges_removed': set(),
+                'graph': {}, 'node': {}, 'edge': {}
+            })
+            engine.close()
+
+
+class ChangesTest(unittest.TestCase):
+    def runTest(self):
+        """Stream the changes between revisions in a branch's lineage,
+        whole and in chunks, with and without caching.
+
+        """
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///:memory:', caching=caching)
+            name = 'changes{}'.format(caching)
+            g = engine.new_graph(name, turn=0)
+            g.add_node(0, hp=10)
+            g.add_node(1)
+            engine.rev = 1
+            g.graph['turn'] = 1
+            g.node[0]['hp'] = 5
+            g.add_edge(0, 1)
+            engine.rev = 2
+            engine.branch = 'b'
+            engine.rev = 3
+            g.node[0]['hp'] = 4
+            del g.node[1]
+            engine.branch = 'master'
+            engine.rev = 4
+            g.node[0]['hp'] = 0
+            expected = [
+                (name, None, 'turn', 0, 1, 1),
+                (name, 0, 'hp', 10, 5, 1),
+                (name, (0, 1), None, False, True, 1),
+                (name, (1, 0), None, False, True, 1),
+                (name, 1, None, True, False, 3),
+                (name, 0, 'hp', 5, 4, 3)
+            ]
+            changes = list(engine.changes(0, 4, branch='b'))
+            self.assertEqual(
+                sorted(changes[:4], key=repr), sorted(expected[:4], key=repr)
+            )
+            self.assertEqual(
+                sorted(changes[4:], key=repr), sorted(expected[4:], key=repr)
+            )
+            self.assertEqual(
+                list(engine.changes(2, 4, graph=name)),
+                [(name, 0, 'hp', 5, 0, 4)]
+            )
+            self.assertEqual(list(engine.changes(0, 4, graph='nope')), [])
+            chunks = list(engine.changes(0, 4, branch='b', chunk_size=4))
+            self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+            self.assertEqual(chunks[0] + chunks[1], changes)
+            with self.assertRaises(ValueError):
+                engine.changes(0, 4, chunk_size=0)
+            engine.close()
+
+
+class RevIndexUpgradeTest(unittest.TestCase):
+    def runTest(self):
+        """Open a database made before the ``*_rev_idx`` indices existed,
+        on both backends, and make sure they get added.
+
+        """
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        for alchemy in (True, False):
+            path = os.path.join(tmp, 'old{}.db'.format(alchemy))
+            if alchemy:
+                path = 'sqlite:///' + path
+            engine = gorm.ORM(path, alchemy=alchemy)
+            engine.new_graph('old').add_node(0, hp=10)
+            engine.close()
+            conn = sqlite3.connect(path.replace('sqlite:///', ''))
+            for tab in history_tables:
+                conn.execute('DROP INDEX {}_rev_idx'.format(tab))
+                conn.execute('DROP INDEX {}_rev_idx_archive'.format(tab))
+            conn.commit()
+            conn.close()
+            self.assertFalse(
+                {name for name in index_names(path) if '_rev_idx' in name}
+            )
+            engine = gorm.ORM(path, alchemy=alchemy)
+            self.assertEqual(engine.get_graph('old').node[0]['hp'], 10)
+            engine.close()
+            self.assertEqual(index_names(path), all_index_names)
+
+
+class InternTest(unittest.TestCase):
+    def runTest(self):
+        """Hand out the same node and edge objects while they're in use,
+        but not across ORMs, and let them go when they're not.
+
+        """
+        engines = [gorm.ORM('sqlite:///:memory:') for i in range(2)]
+        graphs = [engine.new_graph('interned') for engine in engines]
+        for g in graphs:
+            g.add_node(0, hp=10)
+            g.add_node(1)
+            g.add_edge(0, 1)
+        (g, h) = graphs
+        n = g.node[0]
+        self.assertIs(g.node[0], n)
+        self.assertIs(g.edge[0][1], g.edge[0][1])
+        self.assertIsNot(h.node[0], n)
+        self.assertIs(h.node[0].gorm, engines[1])
+        self.assertFalse(hasattr(n, '__dict__'))
+        self.assertFalse(hasattr(g.edge[0][1], '__dict__'))
+        h.node[0]['hp'] = 5
+        self.assertEqual(n['hp'], 10)
+        ref = weakref.ref(n)
+        del n
+        gc.collect()
+        self.assertIsNone(ref())
+        for engine in engines:
+            engine.close()
+
+
+class WorkloadTest(unittest.TestCase):
+    def runTest(self):
+        """Generate the same history from the same seed, and read the same
+        values from it at the bottom of a branch tree whether caching
+        or not.
+
+        """
+        from gorm.bench.workloads import make
+        shape = dict(
+            nodes=20, edges=30, churn=5, revs=6, depth=3, fanout=2, seed=7
+        )
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        dumps = []
+        for i in range(2):
+            path = os.path.join(tmp, '{}.db'.format(i))
+            made = make('sqlite:///' + path, **shape)
+            engine = gorm.ORM('sqlite:///' + path, caching=False)
+            dumps.append(list(engine.db.node_val_dump()))
+            engine.close()
+        self.assertEqual(dumps[0], dumps[1])
+        self.assertEqual(len(made['branches']), 14)
+        self.assertEqual(made['rows']['edges'], 60)
+        (leaf, parent, fork) = made['branches'][-1]
+        nodes = []
+        for caching in (True, False):
+            engine = gorm.ORM('sqlite:///' + path, caching=caching)
+            engine.rev = fork + 2
+            engine.branch = leaf
+            g = engine.get_graph('graph0')
+            nodes.append({
+                n: (g.node[n]['hp'], g.node[n]['mp']) for n in range(20)
+            })
+            engine.close()
+        self.assertEqual(nodes[0], nodes[1])
+
+
+class CacheStatsTest(unittest.TestCase):
+    def runTest(self):
+        """Count what's in the caches, overall and for each graph"""
+        engine = gorm.ORM('sqlite:///:memory:')
+        g = engine.new_graph('stats')
+        h = engine.new_graph('stats2')
+        for rev in range(3):
+            engine.rev = rev
+            g.node[0] = {'hp': rev}
+            g.node[1] = {'hp': rev}
+        h.add_node(0)
+        stats = engine.cache_stats()
+        self.assertEqual(
+            set(stats['caches']),
+            {'graph_val', 'nodes', 'node_val', 'edges', 'edge_val'}
+        )
+        self.assertIn('predecessors', stats['caches']['edges']['structures'])
+        nodevals = stats['caches']['node_val']
+        branches = nodevals['structures']['branches']
+        self.assertEqual(branches['entries'], 6)
+        self.assertEqual(branches['windows'], 2)
+        self.assertEqual(branches['lengths'], {2: 2})
+        self.assertGreater(branches['bytes'], 0)
+        self.assertEqual(
+            sum(graph['entries'] for graph in nodevals['graphs'].values()),
+            sum(s['entries'] for s in nodevals['structures'].values())
+        )
+        self.assertEqual(
+            nodevals['graphs'].get('stats2', {'entries': 0})['entries'], 0
+        )
+        self.assertGreater(
+            stats['caches']['nodes']['graphs']['stats2']['entries'], 0
+        )
+        self.assertGreaterEqual(
+            sum(c['bytes'] for c in stats['caches'].values()),
+            stats['bytes']
+        )
+        engine.close()
+        engine = gorm.ORM('sqlite:///:memory:', caching=False)
+        with self.assertRaises(ValueError):
+            engine.cache_stats()
+        engine.close()
+
+
+class CountingTest(unittest.TestCase):
+    def runTest(self):
+        """Count which way cached values were found, only while counting,
+        and only for the engine that's counting
+
+        """
+        engine = gorm.ORM('sqlite:///:memory:')
+        self.addCleanup(engine.close)
+        other = gorm.ORM('sqlite:///:memory:')
+        self.addCleanup(other.close)
+        g = engine.new_graph('counted')
+        h = other.new_graph('uncounted')
+        g.node[0] = {'hp': 1}
+        h.node[0] = {'hp': 1}
+        self.assertIsNone(engine.stats()['caches'])
+        self.assertIn('dump_hits', engine.stats()['json'])
+        self.assertFalse(engine.counting)
+        engine.counting = True
+        self.assertFalse(other.counting)
+        try:
+            self.assertEqual(g.node[0]['hp'], 1)
+            self.assertEqual(g.node[0]['hp'], 1)
+            engine.branch = 'kid'
+            engine.rev = 1
+            self.assertEqual(g.node[0]['hp'], 1)
+            g.node[0]['hp'] = 2
+            engine.rev = 2
+            self.assertEqual(g.node[0]['hp'], 2)
+            other.branch = 'kid'
+            other.rev = 1
+            self.assertEqual(h.node[0]['hp'], 1)
+            stats = engine.stats()['caches']['node_val']
+            self.assertEqual(stats['retrieve']['shallower'], 2)
+            self.assertEqual(stats['retrieve']['branch'], 1)
+            self.assertEqual(stats['retrieve']['ancestor'], 1)
+            self.assertEqual(stats['walked'], {1: 1, 2: 1})
+            self.assertEqual(sum(stats['seek'].values()), 2)
+            self.assertIsNone(other.stats()['caches'])
+        finally:
+            engine.counting = False
+        self.assertFalse(engine.counting)
+        self.assertEqual(g.node[0]['hp'], 2)
+        self.assertEqual(engine.stats()['caches']['node_val'], stats)
+        uncached = gorm.ORM('sqlite:///:memory:', caching=False)
+        self.addCleanup(uncached.close)
+        with self.assertRaises(ValueError):
+            uncached.counting = True
+
+
+class SharedTest(unittest.TestCase):
+    def runTest(self):
+        """Look up history in a snapshot file as the ORM would"""
+        from gorm.shared import Snapshot
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        path = os.path.join(tmp, 'snapshot')
+        engine = gorm.ORM('sqlite:///:memory:')
+        g = engine.new_digraph('shared')
+        g.add_node(0, hp=1)
+        g.add_node(1)
+        g.add_edge(0, 1, weight=3)
+        g.graph['tick'] = (0, 1)
+        engine.rev = 1
+        g.node[0]['hp'] = 2
+        engine.branch = 'kid'
+        engine.rev = 2
+        del g.node[0]['hp']
+        g.add_node(2)
+        g.add_edge(2, 1)
+        engine.branch = 'master'
+        engine.rev = 3
+        g.remove_edge(0, 1)
+        engine.share(path)
+        engine.close()
+        with Snapshot(path) as snap:
+            self.assertEqual(snap.graphs, {'shared': 'DiGraph'})
+            self.assertEqual(snap.parentbranch_rev, {'kid': ('master', 1)})
+            self.assertEqual(snap.node_val('shared', 0, 'hp', 'master', 0), 1)
+            self.assertEqual(snap.node_val('shared', 0, 'hp', 'kid', 1), 2)
+            with self.assertRaises(KeyError):
+                snap.node_val('shared', 0, 'hp', 'kid', 2)
+            self.assertEqual(snap.graph_val('shared', 'tick', 'kid', 2), (0, 1))
+            self.assertEqual(sorted(snap.nodes('shared', 'master', 3)), [0, 1])
+            self.assertEqual(sorted(snap.nodes('shared', 'kid', 2)), [0, 1, 2])
+            self.assertEqual(sorted(snap.predecessors('shared', 1, 'kid', 2)), [0, 2])
+            self.assertEqual(list(snap.successors('shared', 0, 'master', 3)), [])
+            self.assertTrue(snap.has_edge('shared', 0, 1, 'kid', 3))
+            self.assertEqual(snap.edge_val('shared', 0, 1, 'weight', 'master', 0), 3)
+            self.assertFalse(snap.has_node('shared', 'nope', 'master', 0))
+        with open(path, 'wb') as f:
+            f.write(b'nonsense')
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+
+
+class ReadOnlyTest(unittest.TestCase):
+    def runTest(self):
+        """Read a database opened read-only, but refuse to write to it"""
+        tmp = mkdtemp()
+        self.addCleanup(rmtree, tmp)
+        path = 'sqlite:///' + os.path.join(tmp, 'readonly.db')
+        engine = gorm.ORM(path)
+        g = engine.new_graph('ro')
+        g.add_node(0, hp=1)
+        engine.rev = 1
+        g.node[0]['hp'] = 2
+        engine.close()
+        for kwargs in (
+                dict(caching=True), dict(caching=False),
+                dict(alchemy=False, immutable=True)
+        ):
+            engine = gorm.ORM(path, readonly=True, **kwargs)
+            g = engine.get_graph('ro')
+            self.assertEqual(g.node[0]['hp'], 2)
+            engine.rev = 0
+            self.assertEqual(g.node[0]['hp'], 1)
+            with self.assertRaises(gorm.ReadOnlyError):
+                g.node[0]['hp'] = 3
+            with self.assertRaises(gorm.ReadOnlyError):
+                engine.new_graph('other')
+            with self.assertRaises(gorm.ReadOnlyError):
+                engine.branch = 'new'
+            self.assertEqual(g.node[0]['hp'], 1)
+            engine.close()
+        engine = gorm.ORM(path)
+        self.assertEqual(engine.rev, 1)
+        engine.close()
+        with self.assertRaises(ValueError):
+            gorm.ORM('sqlite:///:memory:', readonly=True)
+
+
 class CompiledQueriesTest(GormTest):
     def runTest(self):
         """Make sure that the queries generated in SQLAlchemy are the same as
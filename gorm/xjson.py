@@ -1,6 +1,6 @@
 # This file is part of gorm, an object relational mapper for versioned graphs.
 # Copyright (C) 2014 Zachary Spector.
-from collections import MutableMapping, MutableSequence
+from collections import MutableMapping, MutableSequence, OrderedDict
 from json import dumps, loads
 from copy import deepcopy
 
@@ -43,24 +43,78 @@ def dec_tuple(o):
         return o
 
 
-json_dump_hints = {}
+hint_maxsize = 4096
+"""How many encodings, and how many decodings, to remember"""
+json_dump_hints = OrderedDict()
+json_load_hints = OrderedDict()
+hint_counts = {
+    'dump_hits': 0,
+    'dump_misses': 0,
+    'load_hits': 0,
+    'load_misses': 0
+}
+scalar_types = frozenset([str, int, float, bool, type(None)])
+
+
+def hint_key(obj):
+    """Return a key for ``obj`` that equals another object's key only if
+    they encode the same, unlike the objects themselves: ``1``,
+    ``1.0``, and ``True`` are all equal.
+
+    """
+    if type(obj) is tuple:
+        return (tuple,) + tuple(hint_key(o) for o in obj)
+    return (type(obj), obj)
+
+
+def hint_stats():
+    """Return the numbers of hits and misses on the memos of ``json_dump``
+    and ``json_load``, and how many entries each has.
+
+    """
+    r = dict(hint_counts)
+    r['dump_size'] = len(json_dump_hints)
+    r['load_size'] = len(json_load_hints)
+    return r
 
 
 def json_dump(obj,  hint=True):
-    """JSON dumper that distinguishes lists from tuples"""
+    """JSON dumper that distinguishes lists from tuples
+
+    Scalars are dumped directly. Other values are remembered, up to
+    ``hint_maxsize`` of them, if they're hashable.
+
+    """
+    if type(obj) in scalar_types:
+        return dumps(obj)
     if not hint:
         return dumps(enc_tuple(obj))
-    k = str(obj)
-    if k not in json_dump_hints:
-        json_dump_hints[k] = dumps(enc_tuple(obj))
-    return json_dump_hints[k]
+    try:
+        k = hint_key(obj)
+        r = json_dump_hints[k]
+    except TypeError:
+        # unhashable
+        hint_counts['dump_misses'] += 1
+        return dumps(enc_tuple(obj))
+    except KeyError:
+        hint_counts['dump_misses'] += 1
+        r = json_dump_hints[k] = dumps(enc_tuple(obj))
+        while len(json_dump_hints) > hint_maxsize:
+            json_dump_hints.popitem(last=False)
+        return r
+    hint_counts['dump_hits'] += 1
+    json_dump_hints.move_to_end(k)
+    return r
 
 
-json_load_hints = {}
+def json_load(s,  hint=True):
+    """JSON loader that distinguishes lists from tuples
 
+    Decoded values are remembered, up to ``hint_maxsize`` of them, if
+    they're immutable; mutable ones are decoded afresh every time, so
+    that nobody gets to change what somebody else loaded.
 
-def json_load(s,  hint=True):
-    """JSON loader that distinguishes lists from tuples"""
+    """
     if s is None:
         return None
     if s == '["list"]':
@@ -69,9 +123,22 @@ def json_load(s,  hint=True):
         return tuple()
     if not hint:
         return dec_tuple(loads(s))
-    if s not in json_load_hints:
-        json_load_hints[s] = dec_tuple(loads(s))
-    return json_load_hints[s]
+    try:
+        r = json_load_hints[s]
+    except KeyError:
+        hint_counts['load_misses'] += 1
+        r = dec_tuple(loads(s))
+        try:
+            hash(r)
+        except TypeError:
+            return r
+        json_load_hints[s] = r
+        while len(json_load_hints) > hint_maxsize:
+            json_load_hints.popitem(last=False)
+        return r
+    hint_counts['load_hits'] += 1
+    json_load_hints.move_to_end(s)
+    return r
 
 
 class JSONWrapper(MutableMapping):
@@ -86,7 +153,11 @@ class JSONWrapper(MutableMapping):
 
     def _get(self, k=None):
         if k is None:
-            return self.outer._get(self.outkey)
+            if isinstance(self.outer, JSONWrapper):
+                return self.outer._get(self.outkey)
+            # the outermost wrapper gets its value straight from the
+            # entity's database accessor; gorm doesn't cache it
+            return self.outer._get_db(self.outkey)
         return self._get()[k]
 
     def _set(self, v):
@@ -149,65 +220,81 @@ class JSONListWrapper(JSONWrapper):
 
 
 
-class JSONReWrapper(MutableMapping):
-    """Like JSONWrapper with a cache."""
-    __slots__ = ['_outer', '_key', '_inner', '_v']
+class CopyOnWrite(object):
+    """Methods for wrappers around a list or dictionary that's the value of
+    a key in the cache, or nested in one.
+
+    Reading copies nothing. The first write in a revision copies the
+    wrapped value, and those it's nested in, so that other revisions
+    keep theirs; later writes in the same revision change the copy in
+    place. ``owned`` holds the values that the present revision has
+    copied already, keyed by id.
+
+    """
+    __slots__ = ()
 
-    def __init__(self, outer, key, initval):
+    def __init__(self, outer, key, initval, owned=None):
+        if not isinstance(initval, self._wraps):
+            raise TypeError(
+                "{} only wraps {}".format(
+                    type(self).__name__, self._wraps.__name__
+                )
+            )
         self._outer = outer
         self._key = key
-        self._inner = JSONWrapper(outer, key)
         self._v = initval
-        if not isinstance(self._v, dict):
-            raise TypeError(
-                "JSONReWrapper only wraps dicts"
-            )
-
-    def _get(self, k=None):
-        if k is None:
-            return self._v
-        return self._v[k]
+        self._owned = {} if owned is None else owned
+        self._kids = None
 
-    def __iter__(self):
-        return iter(self._v)
+    def _wrap(self, k, r):
+        """Return ``r``, my item ``k``, wrapped if it's a list or a dict.
 
-    def __len__(self):
-        return len(self._v)
+        Reuse the wrapper I made for it last time, if it's still
+        around ``r``.
 
-    def __eq__(self, other):
-        return self._v == other
+        """
+        if not isinstance(r, (list, dict)) or isinstance(k, slice):
+            return r
+        kids = self._kids
+        if kids is None:
+            kids = self._kids = {}
+        kid = kids.get(k)
+        if kid is None or kid._v is not r:
+            cls = JSONReWrapper if isinstance(r, dict) else JSONListReWrapper
+            kid = kids[k] = cls(self, k, r, self._owned)
+        return kid
+
+    def _writable(self):
+        """Return my value, first copying it, if this revision hasn't
+        already, and putting the copy in my outer value's place.
+
+        """
+        v = self._v
+        if id(v) in self._owned:
+            return v
+        v = self._v = v.copy()
+        self._owned[id(v)] = v
+        if isinstance(self._outer, CopyOnWrite):
+            self._outer._writable()[self._key] = v
+        return v
+
+    def _touch(self):
+        """Store my outermost value again, now that it's changed"""
+        if isinstance(self._outer, CopyOnWrite):
+            self._outer._touch()
+        else:
+            self._outer[self._key] = self._v
 
     def __getitem__(self, k):
-        r = self._v[k]
-        if isinstance(r, dict):
-            return JSONReWrapper(self, k, r)
-        if isinstance(r, list):
-            return JSONListReWrapper(self, k, r)
-        return r
+        return self._wrap(k, self._v[k])
 
     def __setitem__(self, k, v):
-        self._v[k] = v
-        self._outer[self._key] = self._v
+        self._writable()[k] = v
+        self._touch()
 
     def __delitem__(self, k):
-        del self._inner[k]
-        del self._v[k]
-
-    def __repr__(self):
-        return repr(self._v)
-
-
-class JSONListReWrapper(MutableSequence):
-    """Like JSONListWrapper with a cache."""
-    __slots__ = ['_inner', '_v']
-
-    def __init__(self, outer, key, initval=None):
-        self._inner = JSONListWrapper(outer, key)
-        self._v = initval
-        if not isinstance(self._v, list):
-            raise TypeError(
-                "JSONListReWrapper only wraps lists"
-            )
+        del self._writable()[k]
+        self._touch()
 
     def __iter__(self):
         return iter(self._v)
@@ -215,40 +302,41 @@ class JSONListReWrapper(MutableSequence):
     def __len__(self):
         return len(self._v)
 
+    def __contains__(self, item):
+        return item in self._v
+
     def __eq__(self, other):
+        if isinstance(other, CopyOnWrite):
+            other = other._v
         return self._v == other
 
-    def __getitem__(self, i):
-        r = self._v[i]
-        if isinstance(r, dict):
-            return JSONReWrapper(self, i, r)
-        if isinstance(r, list):
-            return JSONListReWrapper(self, i, r)
-        return r
+    def __repr__(self):
+        return repr(self._v)
 
-    def __setitem__(self, i, v):
-        self._inner[i] = v
-        self._v[i] = v
+    def copy(self):
+        return self._v.copy()
 
-    def __delitem__(self, i, v):
-        del self._inner[i]
-        del self._v[i]
 
-    def insert(self, i, v):
-        self._inner.insert(i, v)
-        self._v.insert(i, v)
+class JSONReWrapper(CopyOnWrite, MutableMapping):
+    """Copy-on-write wrapper for a dictionary in the cache"""
+    __slots__ = ['_outer', '_key', '_v', '_owned', '_kids']
+    _wraps = dict
 
-    def __repr__(self):
-        return repr(self._v)
+
+class JSONListReWrapper(CopyOnWrite, MutableSequence):
+    """Copy-on-write wrapper for a list in the cache"""
+    __slots__ = ['_outer', '_key', '_v', '_owned', '_kids']
+    _wraps = list
+
+    def insert(self, i, v):
+        self._writable().insert(i, v)
+        self._touch()
 
 
 def json_deepcopy(obj):
     r = {}
     for (k, v) in obj.items():
-        if (
-            isinstance(v, JSONReWrapper) or
-            isinstance(v, JSONListReWrapper)
-        ):
+        if isinstance(v, CopyOnWrite):
             r[k] = deepcopy(v._v)
         else:
             r[k] = deepcopy(v)
@@ -2,8 +2,9 @@ from setuptools import setup
 setup(
     name = "gorm",
     version = "0.10.0",
-    packages = ["gorm"],
+    packages = ["gorm", "gorm.bench"],
     install_requires = ['networkx>=1.9'],
+    python_requires = '>=3.7',
     author = "Zachary Spector",
     author_email = "zacharyspector@gmail.com",
     description = "An object-relational mapper serving database-backed versions of the standard networkx graph classes.",